@@ -8,7 +8,7 @@ from celery.result import AsyncResult
 from django.shortcuts import get_object_or_404
 from rest_framework.exceptions import APIException
 
-from mangaki.tasks import redis_pool
+from mangaki.tasks import GROUP_RECO_TAG, redis_pool
 
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework import serializers
@@ -43,11 +43,16 @@ def task_status(request: Request, task_id: str) -> Response:
     details = r.get('tasks:{task_id}:details'.format(task_id=task_id))
     if details:
         details = details.decode('utf8')
+    details = json.loads(details or '{}')
+    if bg_task.tag == GROUP_RECO_TAG and ('works' in details or 'error' in details):
+        # Group recommendations are polled until they are written, then forgotten
+        bg_task.delete()
+        r.delete('tasks:{task_id}:details'.format(task_id=task_id))
     return Response(
         {
             'id': result.id,
             'status': result.state,
-            'details': json.loads(details or '{}')
+            'details': details
         }
     )
 
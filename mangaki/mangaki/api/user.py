@@ -20,8 +20,6 @@ from mangaki.models import Profile, UserArchive, Rating
 from mangaki.utils.ratings import current_user_ratings, friend_ratings
 from mangaki.utils.viz import get_2d_embeddings
 from mangaki.utils.archive_export import export, UserDataArchiveBuilder
-from mangaki.utils.values import rating_values
-import pandas as pd
 import numpy as np
 
 
@@ -107,33 +105,33 @@ def get_user_and_friends_positions(request: Request, algo_name):
     """
     Compute the position of user and friends on the map
     """
-    rated_works = current_user_ratings(request)
-    df_mine = pd.DataFrame(rated_works.items(), columns=('work_id', 'choice'))
-    df_mine['user_id'] = request.user.id if not request.user.is_anonymous else -1
-    df_item_pos = pd.DataFrame(
-        get_2d_embeddings(algo_name)['works']).set_index('work_id')
-    available_works = df_item_pos.index
-
+    my_id = request.user.id if not request.user.is_anonymous else -1
+    favorites = [(my_id, work_id)
+                 for work_id, choice in current_user_ratings(request).items()
+                 if choice == 'favorite']
     if not request.user.is_anonymous:
-        ratings = friend_ratings(request)
-        df = pd.DataFrame(ratings, columns=('user_id', 'work_id', 'choice'))
-        df_all = pd.concat((df_mine, df), axis=0)
-    else:
-        df_all = df_mine
-
+        favorites.extend((user_id, work_id) for user_id, work_id, _
+                         in friend_ratings(request).filter(choice='favorite'))
+    favorites = np.array(favorites, dtype=np.int64).reshape(-1, 2)
+
+    # Each user is at the centroid of their favorite works on the map
+    positions, is_known = get_2d_embeddings(algo_name).get_positions(favorites[:, 1])
+    user_ids, first_index, user_indices = np.unique(
+        favorites[is_known, 0], return_index=True, return_inverse=True)
+    counts = np.bincount(user_indices, minlength=len(user_ids))
+    centroids = np.column_stack([
+        np.bincount(user_indices, weights=positions[is_known, axis],
+                    minlength=len(user_ids)) / counts
+        for axis in range(2)]).reshape(-1, 2)
+
+    users = User.objects.in_bulk(user_ids.tolist())  # Get usernames for display
     user_points = []
-    user_ids = df_all['user_id'].unique().tolist()
-    users = User.objects.in_bulk(user_ids)  # Get usernames for display
-    df_all['rating'] = df_all['choice'].map(rating_values)
-    for user_id in user_ids:
-        this_user = df_all.query(
-            'user_id == @user_id and choice == "favorite" and '
-            'work_id in @available_works')
-        if len(this_user):
-            x, y = df_item_pos.loc[this_user['work_id'], ["x", "y"]].mean(axis=0)
-            user_points.append({
-                'title': f'{users[user_id].username}'
-                         if user_id != -1 else 'yourself',
-                'x': x, 'y': y})
+    for position in np.argsort(first_index, kind='stable').tolist():  # Myself first
+        user_id = int(user_ids[position])
+        x, y = centroids[position].tolist()
+        user_points.append({
+            'title': f'{users[user_id].username}'
+                     if user_id != -1 else 'yourself',
+            'x': x, 'y': y})
 
     return Response(user_points)
@@ -4,7 +4,7 @@
 from django import forms
 from django.utils.translation import gettext_lazy as _
 from mangaki.models import Suggestion, Rating, Profile
-from mangaki.utils.ratings import get_anonymous_ratings, clear_anonymous_ratings
+from mangaki.utils.ratings import get_anonymous_ratings, clear_anonymous_ratings, ratings_changed
 from mangaki.choices import SUGGESTION_PROBLEM_CHOICES
 
 
@@ -39,6 +39,7 @@ class SignupForm(forms.Form):
                 Rating(user=user, work_id=work_id, choice=choice)
                 for work_id, choice in ratings.items()
             ])
+            ratings_changed([user.id])
 
         Profile.objects.filter(id=user.profile.pk).update(
             newsletter_ok=self.cleaned_data['newsletter_ok'],
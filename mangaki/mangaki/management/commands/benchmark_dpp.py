@@ -0,0 +1,73 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from mangaki.utils.dpp import MangakiDPP
+from mangaki.utils.dpplib import esym_poly, sample_k
+
+
+def esym_poly_loop(k, lam):
+    """
+    The former implementation of `esym_poly`, one Python operation per entry.
+    """
+    N = lam.size
+    E = np.zeros((k + 1, N + 1))
+    E[0, :] = 1
+    for l in range(1, k + 1):
+        for n in range(1, N + 1):
+            E[l, n] = E[l, n - 1] + lam[n - 1] * E[l - 1, n - 1]
+    return E
+
+
+def time_per_call(function, nb_repeats):
+    start = time.perf_counter()
+    for _ in range(nb_repeats):
+        function()
+    return 1000 * (time.perf_counter() - start) / nb_repeats
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Time the sampling of diverse works by the DPP on random item vectors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nb_works', type=int, default=200)
+        parser.add_argument('--nb_components', type=int, default=20)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--nb_repeats', type=int, default=20)
+        parser.add_argument('--no_primal', dest='primal', action='store_false', default=True,
+                            help='Skip the N x N decomposition, e.g. for large pools')
+
+    def handle(self, *args, **options):
+        nb_works = options['nb_works']
+        k = options['k']
+        nb_repeats = options['nb_repeats']
+        vectors = np.random.RandomState(0).randn(nb_works, options['nb_components'])
+        dpp = MangakiDPP(np.arange(nb_works), vectors)
+
+        def sample_primal():
+            """
+            The former sampler, which decomposes the N x N kernel.
+            """
+            D, V = np.linalg.eig(vectors.dot(vectors.T))
+            return sample_k(k, np.real(D), np.real(V))
+
+        primal_ms = time_per_call(sample_primal, nb_repeats) if options['primal'] else None
+        preprocess_ms = time_per_call(dpp.preprocess, nb_repeats)
+        lam = dpp.D
+        loop_ms = time_per_call(lambda: esym_poly_loop(k, lam), nb_repeats)
+        vectorized_ms = time_per_call(lambda: esym_poly(k, lam), nb_repeats)
+        sample_ms = time_per_call(lambda: dpp.sample_k(k), nb_repeats)
+
+        self.stdout.write('%d works, %d components, k = %d' % (
+            nb_works, options['nb_components'], k))
+        if primal_ms is not None:
+            self.stdout.write('primal eig + sample_k: %.3f ms' % primal_ms)
+        self.stdout.write('dual preprocess:       %.3f ms' % preprocess_ms)
+        self.stdout.write('esym_poly (loop):      %.3f ms' % loop_ms)
+        self.stdout.write('esym_poly:             %.3f ms' % vectorized_ms)
+        self.stdout.write(self.style.SUCCESS('dual sample_k:         %.3f ms' % sample_ms))
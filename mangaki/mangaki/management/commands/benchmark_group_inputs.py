@@ -0,0 +1,113 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from mangaki.utils.recommendations import (get_group_ratings, get_interesting_mask,
+                                           get_work_ids)
+from mangaki.utils.values import rating_values
+
+
+class SyntheticDataset:
+    def __init__(self, nb_works, seed=0):
+        rng = np.random.RandomState(seed)
+        work_ids = rng.choice(10 * nb_works, nb_works, replace=False).tolist()
+        self.decode_work = dict(enumerate(work_ids))
+        self.encode_work = {work_id: encoded_work_id
+                            for encoded_work_id, work_id in enumerate(work_ids)}
+        self.interesting_works = set(work_ids[:int(0.8 * nb_works)])
+
+
+class SyntheticAlgo:
+    def __init__(self, nb_works):
+        self.dataset = SyntheticDataset(nb_works)
+
+
+def make_group(algo, nb_users, nb_ratings, seed=0):
+    """
+    Ratings of a group as given to `get_group_reco_algo`: a dict for myself
+    and triplets for the others, some of them about unknown works.
+    """
+    rng = np.random.RandomState(seed)
+    all_work_ids = np.array(list(algo.dataset.encode_work) + [-1, -2, -3])
+    choices = np.array(list(rating_values))
+    my_ratings = dict(zip(rng.choice(all_work_ids, nb_ratings, replace=False).tolist(),
+                          rng.choice(choices, nb_ratings).tolist()))
+    triplets = []
+    for user_id in range(1, nb_users):
+        work_ids = rng.choice(all_work_ids, nb_ratings, replace=False).tolist()
+        triplets.extend(zip([user_id] * nb_ratings, work_ids,
+                            rng.choice(choices, nb_ratings).tolist()))
+    return my_ratings, triplets
+
+
+def build_inputs_pandas(algo, my_ratings, triplets, merge_type):
+    """
+    How `get_group_reco_algo` used to build its inputs with DataFrames.
+    """
+    available_works = set(algo.dataset.encode_work.keys())
+    df_mine = pd.DataFrame(my_ratings.items(), columns=('work_id', 'choice')).query(
+        'work_id in @available_works')
+    df_mine['encoded_work_id'] = df_mine['work_id'].map(algo.dataset.encode_work)
+    df_mine['rating'] = df_mine['choice'].map(rating_values)
+    df = pd.DataFrame(triplets, columns=['user_id', 'work_id', 'choice']).query(
+        'work_id in @available_works')
+    df['encoded_work_id'] = df['work_id'].map(algo.dataset.encode_work)
+    df['rating'] = df['choice'].map(rating_values)
+    participating_other_ids = df['user_id'].unique().tolist()
+
+    merge_function = set.union if merge_type == 'union' else set.intersection
+    sets_of_rated_works = [set(df_mine['work_id'])]
+    if merge_type != 'mine':
+        for user_id in participating_other_ids:
+            sets_of_rated_works.append(set(
+                df.query('user_id == @user_id')['work_id'].tolist()))
+    already_rated_works = list(merge_function(*sets_of_rated_works))
+    filtered_works = list(set(algo.dataset.interesting_works) - set(already_rated_works))
+    encoded_work_ids = [algo.dataset.encode_work[work_id] for work_id in filtered_works]
+    others = []
+    for user_id in participating_other_ids:
+        user_ratings = df.query('user_id == @user_id')
+        others.append((user_ratings['encoded_work_id'], user_ratings['rating']))
+    return filtered_works, encoded_work_ids, others
+
+
+def build_inputs_numpy(algo, my_ratings, triplets, merge_type):
+    group = get_group_ratings(algo, my_ratings, triplets, merge_type)
+    encoded_work_ids = np.flatnonzero(get_interesting_mask(algo) & ~group.is_rated)
+    return get_work_ids(algo)[encoded_work_ids], encoded_work_ids, group
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Compare the pandas and NumPy pipelines building group recommendation inputs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nb_users', type=int, default=50)
+        parser.add_argument('--nb_works', type=int, default=20000)
+        parser.add_argument('--nb_ratings', type=int, default=300,
+                            help='Number of ratings per user')
+        parser.add_argument('--nb_repeats', type=int, default=10)
+
+    def handle(self, *args, **options):
+        algo = SyntheticAlgo(options['nb_works'])
+        my_ratings, triplets = make_group(algo, options['nb_users'], options['nb_ratings'])
+
+        for merge_type in ['intersection', 'union', 'mine']:
+            timings = {}
+            results = {}
+            for name, build_inputs in [('pandas', build_inputs_pandas),
+                                       ('numpy', build_inputs_numpy)]:
+                start = time.perf_counter()
+                for _ in range(options['nb_repeats']):
+                    results[name] = build_inputs(algo, my_ratings, triplets, merge_type)
+                timings[name] = (time.perf_counter() - start) / options['nb_repeats']
+            if set(results['pandas'][0]) != set(results['numpy'][0].tolist()):
+                self.stderr.write('Both pipelines disagree on the candidate works!')
+            self.stdout.write('%-12s pandas %7.1f ms, numpy %6.1f ms (%d candidates)' % (
+                merge_type, 1000 * timings['pandas'], 1000 * timings['numpy'],
+                len(results['numpy'][0])))
@@ -0,0 +1,82 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from mangaki.utils.fit_algo import get_embeddings
+from mangaki.utils.item_index import InvertedFileIndex
+from mangaki.utils.recommendations import (NB_ANN_CANDIDATES, NB_RECO,
+                                           get_top_positions)
+
+
+def make_synthetic_embeddings(nb_works, nb_users, nb_components, seed=0):
+    """
+    Item and user vectors drawn around a few topics, with popularity-like
+    differences of norm between items.
+    """
+    rng = np.random.RandomState(seed)
+    topics = rng.randn(50, nb_components)
+    item_vectors = (topics[rng.randint(len(topics), size=nb_works)] +
+                    0.5 * rng.randn(nb_works, nb_components))
+    item_vectors *= rng.lognormal(sigma=0.3, size=(nb_works, 1))
+    user_vectors = (topics[rng.randint(len(topics), size=nb_users)] +
+                    rng.randn(nb_users, nb_components))
+    return item_vectors.astype(np.float32), user_vectors.astype(np.float32)
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Compare the recall and latency of the item index to brute force'
+
+    def add_arguments(self, parser):
+        parser.add_argument('algo_name', type=str, nargs='?', default='als')
+        parser.add_argument('--synthetic', type=int, default=None,
+                            help='Use this many random works instead of a snapshot')
+        parser.add_argument('--nb_queries', type=int, default=200)
+        parser.add_argument('--nb_candidates', type=int, default=NB_ANN_CANDIDATES)
+        parser.add_argument('--nb_probes', type=int, default=None)
+
+    def handle(self, *args, **options):
+        nb_queries = options['nb_queries']
+        if options['synthetic']:
+            item_vectors, queries = make_synthetic_embeddings(
+                options['synthetic'], nb_queries, 20)
+        else:
+            embeddings = get_embeddings(options['algo_name'])
+            item_vectors = np.asarray(embeddings.item_vectors)
+            queries = np.asarray(embeddings.user_vectors)[np.random.choice(
+                len(embeddings.user_vectors), nb_queries)]
+        work_ids = np.arange(len(item_vectors))
+
+        start = time.perf_counter()
+        index = InvertedFileIndex.build(item_vectors, work_ids)
+        self.stdout.write('Built %d clusters over %d works in %.2f s' % (
+            index.nb_clusters, len(work_ids), time.perf_counter() - start))
+
+        exact_time = 0.
+        approximate_time = 0.
+        nb_found = 0
+        nb_scored = 0
+        for query in queries:
+            start = time.perf_counter()
+            expected = get_top_positions(item_vectors @ query, NB_RECO)
+            exact_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            candidates = index.search(query, options['nb_candidates'],
+                                      nb_probes=options['nb_probes'])
+            best = candidates[get_top_positions(item_vectors[candidates] @ query,
+                                                NB_RECO)]
+            approximate_time += time.perf_counter() - start
+
+            nb_found += len(set(expected.tolist()) & set(best.tolist()))
+            nb_scored += len(candidates)
+
+        self.stdout.write('Exact:  %.3f ms per query' % (1000 * exact_time / nb_queries))
+        self.stdout.write('Index:  %.3f ms per query, %d works scored on average' % (
+            1000 * approximate_time / nb_queries, nb_scored // nb_queries))
+        self.stdout.write(self.style.SUCCESS('Recall@%d: %.3f' % (
+            NB_RECO, nb_found / (NB_RECO * nb_queries))))
@@ -0,0 +1,223 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import json
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from mangaki.models import Category, Rating, Work
+from mangaki.utils.chrono import latency_recorder
+from mangaki.utils.dpp import MangakiDPP
+from mangaki.utils.fit_algo import fit_algo
+from mangaki.utils.fold_in import fold_in_cache
+from mangaki.utils.recommendations import (get_group_reco, get_personalized_ranking,
+                                           get_work_ids)
+from mangaki.utils.values import rating_values
+
+BATCH_SIZE = 10000
+CHOICES = ['favorite', 'like', 'neutral', 'dislike', 'willsee', 'wontsee']
+CHOICE_PROBABILITIES = [0.1, 0.4, 0.15, 0.15, 0.1, 0.1]
+NB_ANONYMOUS_RATINGS = 30
+NB_DPP_WORKS = 200
+
+
+def generate_ratings(nb_users, nb_works, nb_ratings, seed=0):
+    """
+    Distinct (user, work, choice) triplets over encoded users and works: a few
+    works get most ratings and users have lognormal activities.
+    """
+    rng = np.random.RandomState(seed)
+    work_popularity = 1 / (np.arange(nb_works) + 10) ** 0.8
+    user_activity = rng.lognormal(sigma=1., size=nb_users)
+    # Draw more pairs than needed, as duplicates are dropped
+    nb_draws = int(1.2 * nb_ratings) + 100
+    users = rng.choice(nb_users, nb_draws, p=user_activity / user_activity.sum())
+    works = rng.choice(nb_works, nb_draws, p=work_popularity / work_popularity.sum())
+    _, first = np.unique(users.astype(np.int64) * nb_works + works, return_index=True)
+    first = rng.permutation(first)[:nb_ratings]
+    choices = rng.choice(len(CHOICES), len(first), p=CHOICE_PROBABILITIES)
+    return users[first], works[first], np.array(CHOICES)[choices]
+
+
+def summarize(durations):
+    durations = 1000 * np.array(durations)
+    return {'median_ms': float(np.median(durations)),
+            'min_ms': float(durations.min()),
+            'max_ms': float(durations.max())}
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Time the recommendation serving path on synthetic users, works and '
+            'ratings, in a throwaway test database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nb_ratings', type=int, default=10000)
+        parser.add_argument('--nb_users', type=int, default=None,
+                            help='By default, one user per 50 ratings')
+        parser.add_argument('--nb_works', type=int, default=None,
+                            help='By default, one work per 20 ratings')
+        parser.add_argument('--algos', nargs='+', default=['svd', 'als'])
+        parser.add_argument('--group_size', type=int, default=4)
+        parser.add_argument('--nb_repeats', type=int, default=5)
+        parser.add_argument('--nb_dpp', type=int, default=10,
+                            help='Number of works sampled by the DPP')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', type=str, default=None,
+                            help='Write the JSON results to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as snapshot_root, \
+                    override_settings(ML_SNAPSHOT_ROOT=snapshot_root,
+                                      VIZ_ROOT=snapshot_root):
+                results = self.run_benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stdout.write(self.style.SUCCESS(
+                'Results written to {}'.format(options['output'])))
+        else:
+            self.stdout.write(output)
+
+    def populate(self, nb_users, nb_works, nb_ratings, group_size, seed):
+        categories = list(Category.objects.filter(slug__in=['anime', 'manga']))
+        works = Work.objects.bulk_create([
+            Work(title='Work {}'.format(i), category=categories[i % len(categories)])
+            for i in range(nb_works)], batch_size=BATCH_SIZE)
+        # The group needs profiles, hence the signals of create_user
+        group = [User.objects.create_user(username='member{}'.format(i))
+                 for i in range(group_size)]
+        users = group + User.objects.bulk_create([
+            User(username='user{}'.format(i))
+            for i in range(nb_users - group_size)], batch_size=BATCH_SIZE)
+        for member in group[1:]:
+            group[0].profile.friends.add(member)
+            member.profile.friends.add(group[0])
+
+        user_ids = np.array([user.id for user in users])
+        work_ids = np.array([work.id for work in works])
+        encoded_users, encoded_works, choices = generate_ratings(
+            nb_users, nb_works, nb_ratings, seed)
+        triplets = list(zip(user_ids[encoded_users].tolist(),
+                            work_ids[encoded_works].tolist(), choices.tolist()))
+        for start in range(0, len(triplets), BATCH_SIZE):
+            Rating.objects.bulk_create([
+                Rating(user_id=user_id, work_id=work_id, choice=choice)
+                for user_id, work_id, choice in triplets[start:start + BATCH_SIZE]])
+        call_command('ranking')  # Popularity, used by the DPP
+        return group, triplets
+
+    def time(self, function, nb_repeats):
+        """
+        Durations of `function()` without any cached results, and once cached.
+        """
+        durations = []
+        for _ in range(nb_repeats):
+            cache.clear()
+            fold_in_cache.clear()
+            start = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        function()
+        return dict(summarize(durations),
+                    cached_ms=1000 * (time.perf_counter() - start))
+
+    def run_benchmark(self, options):
+        nb_ratings = options['nb_ratings']
+        nb_users = options['nb_users'] or max(nb_ratings // 50, options['group_size'])
+        nb_works = options['nb_works'] or max(nb_ratings // 20, NB_DPP_WORKS)
+        nb_repeats = options['nb_repeats']
+        rng = np.random.RandomState(options['seed'])
+        latency_recorder.clear()
+
+        start = time.perf_counter()
+        group, triplets = self.populate(nb_users, nb_works, nb_ratings,
+                                        options['group_size'], options['seed'])
+        results = {
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'database': connection.vendor,
+            'parameters': {'nb_ratings': len(triplets), 'nb_users': nb_users,
+                           'nb_works': nb_works, 'group_size': len(group),
+                           'nb_repeats': nb_repeats, 'seed': options['seed']},
+            'populate_s': time.perf_counter() - start,
+            'fit_s': {},
+            'timings': {},
+        }
+        self.stderr.write('Populated {} ratings in {:.1f} s'.format(
+            len(triplets), results['populate_s']))
+
+        me = group[0]
+        friend_ids = [member.id for member in group[1:]]
+        my_ratings = dict(me.rating_set.values_list('work_id', 'choice'))
+        anonymous_ratings = dict(list(my_ratings.items())[:NB_ANONYMOUS_RATINGS])
+        for algo_name in options['algos']:
+            start = time.perf_counter()
+            algo = fit_algo(algo_name, triplets)
+            results['fit_s'][algo_name] = time.perf_counter() - start
+            self.stderr.write('Fitted {} in {:.1f} s'.format(
+                algo_name, results['fit_s'][algo_name]))
+
+            work_ids = get_work_ids(algo)
+            ranked_work_ids = rng.choice(work_ids, min(1000, len(work_ids)),
+                                         replace=False)
+            encoded_rated = [algo.dataset.encode_work[work_id] for work_id in my_ratings
+                             if work_id in algo.dataset.encode_work]
+            rated_values = [rating_values[my_ratings[algo.dataset.decode_work[encoded]]]
+                            for encoded in encoded_rated]
+            cases = {
+                'solo': lambda: get_group_reco(me, [], algo_name),
+                'group_union': lambda: get_group_reco(me, friend_ids, algo_name,
+                                                      merge_type='union'),
+                'group_intersection': lambda: get_group_reco(
+                    me, friend_ids, algo_name, merge_type='intersection'),
+                'anonymous': lambda: get_group_reco(
+                    AnonymousUser(), None, algo_name, anonymous_ratings=anonymous_ratings),
+                'personalized_ranking': lambda: get_personalized_ranking(
+                    algo, me.id, ranked_work_ids, encoded_rated, rated_values),
+            }
+            results['timings'][algo_name] = {
+                case: self.time(function, nb_repeats) for case, function in cases.items()}
+
+        if 'svd' in options['algos']:
+            popular_work_ids = list(Work.objects.popular()[:NB_DPP_WORKS]
+                                    .values_list('id', flat=True))
+            dpp = MangakiDPP(popular_work_ids)
+            results['timings']['dpp'] = {
+                'load': self.time(lambda: dpp.load_from_algo('svd'), nb_repeats),
+                'sample_k': self.time(lambda: dpp.sample_k(options['nb_dpp']), nb_repeats),
+            }
+
+        results['stages'] = [
+            {'stage': stage, 'labels': labels, 'count': count,
+             'quantiles_ms': {str(quantile): 1000 * seconds
+                              for quantile, seconds in quantiles.items()}}
+            for stage, labels, quantiles, count, _ in latency_recorder.summary()]
+        return results
@@ -0,0 +1,83 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import json
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from mangaki.models import Rating
+from mangaki.utils.evaluation import evaluate_fold, slice_ratings, time_split
+from mangaki.utils.ratings import load_rating_arrays
+
+AVERAGED_METRICS = ['coverage', 'rmse', 'precision@k', 'ndcg@k', 'index_precision@k',
+                    'index_ndcg@k', 'fit_s', 'predictions_per_s', 'snapshot_bytes']
+
+
+def evaluate_seeded_fold(seed, *args, **kwargs):
+    np.random.seed(seed)  # The encoding of the dataset is random
+    return evaluate_fold(*args, **kwargs)
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Evaluate recommendation algorithms on the future ratings: each fold trains on '
+            'the ratings before a date and tests on the following ones')
+
+    def add_arguments(self, parser):
+        parser.add_argument('algo_names', type=str, nargs='+')
+        parser.add_argument('--nb_folds', type=int, default=3)
+        parser.add_argument('--k', type=int, default=10,
+                            help='Length of the rankings for precision@k and NDCG@k')
+        parser.add_argument('--nb_candidates', type=int, default=None,
+                            help='Also rank the candidates of the item index of this size')
+        parser.add_argument('--jobs', type=int, default=None,
+                            help='Number of processes (by default, one per fold and algorithm)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', type=str, default=None,
+                            help='Write the JSON results to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        algo_names = options['algo_names']
+        rating_arrays = load_rating_arrays(Rating.objects.order_by('date', 'id'))
+        folds = time_split(len(rating_arrays), options['nb_folds'])
+
+        jobs = [(algo_name, fold) for fold in range(len(folds)) for algo_name in algo_names]
+        # Forked workers do not use the database connections of this process
+        with ProcessPoolExecutor(options['jobs'] or len(jobs),
+                                 mp_context=multiprocessing.get_context('fork')) as executor:
+            futures = [executor.submit(evaluate_seeded_fold, options['seed'] + fold, algo_name,
+                                       slice_ratings(rating_arrays, folds[fold][0]),
+                                       slice_ratings(rating_arrays, folds[fold][1]),
+                                       k=options['k'], nb_candidates=options['nb_candidates'])
+                       for algo_name, fold in jobs]
+            results = [dict(future.result(), fold=fold)
+                       for (_, fold), future in zip(jobs, futures)]
+
+        by_algo = defaultdict(list)
+        for result in results:
+            by_algo[result['algo']].append(result)
+        summary = {}
+        for algo_name, algo_results in by_algo.items():
+            summary[algo_name] = {
+                metric: float(np.mean([result[metric] for result in algo_results]))
+                for metric in AVERAGED_METRICS
+                if all(result.get(metric) is not None for result in algo_results)}
+            self.stderr.write('{}: {}'.format(algo_name, ', '.join(
+                '{} {:.4g}'.format(metric, value) for metric, value in summary[algo_name].items())))
+
+        output = json.dumps({'parameters': {'nb_ratings': len(rating_arrays),
+                                            'nb_folds': len(folds), 'k': options['k'],
+                                            'nb_candidates': options['nb_candidates'],
+                                            'seed': options['seed']},
+                             'summary': summary, 'folds': results}, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stdout.write(self.style.SUCCESS(
+                'Results written to {}'.format(options['output'])))
+        else:
+            self.stdout.write(output)
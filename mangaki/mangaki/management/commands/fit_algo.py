@@ -1,10 +1,14 @@
 # SPDX-FileCopyrightText: 2014, Mangaki Authors
 # SPDX-License-Identifier: AGPL-3.0-only
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from mangaki.models import Rating, Work
-from mangaki.utils.fit_algo import fit_algo, get_algo_backup, dump_2d_embeddings
+from mangaki.models import Work
+from mangaki.tasks import materialize_recommendations, redis_pool
+from mangaki.utils.embeddings import EmbeddingSnapshot
+from mangaki.utils.fit_algo import fit_algo, get_embeddings, dump_2d_embeddings
+from mangaki.utils.incremental import NB_INCREMENTAL_SWEEPS, fit_algo_incremental
+from mangaki.utils.ratings import load_training_ratings
 
 
 class Command(BaseCommand):
@@ -15,13 +19,22 @@ class Command(BaseCommand):
         parser.add_argument('algo_name', type=str)
         parser.add_argument('--csv', dest='output_csv', action='store_true', default=False)
         parser.add_argument('--viz_only', dest='viz_only', action='store_true', default=False)
+        parser.add_argument('--relayout', action='store_true', default=False,
+                            help='Lay out the whole map again with t-SNE, instead of keeping '
+                                 'the previous positions of the works')
+        parser.add_argument('--no_precompute', dest='precompute', action='store_false', default=True,
+                            help='Do not precompute the recommendations of every user')
+        parser.add_argument('--incremental', action='store_true', default=False,
+                            help='Start from the latest snapshot and only fit the users and works '
+                                 'whose ratings changed since (ALS only)')
+        parser.add_argument('--nb_sweeps', type=int, default=NB_INCREMENTAL_SWEEPS,
+                            help='Number of alternate sweeps of an incremental fit')
 
     def handle(self, *args, **options):
         algo_name = options.get('algo_name')
         output_csv = options.get('output_csv')
         viz_only = options.get('viz_only')
 
-        triplets = Rating.objects.values_list('user_id', 'work_id', 'choice')
         titles = None
         categories = None
         if output_csv:
@@ -30,9 +43,26 @@ class Command(BaseCommand):
             categories = {work_id: cat_id for work_id, _, cat_id in meta_triplets}
 
         if not viz_only:
-            algo = fit_algo(algo_name, triplets, titles=titles, categories=categories, output_csv=output_csv)
+            algo = None
+            if options.get('incremental'):
+                try:
+                    algo = fit_algo_incremental(algo_name, options.get('nb_sweeps'), output_csv=output_csv)
+                except FileNotFoundError:
+                    self.stdout.write('No snapshot of %s yet, fitting it from scratch' % algo_name)
+                except ValueError as e:
+                    raise CommandError(str(e))
+            if algo is None:
+                algo = fit_algo(algo_name, load_training_ratings(), titles=titles, categories=categories,
+                                output_csv=output_csv)
             self.stdout.write(self.style.SUCCESS('Successfully fit %s (%.1f MB)' % (algo_name, algo.size / 1e6)))
-        else:
-            algo = get_algo_backup(algo_name)
-            dump_2d_embeddings(algo, f'points-{algo_name}.json')
+            if options.get('precompute') and algo.is_serializable and EmbeddingSnapshot.is_supported(algo):
+                if redis_pool:
+                    materialize_recommendations.delay(algo_name)
+                    self.stdout.write('Scheduled the precomputation of %s recommendations' % algo_name)
+                else:  # No Celery broker available
+                    materialize_recommendations(algo_name)
+                    self.stdout.write(self.style.SUCCESS('Successfully precomputed %s recommendations' % algo_name))
+        if viz_only or options.get('relayout'):
+            dump_2d_embeddings(get_embeddings(algo_name), f'points-{algo_name}.json',
+                               relayout=options.get('relayout'))
             self.stdout.write(self.style.SUCCESS('Successfully update viz %s' % (algo_name)))
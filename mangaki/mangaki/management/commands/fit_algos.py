@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from zero.dataset import AnonymizedData
+
+from mangaki.tasks import materialize_recommendations, redis_pool
+from mangaki.utils.embeddings import EmbeddingSnapshot
+from mangaki.utils.fit_algo import dump_2d_embeddings, fit_encoded_algo, get_embeddings, make_dataset
+from mangaki.utils.ratings import load_training_ratings
+
+_attached_blocks = []
+
+
+def share_array(array):
+    """
+    Copy an array into a new shared memory block. Returns the block, to be
+    unlinked by the caller, and what `attach_array` needs to read it.
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec):
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    # Fitted algorithms may keep views on the block: keep it open until the
+    # worker exits
+    _attached_blocks.append(block)
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def fit_shared_algo(algo_name, dataset, X_spec, y_spec, nb_users, nb_works):
+    """
+    Fit an algorithm in a worker process, on ratings encoded once by the
+    parent and read from shared memory. The visualization needs the database,
+    so it is left to the parent.
+    """
+    start = time.perf_counter()
+    dataset.anonymized = AnonymizedData(X=attach_array(X_spec), y=attach_array(y_spec),
+                                        y_text=None, nb_users=nb_users, nb_works=nb_works)
+    algo = fit_encoded_algo(algo_name, dataset, dump_viz=False)
+    supports_embeddings = algo.is_serializable and EmbeddingSnapshot.is_supported(algo)
+    return algo.size, supports_embeddings, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Train several recommendation algorithms at once, loading the ratings once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('algo_names', type=str, nargs='+')
+        parser.add_argument('--jobs', type=int, default=None,
+                            help='Number of processes (by default, one per algorithm)')
+        parser.add_argument('--no_precompute', dest='precompute', action='store_false', default=True,
+                            help='Do not precompute the recommendations of every user')
+
+    def handle(self, *args, **options):
+        algo_names = options['algo_names']
+
+        start = time.perf_counter()
+        dataset = make_dataset(load_training_ratings())
+        anonymized = dataset.anonymized
+        dataset.anonymized = None  # Shared separately, not pickled for each worker
+        self.stdout.write('Loaded and encoded %d ratings in %.1f s' % (
+            len(anonymized.y), time.perf_counter() - start))
+
+        X_block, X_spec = share_array(anonymized.X)
+        y_block, y_spec = share_array(anonymized.y)
+        del anonymized
+        fitted = []
+        try:
+            # Forked workers inherit the configured Django project; they must not
+            # use the database connections of this process
+            with ProcessPoolExecutor(options['jobs'] or len(algo_names),
+                                     mp_context=multiprocessing.get_context('fork')) as executor:
+                futures = {executor.submit(fit_shared_algo, algo_name, dataset, X_spec, y_spec,
+                                           len(dataset.encode_user), len(dataset.encode_work)): algo_name
+                           for algo_name in algo_names}
+                for future in as_completed(futures):
+                    algo_name = futures[future]
+                    size, supports_embeddings, duration = future.result()
+                    self.stdout.write(self.style.SUCCESS('Successfully fit %s (%.1f MB) in %.1f s' % (
+                        algo_name, size / 1e6, duration)))
+                    if supports_embeddings:
+                        fitted.append(algo_name)
+        finally:
+            for block in (X_block, y_block):
+                block.close()
+                block.unlink()
+
+        for algo_name in fitted:
+            if algo_name in {'als', 'svd'}:
+                dump_2d_embeddings(get_embeddings(algo_name), f'points-{algo_name}.json')
+            if options['precompute']:
+                if redis_pool:
+                    materialize_recommendations.delay(algo_name)
+                    self.stdout.write('Scheduled the precomputation of %s recommendations' % algo_name)
+                else:  # No Celery broker available
+                    materialize_recommendations(algo_name)
+                    self.stdout.write(self.style.SUCCESS(
+                        'Successfully precomputed %s recommendations' % algo_name))
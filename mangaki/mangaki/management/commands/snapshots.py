@@ -0,0 +1,43 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from django.core.management.base import BaseCommand, CommandError
+from zero.recommendation_algorithm import RecommendationAlgorithm
+
+from mangaki.utils.snapshots import activate_version, get_current_version, list_versions, read_manifest
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'List the snapshot versions of an algorithm, or roll back to one of them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('algo_name', type=str)
+        parser.add_argument('--activate', type=str, default=None, metavar='VERSION',
+                            help='Make this version current')
+        parser.add_argument('--rollback', action='store_true', default=False,
+                            help='Make the version before the current one current')
+
+    def handle(self, *args, **options):
+        shortname = RecommendationAlgorithm.instantiate_algorithm(options['algo_name']).get_shortname()
+        versions = list_versions(shortname)
+        current = get_current_version(shortname)
+
+        version = options['activate']
+        if options['rollback']:
+            if current not in versions or versions.index(current) == 0:
+                raise CommandError('No version of %s before the current one' % shortname)
+            version = versions[versions.index(current) - 1]
+        if version is not None:
+            try:
+                activate_version(shortname, version)
+            except FileNotFoundError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS('Version %s of %s is now current' % (version, shortname)))
+            return
+
+        for version in versions:
+            manifest = read_manifest(shortname, version)
+            self.stdout.write('%s %s  %s ratings  %s' % (
+                '*' if version == current else ' ', version,
+                manifest.get('nb_ratings'), manifest['created_at']))
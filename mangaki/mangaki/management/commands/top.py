@@ -22,7 +22,7 @@ class Command(BaseCommand):
                            help='Top category to Refresh')
 
     def handle(self, *args, **options):
-        chrono = Chrono(False)
+        chrono = Chrono(False, command='top')
 
         categories = []
         if options.get('category'):
@@ -3,8 +3,7 @@
 
 from django.core.management.base import BaseCommand
 
-from mangaki.utils.fit_algo import get_algo_backup
-from django.conf import settings
+from mangaki.utils.fit_algo import load_algo_backup, save_fitted_algo
 
 
 class Command(BaseCommand):
@@ -16,11 +15,10 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         algo_name = options.get('algo_name')
-        algo = get_algo_backup(algo_name)
+        algo = load_algo_backup(algo_name)
         if algo.M is None:
             algo.unzip()
-            if algo.is_serializable:
-                algo.save(settings.ML_SNAPSHOT_ROOT)
+            save_fitted_algo(algo_name, algo, dump_viz=False)
             self.stdout.write(self.style.SUCCESS('Successfully unzipped %s (%.1f MB)' % (algo_name, algo.size / 1e6)))
         else:
             self.stdout.write(self.style.WARNING('Pickle of %s is already unzipped' % algo_name))
@@ -14,6 +14,7 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.search import SearchVectorField
 from django.contrib.postgres.indexes import GinIndex
 from django.core.files import File
@@ -28,6 +29,7 @@ from mangaki.choices import (ORIGIN_CHOICES, TOP_CATEGORY_CHOICES, TYPE_CHOICES,
                              CLUSTER_CHOICES, RELATION_TYPE_CHOICES, SUGGESTION_PROBLEM_CHOICES)
 from mangaki.utils.ranking import (TOP_MIN_RATINGS, RANDOM_MIN_RATINGS, RANDOM_MAX_DISLIKES, RANDOM_RATIO,
                                    PEARLS_MIN_RATINGS, PEARLS_MAX_RATINGS, PEARLS_MAX_DISLIKE_RATE)
+from mangaki.utils.chrono import Chrono
 from mangaki.utils.dpp import MangakiDPP
 
 
@@ -94,14 +96,18 @@ class WorkQuerySet(models.QuerySet):
         return self.filter(title__mangaki_search=search_text).\
             order_by(SearchSimilarity(F('title'), Value(search_text)).desc())
 
-    def dpp(self, nb_works):
+    def dpp(self, nb_works, nb_candidates=TOP_POPULAR_WORKS_FOR_SAMPLING):
         """
-        sample "nb_points" popular works which are far from each other (using DPP)
+        sample "nb_points" popular works which are far from each other (using DPP),
+        among the "nb_candidates" most popular ones, or all of them if it is None
         """
-        work_ids = self.popular()[:TOP_POPULAR_WORKS_FOR_SAMPLING].values_list('id', flat=True)
+        chrono = Chrono(False, algo='svd')
+        work_ids = self.popular()[:nb_candidates].values_list('id', flat=True)
         dpp = MangakiDPP(work_ids)
         dpp.load_from_algo('svd')
+        chrono.save('dpp load')
         sampled_work_ids = dpp.sample_k(nb_works)
+        chrono.save('dpp sample')
         return self.filter(id__in=sampled_work_ids)
 
     def random(self):
@@ -637,6 +643,25 @@ class Recommendation(models.Model):
         return '%s recommends %s to %s' % (self.user, self.work, self.target_user)
 
 
+class PrecomputedRecommendation(models.Model):
+    """
+    Recommendations of an algorithm for a user, computed offline for all the
+    users of a snapshot right after it was trained.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='precomputed_recommendations')
+    algo_name = models.CharField(max_length=32)
+    category = models.CharField(max_length=10)  # Category slug, or 'all'
+    work_ids = ArrayField(models.IntegerField())  # Best first
+    algo_version = models.CharField(max_length=64)  # Snapshot they were computed with
+    computed_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'algo_name', 'category')
+
+    def __str__(self):
+        return '%s recommendations for %s (%s)' % (self.algo_name, self.user, self.category)
+
+
 class Pairing(models.Model):
     date = models.DateTimeField(auto_now=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
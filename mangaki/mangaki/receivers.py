@@ -2,14 +2,35 @@
 # SPDX-License-Identifier: AGPL-3.0-only
 
 
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
 from django.conf import settings
 
-from mangaki.models import Profile
+from mangaki.models import Profile, Work
+from mangaki.utils.catalogue import bump_works_version, get_catalogue_state
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
+
+
+@receiver(post_init, sender=Work)
+def remember_catalogue_state(sender, instance, **kwargs):
+    instance._catalogue_state = get_catalogue_state(instance)
+
+
+@receiver(post_save, sender=Work)
+def invalidate_catalogue_masks(sender, instance, created, **kwargs):
+    # New works are in no snapshot yet, hence in no mask
+    catalogue_state = get_catalogue_state(instance)
+    if not created and catalogue_state != instance._catalogue_state:
+        transaction.on_commit(bump_works_version)
+    instance._catalogue_state = catalogue_state
+
+
+@receiver(post_delete, sender=Work)
+def invalidate_catalogue_masks_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(bump_works_version)
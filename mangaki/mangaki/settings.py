@@ -241,6 +241,14 @@ CELERY_BROKER_URL = config.get('celery', 'broker_url', fallback='redis://')
 CELERY_RESULT_BACKEND = config.get('celery', 'result_backend', fallback='redis://')
 CELERY_BEAT_SCHEDULER = config.get('celery', 'scheduler', fallback='django_celery_beat.schedulers:DatabaseScheduler')
 
+# Caches the recommendations: use a shared backend to share them between processes
+CACHES = {
+    'default': {
+        'BACKEND': config.get('cache', 'BACKEND', fallback='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config.get('cache', 'LOCATION', fallback=''),
+    }
+}
+
 EMAIL_BACKEND = config.get('email', 'EMAIL_BACKEND', fallback='django.core.mail.backends.smtp.EmailBackend')
 if config.has_section('smtp'):
     EMAIL_HOST = config.get('smtp', 'EMAIL_HOST', fallback='localhost')
@@ -277,6 +285,7 @@ STATIC_ROOT = config.get('deployment', 'STATIC_ROOT', fallback=os.path.join(BASE
 MEDIA_ROOT = config.get('deployment', 'MEDIA_ROOT', fallback=os.path.join(BASE_DIR, 'media'))
 DATA_ROOT = config.get('deployment', 'DATA_ROOT', fallback=os.path.join(BASE_DIR, 'data'))
 ML_SNAPSHOT_ROOT = os.path.join(DATA_ROOT, 'snapshots')  # FIXME: rename PICKLE_DIR to SNAPSHOT_DIR
+ML_SNAPSHOT_RETENTION = config.getint('deployment', 'ML_SNAPSHOT_RETENTION', fallback=3)
 VIZ_ROOT = config.get('deployment', 'VIZ_ROOT', fallback=os.path.join(DATA_ROOT, 'viz'))
 VIZ_URL = config.get('deployment', 'VIZ_URL', fallback='https://mangaki.fr/map')
 
@@ -3,6 +3,7 @@
 
 # Here goes the Celery tasks.
 import json
+import uuid
 
 import redis
 from celery.utils.log import get_task_logger
@@ -10,15 +11,20 @@ from django.db import IntegrityError
 from django.db.models import Count, Q
 
 from mangaki.utils.work_merge import create_work_cluster, merge_work_clusters
+from mangaki.utils import recommendations
 from .workers import app
 from django.contrib.auth.models import User
 from django.conf import settings
 
 from mangaki.models import UserBackgroundTask, Work, WorkCluster
+from mangaki.utils.fit_algo import fit_algo, get_algo_backup
+from mangaki.utils.ratings import load_training_ratings
+from mangaki.utils.snapshots import CorruptSnapshotError
 import mangaki.utils.mal as mal
 import redis_lock
 
 MAL_IMPORT_TAG = 'MAL_IMPORT'
+GROUP_RECO_TAG = 'GROUP_RECO'
 
 logger = get_task_logger(__name__)
 if settings.REDIS_URL:
@@ -39,6 +45,9 @@ def get_current_mal_import(user: User):
 
 # 10 minutes.
 DEFAULT_LOCK_EXPIRATION_TIME = 10*60
+# Group recommendations are polled for, then forgotten.
+GROUP_RECO_DETAILS_EXPIRATION_TIME = 10*60
+FALLBACK_SVD_SCHEDULED_KEY = 'fallback-svd:scheduled'
 
 
 @app.task(name='look_for_workclusters', ignore_result=True)
@@ -114,3 +123,93 @@ def import_mal(self, mal_username: str, mangaki_username: str):
         bg_task.delete()
         r.delete('tasks:{}:details'.format(self.request.id))
         logger.info('[{}] MAL import task recycled and deleted.'.format(user))
+
+
+@app.task(name='materialize_recommendations', ignore_result=True)
+def materialize_recommendations(algo_name: str):
+    """
+    Precompute the solo recommendations of every user of the latest snapshot
+    of `algo_name`. Scheduled by `fit_algo` once the snapshot is written.
+    """
+    logger.info('Precomputing {} recommendations...'.format(algo_name))
+    nb_users = recommendations.materialize_recommendations(algo_name)
+    logger.info('Precomputed {} recommendations for {} users.'
+                .format(algo_name, nb_users))
+
+
+def start_group_reco(user: User, friend_ids, algo_name: str, category: str,
+                     merge_type, nb_reco: int) -> str:
+    """
+    Enqueue `compute_group_reco` for `user`, replacing their previous group
+    recommendation task. Returns the task id, to be polled with `task_status`.
+    """
+    user.background_tasks.filter(tag=GROUP_RECO_TAG).delete()
+    # The task has to be owned before it can be polled, i.e. before it runs
+    task_id = str(uuid.uuid4())
+    UserBackgroundTask.objects.create(owner=user, task_id=task_id, tag=GROUP_RECO_TAG)
+    compute_group_reco.apply_async(
+        (user.id, friend_ids, algo_name, category, merge_type, nb_reco),
+        task_id=task_id)
+    return task_id
+
+
+@app.task(name='compute_group_reco', bind=True)
+def compute_group_reco(self, user_id: int, friend_ids, algo_name: str,
+                       category: str, merge_type, nb_reco: int):
+    """
+    Group recommendations too heavy to be computed within a request. Their
+    serialized works are stored in the details of the task, or an error if
+    they could not be computed: the details are always written, so that
+    polling `task_status` ends (and closes the task, see there).
+    """
+    payload = {'error': 'Group recommendations could not be computed.'}
+    try:
+        user = User.objects.get(id=user_id)
+        data = recommendations.get_group_reco(user, friend_ids, algo_name,
+                                              category, merge_type)
+        payload = {'works': recommendations.serialize_reco_list(user, data, nb_reco)}
+        logger.info('[{}] Group recommendations computed: {}.'.format(user, self.request.id))
+    finally:
+        r = redis.StrictRedis(connection_pool=redis_pool)
+        r.set('tasks:{task_id}:details'.format(task_id=self.request.id),
+              json.dumps(payload), ex=GROUP_RECO_DETAILS_EXPIRATION_TIME)
+
+
+def start_fallback_svd_fit() -> bool:
+    """
+    Enqueue `fit_fallback_svd`, unless it was already enqueued recently.
+    Returns False if there is no background worker to run it.
+    """
+    if not redis_pool:
+        return False
+    r = redis.StrictRedis(connection_pool=redis_pool)
+    # Every request missing a snapshot ends up here: only enqueue once
+    if r.set(FALLBACK_SVD_SCHEDULED_KEY, 1, nx=True, ex=DEFAULT_LOCK_EXPIRATION_TIME):
+        fit_fallback_svd.delay()
+    return True
+
+
+@app.task(name='fit_fallback_svd', ignore_result=True)
+def fit_fallback_svd():
+    """
+    Fit the SVD served when the requested algorithm has no snapshot. Web
+    processes pick up its snapshot as soon as it is written.
+    """
+    lock = redis_lock.Lock(redis.StrictRedis(connection_pool=redis_pool),
+                           'lock-fallback-svd',
+                           expire=DEFAULT_LOCK_EXPIRATION_TIME, auto_renewal=True)
+    if not lock.acquire(blocking=False):
+        logger.info('Fallback SVD already being fitted. Ignoring.')
+        return
+    try:
+        try:
+            get_algo_backup('svd')
+            logger.info('Fallback SVD already fitted. Ignoring.')
+            return
+        except (FileNotFoundError, CorruptSnapshotError):
+            pass
+        logger.info('Fitting fallback SVD...')
+        fit_algo('svd', load_training_ratings())
+        logger.info('Fallback SVD fitted.')
+    finally:
+        lock.release()
@@ -0,0 +1,64 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from unittest import mock
+
+from django.test import TestCase
+
+from mangaki.models import Category, Work
+from mangaki.tests.utils import RedisVersionsMixin
+from mangaki.utils.catalogue import VISIBLE, CatalogueMasks, get_works_version
+
+
+class CatalogueMasksTest(RedisVersionsMixin, TestCase):
+    def setUp(self):
+        self.anime = Category.objects.get(slug='anime')
+        self.manga = Category.objects.get(slug='manga')
+        self.works = Work.objects.bulk_create([
+            Work(title='Mahou Shoujo Madoka Magica', category=self.anime),
+            Work(title='Berserk', category=self.manga),
+            Work(title='Hidden', category=self.anime, visible=False),
+            Work(title='Not in the snapshot', category=self.anime),
+        ])
+        # Encoded works of a snapshot, the last one was deleted since
+        self.masks = CatalogueMasks([work.id for work in self.works[:3]] + [999999])
+
+    def test_masks(self):
+        self.assertEqual(self.masks.get('anime').tolist(), [True, False, True, False])
+        self.assertEqual(self.masks.get('manga').tolist(), [False, True, False, False])
+        self.assertEqual(self.masks.get(VISIBLE).tolist(), [True, True, False, False])
+        self.assertEqual(self.masks.get('unknown').tolist(), [False] * 4)
+
+    def test_masks_are_refreshed(self):
+        self.assertTrue(self.masks.get('anime')[0])
+        madoka = self.works[0]
+        madoka.category = self.manga
+        with self.captureOnCommitCallbacks(execute=True):
+            madoka.save()
+        self.assertFalse(self.masks.get('anime')[0])
+        self.assertTrue(self.masks.get('manga')[0])
+
+
+    def test_version_bumps(self):
+        works_version = get_works_version()
+        madoka = Work.objects.get(id=self.works[0].id)
+        madoka.title = 'Puella Magi Madoka Magica'
+        with self.captureOnCommitCallbacks(execute=True):
+            madoka.save()
+            Work.objects.create(title='New', category=self.anime)
+        self.assertEqual(get_works_version(), works_version)
+
+        madoka.visible = False
+        with self.captureOnCommitCallbacks(execute=True):
+            madoka.save()
+        self.assertEqual(get_works_version(), works_version + 1)
+
+    def test_version_is_read_once_in_a_while(self):
+        self.masks.get('anime')
+        with mock.patch('mangaki.utils.catalogue.get_versions', return_value=[42]) as get_versions:
+            self.masks.get('anime')
+            self.masks.get('manga')
+            self.assertEqual(get_versions.call_count, 0)
+            self.assertEqual(get_works_version(max_age=0), 42)
+            self.assertEqual(get_versions.call_count, 1)
+        get_works_version(max_age=0)  # Forget the fake version
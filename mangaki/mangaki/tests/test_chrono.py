@@ -0,0 +1,51 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from mangaki.utils.chrono import Chrono, LatencyRecorder, latency_recorder
+
+
+class ChronoTest(TestCase):
+
+    def test_quantiles(self):
+        recorder = LatencyRecorder()
+        for milliseconds in range(1, 101):
+            recorder.observe('get bulk', milliseconds / 1000, algo='als')
+        recorder.observe('get bulk', 1., algo='svd')
+
+        (stage, labels, quantiles, count, total), _ = recorder.summary()
+        self.assertEqual((stage, labels, count), ('get bulk', {'algo': 'als'}, 100))
+        self.assertAlmostEqual(total, 5.05)
+        self.assertAlmostEqual(quantiles[0.5], 0.0505)
+        self.assertAlmostEqual(quantiles[0.99], 0.09901)
+
+        text = recorder.export_prometheus()
+        self.assertIn('# TYPE mangaki_stage_duration_seconds summary', text)
+        self.assertIn('mangaki_stage_duration_seconds{stage="get bulk",algo="svd",quantile="0.95"} 1.0',
+                      text)
+        self.assertIn('mangaki_stage_duration_seconds_count{stage="get bulk",algo="als"} 100', text)
+
+    def test_chrono_stages(self):
+        recorder = LatencyRecorder()
+        chrono = Chrono(False, recorder=recorder, algo='als')
+        chrono.save('remove already rated, left 42', stage='remove already rated')
+        chrono.save('get bulk')
+        self.assertEqual([(stage, labels, count) for stage, labels, _, count, _ in recorder.summary()],
+                         [('get bulk', {'algo': 'als'}, 1),
+                          ('remove already rated', {'algo': 'als'}, 1)])
+
+    def test_metrics_view(self):
+        latency_recorder.observe('get bulk', 0.01, algo='als')
+        user = get_user_model().objects.create_user(username='test', password='test')
+        self.client.login(username='test', password='test')
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 302)  # To the admin login
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('stage="get bulk",algo="als"', response.content.decode('utf-8'))
@@ -1,8 +1,10 @@
 # SPDX-FileCopyrightText: 2022, Mangaki Authors
 # SPDX-License-Identifier: AGPL-3.0-only
 
+import numpy as np
 from django.test import TestCase
-from mangaki.utils.crypto import HomomorphicEncryption
+from mangaki.utils.crypto import (PRIME, HomomorphicEncryption, discrete_log, expmod,
+                                  random_generator, vexpmod)
 
 
 class CryptoTest(TestCase):
@@ -22,3 +24,24 @@ class CryptoTest(TestCase):
         mean, feat = self.he.decrypt_embeddings(encrypted)
         self.assertEqual(mean, 4)
         self.assertSequenceEqual(feat.tolist(), [5, 2])
+
+    def test_quantized_encryption(self):
+        he = HomomorphicEncryption(['Alice', 'Bob'], quantize_round=1, MAX_VALUE=800 * 3)
+        alice = (np.float64(1.26), np.array([0.3, -2.04, 12.5]))
+        bob = (np.float64(-0.1), np.array([-0.3, -1.01, 99.94]))
+        mean, feat = he.decrypt_embeddings([he.encrypt_embeddings('Alice', alice),
+                                            he.encrypt_embeddings('Bob', bob)])
+        self.assertAlmostEqual(mean, 1.2)
+        np.testing.assert_allclose(feat, [0., -3., 112.4])
+
+    def test_vectorized_arithmetic(self):
+        a = np.array([0, 1, 2, 123456, PRIME - 1])
+        b = np.array([0, 5, PRIME - 2, 98765, 2])
+        self.assertSequenceEqual(vexpmod(a, b).tolist(),
+                                 [expmod(int(x), int(y)) for x, y in zip(a, b)])
+        g = random_generator()
+        logs = np.arange(-50, 51)
+        values = [expmod(g, int(x) % (PRIME - 1)) for x in logs]
+        self.assertSequenceEqual(discrete_log(g, values, 50).tolist(), logs.tolist())
+        with self.assertRaises(ValueError):
+            discrete_log(g, values, 40)
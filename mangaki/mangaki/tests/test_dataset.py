@@ -0,0 +1,70 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from zero.dataset import Dataset
+
+from mangaki.models import Category, Rating, Work
+from mangaki.utils.dataset import RatingArrays, make_anonymous_data
+from mangaki.utils.ratings import load_rating_arrays
+from mangaki.utils.values import rating_values
+
+
+class DatasetTest(TestCase):
+    def setUp(self):
+        choices = list(rating_values)
+        self.triplets = [(user_id, work_id, choices[(user_id + work_id) % len(choices)])
+                         for user_id in range(1, 8)
+                         for work_id in range(10, 30, user_id)]
+
+    def test_from_triplets(self):
+        # Chunks smaller than the data, and fewer triplets than expected
+        with mock.patch('mangaki.utils.dataset.TRIPLETS_CHUNK_SIZE', 7):
+            rating_arrays = RatingArrays.from_triplets(iter(self.triplets), size_hint=5)
+        self.assertEqual(len(rating_arrays), len(self.triplets))
+        self.assertEqual(rating_arrays.user_ids.dtype, np.int32)
+        self.assertEqual(rating_arrays.ratings.dtype, np.float32)
+        self.assertEqual(list(zip(rating_arrays.user_ids.tolist(), rating_arrays.work_ids.tolist(),
+                                  rating_arrays.ratings.tolist())),
+                         [(user_id, work_id, np.float32(rating_values[choice]))
+                          for user_id, work_id, choice in self.triplets])
+
+    def test_make_anonymous_data(self):
+        for ordered in [False, True]:
+            dataset = Dataset()
+            anonymized = make_anonymous_data(
+                dataset, RatingArrays.from_triplets(self.triplets), ordered=ordered,
+                with_text=True)
+            self.assertEqual((anonymized.nb_users, anonymized.nb_works), (7, 20))
+            decoded = sorted(
+                (dataset.decode_user[encoded_user_id], dataset.decode_work[encoded_work_id], choice)
+                for (encoded_user_id, encoded_work_id), choice
+                in zip(anonymized.X.tolist(), anonymized.y_text.tolist()))
+            self.assertEqual(decoded, sorted(self.triplets))
+            np.testing.assert_allclose(anonymized.y, [rating_values[choice]
+                                                      for choice in anonymized.y_text])
+
+            reference = Dataset()
+            reference.make_anonymous_data(self.triplets)
+            self.assertEqual(dataset.interesting_works, reference.interesting_works)
+            if ordered:  # Work 10 is rated by everyone
+                self.assertEqual(dataset.encode_work[10], 0)
+
+    def test_load_rating_arrays(self):
+        users = [get_user_model().objects.create_user(username=f'user{i}') for i in range(3)]
+        works = Work.objects.bulk_create([Work(title=f'Work {i}', category=Category.objects.get(slug='anime'))
+                                          for i in range(4)])
+        Rating.objects.bulk_create([Rating(user=user, work=work, choice='like')
+                                    for user in users for work in works[:2]])
+        Rating.objects.create(user=users[0], work=works[3], choice='dislike')
+
+        rating_arrays = load_rating_arrays(chunk_size=2)
+        expected = [(user_id, work_id, rating_values[choice]) for user_id, work_id, choice
+                    in Rating.objects.values_list('user_id', 'work_id', 'choice')]
+        self.assertEqual(sorted(zip(rating_arrays.user_ids.tolist(), rating_arrays.work_ids.tolist(),
+                                    rating_arrays.ratings.tolist())),
+                         sorted(expected))
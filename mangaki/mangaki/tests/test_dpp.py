@@ -17,7 +17,6 @@ class DPPTest(TestCase):
         self.dpp = MangakiDPP(work_ids, vectors)
 
     def test_dpp(self):
-        self.dpp.compute_similarity()
         self.dpp.preprocess()
         subset = self.dpp.sample_k(self.nb_works)
         self.assertEqual(set(subset), set(self.dpp.work_ids))
@@ -0,0 +1,63 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import numpy as np
+from django.test import TestCase
+
+from mangaki.utils.dpplib import dual_decomposition, esym_poly, sample_k, sample_k_dual
+
+
+def esym_poly_reference(k, lam):
+    N = lam.size
+    E = np.zeros((k + 1, N + 1))
+    E[0, :] = 1
+    for l in range(1, k + 1):
+        for n in range(1, N + 1):
+            E[l, n] = E[l, n - 1] + lam[n - 1] * E[l - 1, n - 1]
+    return E
+
+
+class DPPLibTest(TestCase):
+    def test_esym_poly(self):
+        rng = np.random.RandomState(0)
+        for k, lam in [(10, rng.rand(200)), (3, np.array([0., 2., 0., 1e-12, 5.])),
+                       (6, rng.rand(4)), (2, np.array([]))]:
+            np.testing.assert_array_equal(esym_poly(k, lam), esym_poly_reference(k, lam))
+        # e_2(1, 2, 3) = 1*2 + 1*3 + 2*3
+        self.assertEqual(esym_poly(2, np.array([1., 2., 3.]))[2, 3], 11)
+
+    def test_sample_k(self):
+        rng = np.random.RandomState(0)
+        vectors = rng.randn(30, 5)
+        D, V = np.linalg.eigh(vectors @ vectors.T)
+        sampled = sample_k(4, D, V).ravel().astype(int)
+        self.assertEqual(len(sampled), 4)
+        self.assertEqual(len(set(sampled.tolist())), 4)
+
+    def test_dual_decomposition(self):
+        B = np.random.RandomState(0).randn(50, 6)
+        lam, W = dual_decomposition(B)
+        primal_lam = np.linalg.eigvalsh(B @ B.T)
+        np.testing.assert_allclose(lam, primal_lam[-6:])
+        # The primal eigenvectors follow from the dual ones
+        U = B @ W / np.sqrt(lam)
+        np.testing.assert_allclose(U.T @ U, np.eye(6), atol=1e-10)
+        np.testing.assert_allclose(B @ B.T @ U, U * lam)
+
+        # Rank 3 only: at most 3 items
+        lam, W = dual_decomposition(B[:3])
+        self.assertEqual(lam.size, 3)
+        self.assertEqual(len(sample_k_dual(5, lam, W, B[:3])), 3)
+
+    def test_sample_k_dual(self):
+        np.random.seed(0)
+        # With k = 1, each item is sampled with probability L_ii / tr(L)
+        B = np.array([[1., 0.], [0., 2.], [1., 1.]])
+        lam, W = dual_decomposition(B)
+        counts = np.bincount([sample_k_dual(1, lam, W, B)[0] for _ in range(3000)], minlength=3)
+        np.testing.assert_allclose(counts / 3000, [1 / 7, 4 / 7, 2 / 7], atol=0.03)
+
+        B = np.random.randn(500, 20)
+        lam, W = dual_decomposition(B)
+        sampled = sample_k_dual(10, lam, W, B)
+        self.assertEqual(len(set(sampled.tolist())), 10)
@@ -0,0 +1,47 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from django.test import TestCase
+from mangaki.tests.utils import fit_on_triplets
+from mangaki.utils.embeddings import EmbeddingSnapshot
+
+
+class EmbeddingSnapshotTest(TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.algo = fit_on_triplets('als', nb_works=20)
+
+    def test_save_and_load(self):
+        path = EmbeddingSnapshot.get_path(self.folder, 'als-20')
+        EmbeddingSnapshot.from_algo(self.algo).save(path)
+        EmbeddingSnapshot.from_algo(self.algo).save(path)  # Overwrite
+        self.assertEqual(os.listdir(self.folder), ['als-20.embeddings'])
+
+        embeddings = EmbeddingSnapshot.load(path)
+        self.assertIsInstance(embeddings.item_vectors, np.memmap)
+        self.assertEqual(embeddings.item_vectors.dtype, np.float32)
+        self.assertEqual(embeddings.nb_works, self.algo.nb_works)
+
+        work_ids = [10, 12, 15, 99]
+        self.assertSequenceEqual(
+            embeddings.encode_works(work_ids).tolist(),
+            [self.algo.dataset.encode_work[10],
+             self.algo.dataset.encode_work[12],
+             self.algo.dataset.encode_work[15], -1])
+        self.assertIsNone(embeddings.encode_user(42))
+
+        encoded_user_id = self.algo.dataset.encode_user[3]
+        X = np.array([[encoded_user_id, self.algo.dataset.encode_work[work_id]]
+                      for work_id in work_ids[:3]])
+        np.testing.assert_allclose(embeddings.predict_user(3, work_ids[:3]),
+                                   self.algo.predict(X), rtol=1e-4, atol=1e-4)
+        with self.assertRaises(KeyError):
+            embeddings.predict_user(3, work_ids)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
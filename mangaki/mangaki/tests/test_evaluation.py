@@ -0,0 +1,51 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import json
+from io import StringIO
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core import management
+from django.test import TestCase
+
+from mangaki.models import Category, Rating, Work
+from mangaki.utils.evaluation import ndcg_at_k, precision_at_k, time_split
+
+
+class EvaluationTest(TestCase):
+    def test_time_split(self):
+        folds = time_split(10, 4)
+        self.assertEqual([(train.stop, test.start, test.stop) for train, test in folds],
+                         [(2, 2, 4), (4, 4, 6), (6, 6, 8), (8, 8, 10)])
+
+    def test_ranking_metrics(self):
+        hits = np.array([[1, 0, 1], [0, 0, 0]], dtype=float)
+        self.assertAlmostEqual(precision_at_k(hits), 2 / 6)
+        # Both relevant works of the first user are found, at ranks 1 and 3
+        self.assertAlmostEqual(ndcg_at_k(hits, np.array([2, 1])),
+                               (1 + 1 / 2) / (1 + 1 / np.log2(3)) / 2)
+        self.assertAlmostEqual(ndcg_at_k(np.ones((1, 3)), np.array([5])), 1)
+
+    def test_evaluate_algos(self):
+        anime = Category.objects.get(slug='anime')
+        works = Work.objects.bulk_create([Work(title='Work {}'.format(i), category=anime)
+                                          for i in range(12)])
+        users = get_user_model().objects.bulk_create([
+            get_user_model()(username='user{}'.format(i)) for i in range(8)])
+        choices = ['favorite', 'like', 'dislike', 'neutral']
+        Rating.objects.bulk_create([
+            Rating(user=user, work=work, choice=choices[(i + j) % len(choices)])
+            for i, user in enumerate(users) for j, work in enumerate(works) if (i * j) % 3 != 1])
+
+        stdout = StringIO()
+        management.call_command('evaluate_algos', 'svd', 'als', '--nb_folds', '2',
+                                '--k', '3', '--nb_candidates', '5', stdout=stdout, stderr=StringIO())
+        results = json.loads(stdout.getvalue())
+        self.assertEqual(len(results['folds']), 4)
+        self.assertEqual(set(results['summary']), {'svd', 'als'})
+        for summary in results['summary'].values():
+            self.assertGreater(summary['coverage'], 0)
+            self.assertGreaterEqual(summary['ndcg@k'], 0)
+            self.assertLessEqual(summary['index_precision@k'], 1)
+            self.assertGreater(summary['snapshot_bytes'], 0)
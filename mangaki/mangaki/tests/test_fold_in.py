@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from mangaki.models import Category, Work
+from mangaki.utils.fold_in import FoldInCache, fit_user, fit_users, fit_users_batch
+from mangaki.utils.model_registry import model_registry
+from mangaki.tests.utils import RedisVersionsMixin, fit_on_triplets
+from mangaki.utils.ratings import bump_ratings_version, get_ratings_versions
+
+
+class CountingAlgo:
+    def __init__(self):
+        self.nb_fits = 0
+
+    def fit_single_user(self, rated_works, ratings):
+        self.nb_fits += 1
+        return sum(ratings) / len(ratings), list(ratings)
+
+
+class FoldInTest(RedisVersionsMixin, TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'algo.pickle')
+        open(self.path, 'wb').close()
+        self.algo = CountingAlgo()
+        model_registry.register(self.path, self.algo)
+        self.cache = FoldInCache(maxsize=2)
+
+    def test_fit_user_is_cached(self):
+        first = fit_user(self.algo, 1, 0, [0, 1], [2, 4], cache=self.cache)
+        second = fit_user(self.algo, 1, 0, [0, 1], [2, 4], cache=self.cache)
+        self.assertIs(first, second)
+        self.assertEqual(self.algo.nb_fits, 1)
+
+        # New ratings version, anonymous user
+        self.assertEqual(fit_user(self.algo, 1, 1, [0], [1],
+                                  cache=self.cache), (1, [1]))
+        fit_user(self.algo, None, None, [0], [1], cache=self.cache)
+        self.assertEqual(self.algo.nb_fits, 3)
+
+        # Least recently used entries are evicted
+        fit_user(self.algo, 2, 0, [0], [3], cache=self.cache)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get((1, model_registry.version(self.algo), 0)))
+
+    def test_fit_users_batch(self):
+        rng = np.random.RandomState(0)
+        indptr = [0, 3, 4, 10]
+        for algo_name in ['als', 'svd', 'knn']:
+            algo = fit_on_triplets(algo_name)
+            encoded_work_ids = rng.choice(algo.nb_works, 10, replace=False)
+            ratings = rng.choice([-2., 0.1, 2., 4.], 10)
+            expected = [algo.fit_single_user(encoded_work_ids[start:end],
+                                             ratings[start:end].copy())
+                        for start, end in zip(indptr, indptr[1:])]
+            parameters = fit_users_batch(algo, indptr, encoded_work_ids, ratings)
+            self.assertEqual(len(parameters), 3)
+            if algo_name == 'knn':  # Neighbors, fitted one user at a time
+                for neighbors, expected_neighbors in zip(parameters, expected):
+                    np.testing.assert_array_equal(neighbors, expected_neighbors)
+                continue
+            for (mean, feat), (expected_mean, expected_feat) in zip(parameters, expected):
+                self.assertAlmostEqual(mean, expected_mean)
+                np.testing.assert_allclose(feat, expected_feat, rtol=1e-6, atol=1e-8)
+
+    def test_fit_users_is_cached(self):
+        fit_user(self.algo, 2, 0, [0], [3], cache=self.cache)
+        parameters = fit_users(self.algo, [1, 2, 3], {2: 0}, [0, 2, 3, 4],
+                               [0, 1, 0, 1], [2., 4., 5., 1.], cache=self.cache)
+        self.assertEqual([mean for mean, _ in parameters], [3., 3., 1.])
+        self.assertEqual(self.algo.nb_fits, 3)
+
+    def test_rating_bumps_version(self):
+        user = get_user_model().objects.create_user(username='test',
+                                                    password='test')
+        work = Work.objects.create(title='Sangatsu no Lion',
+                                   category=Category.objects.get(slug='anime'))
+        version = get_ratings_versions([user.id])[user.id]
+        self.client.login(username='test', password='test')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('vote', args=[work.id]),
+                             {'choice': 'like'})
+        self.assertEqual(get_ratings_versions([user.id]),
+                         {user.id: version + 1})
+
+    def test_no_redis(self):
+        user = get_user_model().objects.create_user(username='test')
+        with mock.patch('mangaki.utils.versions._get_redis', return_value=None):
+            bump_ratings_version(user.id)
+            # Another process could have bumped it: there is no version to trust
+            ratings_version = get_ratings_versions([user.id])[user.id]
+        self.assertIsNone(ratings_version)
+        fit_user(self.algo, user.id, ratings_version, [0], [1], cache=self.cache)
+        fit_user(self.algo, user.id, ratings_version, [0], [1], cache=self.cache)
+        self.assertEqual(self.algo.nb_fits, 2)
+
+    def tearDown(self):
+        model_registry.invalidate(self.path)
+        shutil.rmtree(self.folder)
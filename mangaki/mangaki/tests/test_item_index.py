@@ -0,0 +1,49 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from django.test import TestCase
+
+from mangaki.management.commands.benchmark_item_index import make_synthetic_embeddings
+from mangaki.utils.item_index import InvertedFileIndex
+
+
+class InvertedFileIndexTest(TestCase):
+    def setUp(self):
+        self.item_vectors, self.queries = make_synthetic_embeddings(2000, 20, 10)
+        self.work_ids = np.arange(1000, 3000)
+        self.index = InvertedFileIndex.build(self.item_vectors, self.work_ids)
+
+    def test_search(self):
+        self.assertEqual(self.index.nb_clusters, 44)
+        self.assertEqual(sorted(self.index.work_ids), self.work_ids.tolist())
+        nb_found = 0
+        for query in self.queries:
+            expected = self.work_ids[np.argsort(-self.item_vectors @ query)[:10]]
+            candidates = self.index.search(query, 200)
+            self.assertGreaterEqual(len(candidates), 200)
+            nb_found += len(set(expected) & set(candidates))
+        self.assertGreaterEqual(nb_found / (10 * len(self.queries)), 0.9)
+
+    def test_allowed_works(self):
+        allowed_work_ids = [1000, 1500, 2999, 4000]
+        candidates = self.index.search(self.queries[0], 100,
+                                       allowed_work_ids=allowed_work_ids)
+        self.assertEqual(sorted(candidates), [1000, 1500, 2999])
+
+    def test_save_and_load(self):
+        folder = tempfile.mkdtemp()
+        try:
+            path = InvertedFileIndex.get_path(folder, 'als-10')
+            self.index.save(path)
+            loaded = InvertedFileIndex.load(path)
+            self.assertEqual(os.listdir(folder), ['als-10.ivf'])
+            np.testing.assert_array_equal(
+                loaded.search(self.queries[0], 50),
+                self.index.search(self.queries[0], 50))
+        finally:
+            shutil.rmtree(folder)
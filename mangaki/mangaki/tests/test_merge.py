@@ -13,10 +13,12 @@ from mangaki import tasks
 from mangaki.models import Work, Category, WorkCluster, Rating, Staff, Role, Artist, Genre, Reference
 from datetime import timedelta
 
+from mangaki.tests.utils import RedisVersionsMixin
+from mangaki.utils.ratings import get_ratings_versions
 from mangaki.utils.work_merge import create_work_cluster, merge_work_clusters
 
 
-class MergeTest(TestCase):
+class MergeTest(RedisVersionsMixin, TestCase):
 
     def setUp(self):
         self.user = get_user_model().objects.create_superuser(username='test', password='test', email='steins@gate.co.jp')
@@ -99,8 +101,14 @@ class MergeTest(TestCase):
             'fields_to_choose': '',
             'fields_required': ''
         }
-        with self.assertNumQueries(37):  # FIXME(Raito): This test is quite fragile, what would be better?
+        user_ids = [user.id for user in self.users]
+        versions = get_ratings_versions(user_ids)
+        with self.captureOnCommitCallbacks(execute=True), \
+                self.assertNumQueries(37):  # FIXME(Raito): This test is quite fragile, what would be better?
             self.client.post(merge_url, context)
+        # The ratings of the users were redirected to the kept work
+        self.assertEqual(get_ratings_versions(user_ids),
+                         {user_id: version + 1 for user_id, version in versions.items()})
         self.assertEqual(list(Rating.objects.filter(user__in=self.users).values_list('choice', flat=True)), ['favorite'] * 4)
         self.assertEqual(Work.all_objects.filter(redirect__isnull=True).count(), 1)
         self.assertEqual(WorkCluster.objects.count(), 1)
@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import os
+import pickle
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from mangaki.utils.model_registry import ModelRegistry
+
+
+class Model:
+    def __init__(self, version):
+        self.version = version
+
+
+class ModelRegistryTest(TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'model.pickle')
+        self.registry = ModelRegistry()
+        self.nb_loads = 0
+        self.write({'version': 1})
+
+    def write(self, model):
+        with open(self.path, 'wb') as f:
+            pickle.dump(model, f)
+
+    def load(self, path):
+        self.nb_loads += 1
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def test_model_is_loaded_once(self):
+        first = self.registry.get(self.path, self.load)
+        second = self.registry.get(self.path, self.load)
+        self.assertIs(first, second)
+        self.assertEqual(self.nb_loads, 1)
+
+    def test_new_snapshot_is_reloaded(self):
+        first = self.registry.get(self.path, self.load)
+        self.write({'version': 2, 'padding': 'x' * 100})
+        second = self.registry.get(self.path, self.load)
+        self.assertEqual(first['version'], 1)
+        self.assertEqual(second['version'], 2)
+        self.assertEqual(self.nb_loads, 2)
+
+    def test_missing_snapshot(self):
+        self.registry.get(self.path, self.load)
+        os.remove(self.path)
+        with self.assertRaises(FileNotFoundError):
+            self.registry.get(self.path, self.load)
+
+    def test_register_and_derive(self):
+        model = Model(3)
+        self.registry.register(self.path, model)
+        self.assertIs(self.registry.get(self.path, self.load), model)
+        self.assertEqual(self.nb_loads, 0)
+        self.assertIsNotNone(self.registry.version(model))
+        self.assertIsNone(self.registry.version(Model(3)))
+
+        squares = self.registry.derive(model, 'square', lambda m: [m.version ** 2])
+        self.assertEqual(squares, [9])
+        self.assertIs(self.registry.derive(model, 'square', list), squares)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
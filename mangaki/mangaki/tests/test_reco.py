@@ -5,15 +5,34 @@ import logging
 import json
 import os
 import shutil
+import tempfile
+from unittest import mock
 
+from django.core import management
 from django.test import TestCase
 from django.urls import reverse_lazy
 from django.contrib.auth import get_user_model
+from django.contrib.messages import get_messages
 from django.conf import settings
 import responses
 
-from mangaki.models import Category, Work, Rating
+from mangaki.models import Category, Work, Rating, PrecomputedRecommendation
+from mangaki.tasks import GROUP_RECO_TAG, compute_group_reco
+from mangaki.tests.utils import RedisVersionsMixin
+from mangaki.utils.fit_algo import fit_algo, get_algo_backup, get_backup_filename
+from mangaki.utils.incremental import fit_algo_incremental
+from mangaki.utils.snapshots import get_snapshot_path
+from mangaki.utils.values import rating_values
+from mangaki.utils.popularity import popularity_cache
+from mangaki.utils.ratings import bump_ratings_version, load_rating_arrays, load_training_ratings
+from mangaki.utils.recommendations import (get_algo_backup_or_fit_svd, get_group_ratings,
+                                           get_personalized_ranking,
+                                           get_precomputed_recommendations,
+                                           get_reco_cache_key, get_top_positions,
+                                           materialize_recommendations, retrieve_candidates)
+import numpy as np
 import time
+from io import StringIO
 
 
 ML_SNAPSHOT_ROOT_TEST = '/tmp/test_reco/'
@@ -22,7 +41,7 @@ def get_path(key):
     return os.path.join(ML_SNAPSHOT_ROOT_TEST, '{:s}'.format(key))
 
 
-class RecoTest(TestCase):
+class RecoTest(RedisVersionsMixin, TestCase):
 
     def setUp(self):
         self.user = get_user_model().objects.create_user(username='test', password='test')
@@ -58,7 +77,8 @@ class RecoTest(TestCase):
 
         if not os.path.exists(ML_SNAPSHOT_ROOT_TEST):
             os.makedirs(ML_SNAPSHOT_ROOT_TEST)
-            for key in {'svd', 'svd-embeddings', 'als', 'knn', 'knn-anonymous'}:
+            for key in {'svd', 'svd-embeddings', 'als', 'knn', 'knn-anonymous',
+                        'popularity'}:
                 path = get_path(key)
                 if not os.path.exists(path):
                     os.makedirs(path)
@@ -84,7 +104,7 @@ class RecoTest(TestCase):
         with self.settings(ML_SNAPSHOT_ROOT=get_path('als'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST):
             response = self.client.get(reco_url)
         self.assertEqual(len(json.loads(response.content.decode('utf-8'))), 8)
-        os.remove(os.path.join(get_path('als'), 'svd-20.pickle'))
+        shutil.rmtree(os.path.join(get_path('als'), 'svd-20'))
 
     def test_group_reco_custom_embed(self):
         self.client.login(username='test', password='test')
@@ -103,7 +123,7 @@ class RecoTest(TestCase):
         with self.settings(ML_SNAPSHOT_ROOT=get_path('als'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST):
             response = self.client.get(reco_url)
         self.assertEqual(len(json.loads(response.content.decode('utf-8'))), 9)
-        os.remove(os.path.join(get_path('als'), 'svd-20.pickle'))
+        shutil.rmtree(os.path.join(get_path('als'), 'svd-20'))
 
     def test_group_reco_intersection(self):
         self.client.login(username='test', password='test')
@@ -114,7 +134,7 @@ class RecoTest(TestCase):
         with self.settings(ML_SNAPSHOT_ROOT=get_path('als'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST):
             response = self.client.get(reco_url)
         self.assertEqual(len(json.loads(response.content.decode('utf-8'))), 1)
-        os.remove(os.path.join(get_path('als'), 'svd-20.pickle'))
+        shutil.rmtree(os.path.join(get_path('als'), 'svd-20'))
 
     def test_group_reco_union(self):
         self.client.login(username='test', password='test')
@@ -125,7 +145,7 @@ class RecoTest(TestCase):
         with self.settings(ML_SNAPSHOT_ROOT=get_path('als'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST):
             response = self.client.get(reco_url)
         self.assertEqual(len(json.loads(response.content.decode('utf-8'))), 9)
-        os.remove(os.path.join(get_path('als'), 'svd-20.pickle'))
+        shutil.rmtree(os.path.join(get_path('als'), 'svd-20'))
 
     @responses.activate
     def test_user_position_and_friends(self, **kwargs):
@@ -149,7 +169,7 @@ class RecoTest(TestCase):
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.content.decode())
         self.assertEqual(len(data), 2)
-        os.remove(os.path.join(get_path('svd-embeddings'), 'svd-20.pickle'))
+        shutil.rmtree(os.path.join(get_path('svd-embeddings'), 'svd-20'))
 
     def test_svd_reco_with_new_works(self):
         self.client.login(username='test', password='test')
@@ -171,7 +191,7 @@ class RecoTest(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(json.loads(response.content.decode('utf-8'))), 8)
-        os.remove(os.path.join(get_path('svd'), 'svd-20.pickle'))
+        shutil.rmtree(os.path.join(get_path('svd'), 'svd-20'))
 
     def test_anonymous_reco(self):
         vote_url = reverse_lazy('vote', args=[self.work.id])
@@ -190,7 +210,262 @@ class RecoTest(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(json.loads(response.content.decode('utf-8'))), 8)
-        os.remove(os.path.join(get_path('knn-anonymous'), 'svd-20.pickle'))
+        shutil.rmtree(os.path.join(get_path('knn-anonymous'), 'svd-20'))
+
+    def test_personalized_ranking(self):
+        with self.settings(ML_SNAPSHOT_ROOT=get_path('als'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST):
+            algo = fit_algo('als', Rating.objects.values_list('user_id', 'work_id', 'choice'))
+        otaku = get_user_model().objects.get(username='otaku')
+        work_ids = list(Rating.objects.filter(user=otaku).values_list('work_id', flat=True))
+        encoded_user_id = algo.dataset.encode_user[otaku.id]
+        y_pred = algo.predict(np.array([[encoded_user_id, algo.dataset.encode_work[work_id]]
+                                        for work_id in work_ids]))
+        best_pos = get_personalized_ranking(algo, otaku.id, work_ids, limit=5)
+        np.testing.assert_allclose(y_pred[best_pos], np.sort(y_pred)[::-1][:5], rtol=1e-4)
+
+    def test_precomputed_reco(self):
+        self.client.login(username='test', password='test')
+        reco_url = reverse_lazy('get-reco-algo-list', args=['als', 'all'])
+        with self.settings(ML_SNAPSHOT_ROOT=get_path('als'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST):
+            fit_algo('als', Rating.objects.values_list('user_id', 'work_id', 'choice'))
+            nb_users = materialize_recommendations('als')
+            self.assertEqual(nb_users, 23)
+            precomputed = PrecomputedRecommendation.objects.get(user=self.user, algo_name='als',
+                                                                category='all')
+            self.assertNotIn(self.work.id, precomputed.work_ids)
+            self.assertEqual(len(precomputed.work_ids), 23)
+            self.assertTrue(set(PrecomputedRecommendation.objects.get(
+                user=self.user, algo_name='als', category='anime').work_ids) <=
+                set(Work.objects.filter(category=self.anime_category).values_list('id', flat=True)))
+
+            response = self.client.get(reco_url)
+            data = json.loads(response.content.decode('utf-8'))
+            self.assertEqual([work['id'] for work in data], precomputed.work_ids[:8])
+
+            # Works hidden or deleted since are replaced by the next ones
+            with self.captureOnCommitCallbacks(execute=True):
+                for hidden in Work.objects.filter(id__in=precomputed.work_ids[:3]):
+                    hidden.visible = False
+                    hidden.save()
+                Work.objects.filter(id=precomputed.work_ids[3]).delete()
+            response = self.client.get(reco_url)
+            data = json.loads(response.content.decode('utf-8'))
+            self.assertEqual([work['id'] for work in data], precomputed.work_ids[4:12])
+
+            # Once the user rates something new, the precomputed reco are ignored
+            Rating.objects.create(user=self.user, work_id=precomputed.work_ids[4], choice='like')
+            response = self.client.get(reco_url)
+            data = json.loads(response.content.decode('utf-8'))
+            self.assertNotIn(precomputed.work_ids[4], [work['id'] for work in data])
+
+    def test_precomputed_reco_freshness(self):
+        otaku = get_user_model().objects.get(username='otaku')
+
+        def load_while_rating(*args, **kwargs):
+            # Written while the ratings are being read: not seen by the snapshot
+            Rating.objects.create(user=self.user, work=Work.objects.exclude(rating__user=self.user).first(),
+                                  choice='like')
+            return load_rating_arrays(*args, **kwargs)
+
+        with self.settings(ML_SNAPSHOT_ROOT=get_path('als'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST), \
+                mock.patch('mangaki.utils.ratings.load_rating_arrays', side_effect=load_while_rating):
+            algo = fit_algo('als', load_training_ratings())
+            materialize_recommendations('als')
+            self.assertIsNone(get_precomputed_recommendations(self.user, 'als', algo, 'all'))
+            self.assertIsNotNone(get_precomputed_recommendations(otaku, 'als', algo, 'all'))
+
+            # A deleted rating leaves no date behind, but bumps the ratings version
+            otaku.rating_set.first().delete()
+            bump_ratings_version(otaku.id)
+            self.assertIsNone(get_precomputed_recommendations(otaku, 'als', algo, 'all'))
+
+    def test_corrupt_snapshot(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        with self.settings(ML_SNAPSHOT_ROOT=folder, VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST):
+            als = fit_algo('als', load_training_ratings())
+            fit_algo('svd', load_training_ratings())
+            with open(get_snapshot_path(als.get_shortname(), get_backup_filename(als)), 'ab') as f:
+                f.write(b'corrupt')
+            with self.assertLogs('mangaki.utils.recommendations', 'ERROR'):
+                algo = get_algo_backup_or_fit_svd(None, 'als')
+        self.assertEqual(algo.get_shortname(), 'svd-20')
+
+    def test_group_reco_item_index(self):
+        self.client.login(username='test', password='test')
+        self.client.post(reverse_lazy('toggle-friend', args=['friend']))
+        reco_url = reverse_lazy('get-reco-algo-list', args=['als', 'union', 'all'])
+        with self.settings(ML_SNAPSHOT_ROOT=get_path('als'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST):
+            algo = fit_algo('als', Rating.objects.values_list('user_id', 'work_id', 'choice'))
+            work_ids = sorted(algo.dataset.interesting_works)[:10]
+            encoded_work_ids = [algo.dataset.encode_work[work_id] for work_id in work_ids]
+            # Every candidate is retrieved from the index on such a small catalogue
+            candidates, encoded_candidates = retrieve_candidates(
+                algo, [algo.fit_single_user([0], [1.])], work_ids, encoded_work_ids)
+            self.assertEqual(sorted(candidates), work_ids)
+            self.assertEqual(sorted(encoded_candidates), sorted(encoded_work_ids))
+
+            with mock.patch('mangaki.utils.recommendations.ANN_MIN_CANDIDATES', 1):
+                response = self.client.get(reco_url)
+        self.assertEqual(len(json.loads(response.content.decode('utf-8'))), 9)
+
+    def test_group_reco_async(self):
+        self.client.login(username='test', password='test')
+        self.client.post(reverse_lazy('toggle-friend', args=['friend']))
+        reco_url = reverse_lazy('get-reco-algo-list', args=['als', 'union', 'all'])
+        with mock.patch('mangaki.views.redis_pool', mock.Mock()), \
+                mock.patch('mangaki.tasks.compute_group_reco.apply_async') as apply_async:
+            response = self.client.get(reco_url, {'async': 1})
+        self.assertEqual(response.status_code, 202)
+        task_id = json.loads(response.content.decode('utf-8'))['task_id']
+        self.assertTrue(self.user.background_tasks.filter(task_id=task_id,
+                                                          tag=GROUP_RECO_TAG).exists())
+        args = apply_async.call_args[0][0]
+        self.assertEqual(apply_async.call_args[1]['task_id'], task_id)
+
+        with self.settings(ML_SNAPSHOT_ROOT=get_path('als'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST), \
+                mock.patch('mangaki.tasks.redis.StrictRedis') as redis:
+            compute_group_reco.apply(args, task_id=task_id).get()
+        key, payload = redis.return_value.set.call_args[0]
+        self.assertEqual(key, 'tasks:{}:details'.format(task_id))
+        self.assertEqual(len(json.loads(payload)['works']), 9)
+
+        # Polled once computed, then forgotten
+        task_url = reverse_lazy('api-get-task-status', args=[task_id])
+        with mock.patch('mangaki.api.tasks.redis_pool', mock.Mock()), \
+                mock.patch('mangaki.api.tasks.AsyncResult') as async_result, \
+                mock.patch('mangaki.api.tasks.redis.StrictRedis') as redis:
+            async_result.return_value.id = task_id
+            async_result.return_value.state = 'SUCCESS'
+            redis.return_value.get.return_value = payload.encode('utf8')
+            response = self.client.get(task_url)
+        self.assertEqual(len(response.json()['details']['works']), 9)
+        self.assertFalse(self.user.background_tasks.filter(task_id=task_id).exists())
+
+    def test_group_reco_async_failure(self):
+        with mock.patch('mangaki.utils.recommendations.get_group_reco', side_effect=RuntimeError), \
+                mock.patch('mangaki.tasks.redis.StrictRedis') as redis:
+            result = compute_group_reco.apply((self.user.id, None, 'als', 'all', 'union', 9))
+        self.assertTrue(result.failed())
+        # The details are written anyway, so that polling ends
+        key, payload = redis.return_value.set.call_args[0]
+        self.assertIn('error', json.loads(payload))
+
+    def test_popularity_fallback(self):
+        popularity_cache.clear()
+        # As if the ranking command had run: the manga are liked by 2 users
+        Work.objects.update(nb_ratings=1, sum_ratings=5)
+        Work.objects.filter(category__slug='manga').update(nb_ratings=2, sum_ratings=5)
+        self.client.login(username='test', password='test')
+        reco_url = reverse_lazy('get-reco-algo-list', args=['als', 'all'])
+        with self.settings(ML_SNAPSHOT_ROOT=get_path('popularity'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST), \
+                mock.patch('mangaki.tasks.redis_pool', mock.Mock()), \
+                mock.patch('mangaki.tasks.redis.StrictRedis'), \
+                mock.patch('mangaki.tasks.fit_fallback_svd.delay') as fit_fallback_svd:
+            response = self.client.get(reco_url)
+        fit_fallback_svd.assert_called_once_with()
+        self.assertEqual(os.listdir(get_path('popularity')), [])
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(data), 8)
+        self.assertEqual({work['category_slug'] for work in data}, {'manga'})
+        # Not the SVD, so no message saying so
+        self.assertEqual(list(get_messages(response.wsgi_request)), [])
+
+    def test_reco_cache(self):
+        self.client.login(username='test', password='test')
+        self.client.post(reverse_lazy('toggle-friend', args=['friend']))
+        reco_url = reverse_lazy('get-reco-algo-list', args=['als', 'union', 'all'])
+        with self.settings(ML_SNAPSHOT_ROOT=get_path('als'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST):
+            algo = fit_algo('als', Rating.objects.values_list('user_id', 'work_id', 'choice'))
+            response = self.client.get(reco_url)
+            with mock.patch('mangaki.utils.recommendations.get_group_ratings',
+                            side_effect=AssertionError('Not cached')):
+                cached_response = self.client.get(reco_url)
+        self.assertEqual(json.loads(cached_response.content.decode('utf-8')),
+                         json.loads(response.content.decode('utf-8')))
+
+        triplets = [(2, self.work.id, 'like'), (3, self.work.id, 'dislike')]
+        key = get_reco_cache_key(algo, 'all', 'union', {self.work.id: 'like'}, triplets)
+        # Who rated what does not matter, only the ratings of each member
+        self.assertEqual(key, get_reco_cache_key(
+            algo, 'all', 'union', {self.work.id: 'like'}, triplets[::-1]))
+        self.assertNotEqual(key, get_reco_cache_key(
+            algo, 'all', 'union', {self.work.id: 'favorite'}, triplets))
+        self.assertNotEqual(key, get_reco_cache_key(
+            algo, 'anime', 'union', {self.work.id: 'like'}, triplets))
+        self.assertNotEqual(key, get_reco_cache_key(
+            algo, 'all', 'intersection', {self.work.id: 'like'}, triplets))
+
+    def test_incremental_fit(self):
+        with self.settings(ML_SNAPSHOT_ROOT=get_path('als'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST):
+            algo = fit_algo('als', Rating.objects.values_list('user_id', 'work_id', 'choice'))
+            newcomer = get_user_model().objects.create_user(username='newcomer', password='test')
+            new_work = Work.objects.create(title='New', category=self.anime_category)
+            Rating.objects.bulk_create([Rating(user=newcomer, work=self.work, choice='like'),
+                                        Rating(user=newcomer, work=new_work, choice='favorite'),
+                                        Rating(user=self.user, work=new_work, choice='like')])
+            updated = fit_algo_incremental('als')
+
+            # Known users and works keep their codes
+            for user_id, encoded_user_id in algo.dataset.encode_user.items():
+                self.assertEqual(updated.dataset.encode_user[user_id], encoded_user_id)
+            self.assertEqual(updated.dataset.encode_work[new_work.id], algo.nb_works)
+            self.assertEqual(updated.dataset.encode_user[newcomer.id], algo.nb_users)
+            self.assertEqual(updated.U.shape, (algo.nb_users + 1, algo.nb_components))
+            self.assertEqual(updated.VT.shape, (algo.nb_components, algo.nb_works + 1))
+            # Only the users who rated something since the snapshot were fit again
+            otaku = algo.dataset.encode_user[get_user_model().objects.get(username='otaku').id]
+            np.testing.assert_array_equal(updated.U[otaku], algo.U[otaku])
+            me = algo.dataset.encode_user[self.user.id]
+            self.assertEqual(updated.means[me], (rating_values['favorite'] + rating_values['like']) / 2)
+            self.assertTrue(np.isfinite(updated.predict(np.array([[algo.nb_users, algo.nb_works]]))).all())
+            self.assertIs(get_algo_backup('als'), updated)
+
+    def test_fit_algos(self):
+        with self.settings(ML_SNAPSHOT_ROOT=get_path('svd'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST):
+            management.call_command('fit_algos', 'svd', 'als', '--no_precompute', stdout=StringIO())
+            svd, als = get_algo_backup('svd'), get_algo_backup('als')
+        # Both were fit on the same encoded ratings
+        self.assertEqual(svd.dataset.encode_user, als.dataset.encode_user)
+        self.assertEqual(svd.dataset.encode_work, als.dataset.encode_work)
+        self.assertEqual(als.U.shape, (Rating.objects.values('user').distinct().count(), 20))
+        self.assertEqual(sorted(os.listdir(get_path('svd'))), ['als-20', 'svd-20'])
+        for shortname in ['svd-20', 'als-20']:
+            shutil.rmtree(os.path.join(get_path('svd'), shortname))
+
+    def test_group_ratings(self):
+        with self.settings(ML_SNAPSHOT_ROOT=get_path('als'), VIZ_ROOT=ML_SNAPSHOT_ROOT_TEST):
+            algo = fit_algo('als', Rating.objects.values_list('user_id', 'work_id', 'choice'))
+        work_ids = sorted(algo.dataset.encode_work)
+        encode_work = algo.dataset.encode_work
+        my_ratings = {work_ids[0]: 'like', work_ids[1]: 'favorite', 999999: 'like'}
+        triplets = [(42, work_ids[1], 'dislike'), (7, work_ids[2], 'neutral'),
+                    (42, work_ids[3], 'like'), (7, work_ids[1], 'like'),
+                    (13, 999999, 'like')]  # Unknown work
+
+        group = get_group_ratings(algo, my_ratings, triplets)
+        self.assertEqual(sorted(group.my_encoded_work_ids.tolist()),
+                         sorted([encode_work[work_ids[0]], encode_work[work_ids[1]]]))
+        self.assertEqual(group.other_ids, [7, 42])
+        self.assertEqual(group.indptr.tolist(), [0, 2, 4])
+        self.assertEqual(group.encoded_work_ids.tolist(),
+                         [encode_work[work_ids[2]], encode_work[work_ids[1]],
+                          encode_work[work_ids[1]], encode_work[work_ids[3]]])
+        self.assertEqual(group.ratings.tolist(), [0.1, 2, -2, 2])
+        self.assertEqual(np.flatnonzero(group.is_rated).tolist(), [encode_work[work_ids[1]]])
+
+        union = get_group_ratings(algo, my_ratings, triplets, 'union')
+        self.assertEqual(sorted(np.flatnonzero(union.is_rated).tolist()),
+                         sorted(encode_work[work_id] for work_id in work_ids[:4]))
+        mine = get_group_ratings(algo, my_ratings, triplets, 'mine')
+        self.assertEqual(sorted(np.flatnonzero(mine.is_rated).tolist()),
+                         sorted(encode_work[work_id] for work_id in work_ids[:2]))
+
+    def test_top_positions(self):
+        y_pred = np.array([0.5, 3., -1., 2., 2.5])
+        self.assertSequenceEqual(get_top_positions(y_pred).tolist(), [1, 4, 3, 0, 2])
+        self.assertSequenceEqual(get_top_positions(y_pred, 2).tolist(), [1, 4])
+        self.assertSequenceEqual(get_top_positions(y_pred, 0).tolist(), [])
 
     def tearDown(self):
         shutil.rmtree(ML_SNAPSHOT_ROOT_TEST)
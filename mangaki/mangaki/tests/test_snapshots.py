@@ -0,0 +1,80 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core import management
+from django.test import TestCase
+
+from mangaki.utils.snapshots import (CorruptSnapshotError, activate_version, get_current_version,
+                                     get_snapshot_path, list_versions, publish_snapshot,
+                                     read_manifest, resolve_snapshot_path)
+
+
+def write_text(text):
+    def write_files(folder):
+        with open(os.path.join(folder, 'algo.pickle'), 'w') as f:
+            f.write(text)
+        os.mkdir(os.path.join(folder, 'algo.embeddings'))
+        with open(os.path.join(folder, 'algo.embeddings', 'U.npy'), 'w') as f:
+            f.write(text)
+    return write_files
+
+
+class SnapshotsTest(TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def read_current(self):
+        with open(resolve_snapshot_path(get_snapshot_path('algo', 'algo.pickle'))) as f:
+            return f.read()
+
+    def test_publish(self):
+        with self.settings(ML_SNAPSHOT_ROOT=self.folder, ML_SNAPSHOT_RETENTION=2):
+            # Snapshots written before versioning are still read
+            self.assertEqual(get_snapshot_path('algo', 'algo.pickle'),
+                             os.path.join(self.folder, 'algo.pickle'))
+            manifests = [publish_snapshot('algo', write_text(str(i)), nb_ratings=i) for i in range(3)]
+            self.assertEqual(self.read_current(), '2')
+            versions = list_versions('algo')
+            self.assertEqual(versions, [manifest['version'] for manifest in manifests[1:]])
+            self.assertEqual(get_current_version('algo'), versions[-1])
+            manifest = read_manifest('algo', versions[-1])
+            self.assertEqual(manifest['nb_ratings'], 2)
+            self.assertEqual(sorted(manifest['sha256']), ['algo.embeddings/U.npy', 'algo.pickle'])
+
+            activate_version('algo', versions[0])  # Rollback
+            self.assertEqual(self.read_current(), '1')
+            with self.assertRaises(FileNotFoundError):
+                activate_version('algo', 'unknown')
+
+            management.call_command('snapshots', 'svd', stdout=StringIO())
+            with self.assertRaises(management.CommandError):
+                management.call_command('snapshots', 'svd', '--rollback', stdout=StringIO())
+
+    def test_failed_publish(self):
+        with self.settings(ML_SNAPSHOT_ROOT=self.folder):
+            publish_snapshot('algo', write_text('ok'))
+
+            def fail(folder):
+                write_text('partial')(folder)
+                raise RuntimeError
+            with self.assertRaises(RuntimeError):
+                publish_snapshot('algo', fail)
+            self.assertEqual(self.read_current(), 'ok')
+            self.assertEqual(len(os.listdir(os.path.join(self.folder, 'algo', 'versions'))), 1)
+
+    def test_corrupt_snapshot(self):
+        with self.settings(ML_SNAPSHOT_ROOT=self.folder):
+            publish_snapshot('algo', write_text('ok'))
+            with open(get_snapshot_path('algo', 'algo.embeddings/U.npy'), 'w') as f:
+                f.write('ko')
+            self.assertEqual(self.read_current(), 'ok')
+            with self.assertRaises(CorruptSnapshotError):
+                resolve_snapshot_path(get_snapshot_path('algo', 'algo.embeddings'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import json
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+import responses
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from mangaki.models import Category, Rating, Work
+from mangaki.utils.viz import (MapCache, dump_2d_embeddings, interpolate_positions,
+                               load_2d_positions)
+
+POINTS = {'works': [{'work_id': 3, 'x': 1., 'y': 2.}, {'work_id': 7, 'x': -1., 'y': 0.5}],
+          'users': []}
+
+
+class VizTest(TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        anime = Category.objects.get(slug='anime')
+        self.works = Work.objects.bulk_create([Work(title='Work {}'.format(i), category=anime)
+                                               for i in range(20)])
+
+    def get_embeddings(self, nb_works, seed=0):
+        return SimpleNamespace(
+            item_vectors=np.random.RandomState(seed).randn(nb_works, 3).astype(np.float32),
+            work_ids=np.array([work.id for work in self.works[:nb_works]], dtype=np.int32),
+            work_popularity=np.arange(nb_works, 0, -1))
+
+    def test_interpolate_positions(self):
+        vectors = np.array([[0., 0.], [1., 0.], [10., 0.], [0.9, 0.]])
+        positions = np.array([[0., 0.], [1., 1.], [5., 5.], [0., 0.]])
+        is_placed = np.array([True, True, True, False])
+        interpolate_positions(vectors, positions, is_placed, nb_neighbors=2)
+        # Between its 2 nearest neighbors, much closer to the second one
+        np.testing.assert_allclose(positions[3], [0.9, 0.9])
+        np.testing.assert_allclose(positions[:3], [[0, 0], [1, 1], [5, 5]])
+
+    def test_incremental_layout(self):
+        with self.settings(VIZ_ROOT=self.folder):
+            dump_2d_embeddings(self.get_embeddings(16), 'points-als.json')
+            positions = load_2d_positions('points-als.json')
+            self.assertEqual(len(positions), 16)
+            self.assertEqual(os.listdir(self.folder), ['points-als.json'])
+
+            # A new fit moves the vectors and adds works, but not the map
+            dump_2d_embeddings(self.get_embeddings(20, seed=1), 'points-als.json')
+            new_positions = load_2d_positions('points-als.json')
+            self.assertEqual(len(new_positions), 20)
+            for work_id, position in positions.items():
+                self.assertEqual(new_positions[work_id], position)
+
+            dump_2d_embeddings(self.get_embeddings(20, seed=1), 'points-als.json', relayout=True)
+            self.assertNotEqual(load_2d_positions('points-als.json'), new_positions)
+
+    def test_local_map(self):
+        cache = MapCache()
+        path = os.path.join(self.folder, 'points-als.json')
+        with open(path, 'w') as f:
+            json.dump(POINTS, f)
+        with self.settings(VIZ_ROOT=self.folder):
+            map_positions = cache.get('als')
+            self.assertIs(cache.get('als'), map_positions)
+            positions, is_known = map_positions.get_positions([7, 5, 3])
+            self.assertEqual(is_known.tolist(), [True, False, True])
+            np.testing.assert_array_equal(positions[[0, 2]], [[-1, 0.5], [1, 2]])
+
+            with open(path, 'w') as f:
+                json.dump({'works': POINTS['works'][:1], 'users': []}, f)
+            os.utime(path, ns=(0, 0))  # The file changed
+            map_positions = cache.get('als')
+            self.assertEqual(map_positions.work_ids.tolist(), [3])
+
+            with open(path, 'w') as f:
+                f.write('{"works": [')
+            with self.assertLogs('mangaki.utils.viz', 'WARNING'):
+                self.assertIs(cache.get('als'), map_positions)
+
+    @responses.activate
+    def test_remote_map(self):
+        cache = MapCache(max_age=0)
+        url = 'https://fake.news/points-svd.json'
+        responses.add(responses.GET, url, json=POINTS, headers={'ETag': '"v1"'})
+        responses.add(responses.GET, url, status=304)
+        with self.settings(VIZ_ROOT=self.folder, VIZ_URL='https://fake.news'):
+            map_positions = cache.get('svd')
+            self.assertIs(cache.get('svd'), map_positions)
+        self.assertEqual(responses.calls[1].request.headers['If-None-Match'], '"v1"')
+
+    def test_user_and_friends_positions(self):
+        me = get_user_model().objects.create_user(username='me', password='me')
+        friend = get_user_model().objects.create_user(username='friend')
+        me.profile.friends.add(friend)
+        works = self.works
+        points = {'works': [{'work_id': works[i].id, 'x': float(i), 'y': -float(i)}
+                            for i in range(4)], 'users': []}
+        with open(os.path.join(self.folder, 'points-als.json'), 'w') as f:
+            json.dump(points, f)
+        Rating.objects.bulk_create([
+            Rating(user=me, work=works[0], choice='favorite'),
+            Rating(user=me, work=works[2], choice='favorite'),
+            Rating(user=me, work=works[3], choice='like'),
+            Rating(user=me, work=works[10], choice='favorite'),  # Not on the map
+            Rating(user=friend, work=works[3], choice='favorite')])
+
+        self.client.login(username='me', password='me')
+        with self.settings(VIZ_ROOT=self.folder):
+            response = self.client.get('/api/user/position/als')
+        self.assertEqual(response.json(), [{'title': 'me', 'x': 1., 'y': -1.},
+                                           {'title': 'friend', 'x': 3., 'y': -3.}])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
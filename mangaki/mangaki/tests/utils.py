@@ -0,0 +1,62 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from unittest import mock
+
+from zero.dataset import Dataset
+from zero.recommendation_algorithm import RecommendationAlgorithm
+
+from mangaki.utils.catalogue import get_works_version
+
+
+def fit_on_triplets(algo_name, nb_works=30):
+    """
+    Fit an algorithm on a small deterministic set of ratings by 7 users, on
+    work ids from 10 to `10 + nb_works`.
+    """
+    choices = ['like', 'dislike', 'favorite', 'neutral']
+    triplets = [(user_id, work_id, choices[(user_id + work_id) % 4])
+                for user_id in range(1, 8)
+                for work_id in range(10, 10 + nb_works, user_id)]
+    algo = RecommendationAlgorithm.instantiate_algorithm(algo_name)
+    algo.verbose_level = 0
+    algo.dataset = Dataset()
+    anonymized = algo.dataset.make_anonymous_data(triplets)
+    algo.set_parameters(anonymized.nb_users, anonymized.nb_works)
+    algo.fit(anonymized.X, anonymized.y)
+    return algo
+
+
+class FakeRedis:
+    """
+    The commands of Redis used by `mangaki.utils.versions`, on a dict.
+    """
+    def __init__(self):
+        self.values = {}
+
+    def incr(self, key):
+        self.values[key] = self.values.get(key, 0) + 1
+        return self.values[key]
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+
+class RedisVersionsMixin:
+    """
+    Run the tests of a TestCase with version counters, as if Redis was
+    available: without it, there are none.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._redis_patcher = mock.patch('mangaki.utils.versions._get_redis',
+                                        return_value=FakeRedis())
+        cls._redis_patcher.start()
+        get_works_version(max_age=0)  # Forget the version read without Redis
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._redis_patcher.stop()
+        get_works_version(max_age=0)
+        super().tearDownClass()
@@ -27,6 +27,7 @@ urlpatterns = [
     re_path(r'^data/(?P<category>\w+)\.json$', views.get_works, name='get-work'),
     re_path(r'^data/reco/(?P<algo_name>\w+)/(?P<merge_type>\w+)/(?P<category>\w+)\.json$', views.get_reco_algo_list, name='get-reco-algo-list'),
     re_path(r'^data/reco/(?P<algo_name>\w+)/(?P<category>\w+)\.json$', views.get_reco_algo_list, name='get-reco-algo-list'),
+    re_path(r'^metrics$', views.metrics, name='metrics'),
     re_path(r'^getuser/(?P<work_id>\w+)\.json$', views.get_user_for_recommendations, name='get-user-for-reco'),
     re_path(r'^getuser\.json$', views.get_users, name='get-user'),
     re_path(r'^getfriends\.json$', views.get_friends, name='get-friends'),
@@ -0,0 +1,106 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import threading
+import time
+
+import numpy as np
+
+from mangaki.models import Category, Work
+from mangaki.utils.embeddings import build_lookup, lookup_ids
+from mangaki.utils.versions import bump_version, get_versions
+
+WORKS_VERSION_KEY = 'works:version'
+WORKS_VERSION_MAX_AGE = 5  # Seconds
+VISIBLE = 'visible'
+# Fields of Work the masks are built from
+CATALOGUE_FIELDS = ('category_id', 'visible', 'redirect_id')
+
+# Last works version read by this process, and when
+_last_works_version = (None, None)
+
+
+def get_catalogue_state(work):
+    """
+    Values of the `CATALOGUE_FIELDS` of a work, without loading deferred ones.
+    """
+    return tuple(work.__dict__.get(field) for field in CATALOGUE_FIELDS)
+
+
+def bump_works_version():
+    """
+    Record that works changed category, visibility or were merged, so that
+    the masks of the loaded snapshots are built again.
+    """
+    global _last_works_version
+    bump_version(WORKS_VERSION_KEY)
+    _last_works_version = (None, None)  # Seen right away by this process
+
+
+def get_works_version(max_age=WORKS_VERSION_MAX_AGE):
+    """
+    Current works version, read again at most every `max_age` seconds: the
+    other processes see a bump after this delay. None without Redis (see
+    `get_versions`).
+    """
+    global _last_works_version
+    works_version, read_at = _last_works_version
+    now = time.monotonic()
+    if read_at is None or now - read_at > max_age:
+        versions = get_versions([WORKS_VERSION_KEY])
+        works_version = None if versions is None else versions[0]
+        _last_works_version = (works_version, now)
+    return works_version
+
+
+class CatalogueMasks:
+    """
+    Boolean masks over the encoded works of a snapshot: `visible` for the
+    works that can be shown (visible and not redirected), and one mask per
+    category slug.
+
+    They are built with a single query, and again only once the works
+    version changes, or without Redis once they are older than
+    `WORKS_VERSION_MAX_AGE` seconds.
+    """
+    def __init__(self, work_ids):
+        self.work_ids = np.asarray(work_ids)
+        self._lock = threading.Lock()
+        self._masks = {}
+        self._works_version = None
+        self._built_at = None
+
+    def build(self):
+        rows = list(Work.all_objects.values_list(
+            'id', 'category__slug', 'visible', 'redirect'))
+        encoded_work_ids = lookup_ids(build_lookup(self.work_ids),
+                                      [row[0] for row in rows])
+        masks = {slug: np.zeros(len(self.work_ids), dtype=bool)
+                 for slug in Category.objects.values_list('slug', flat=True)}
+        masks[VISIBLE] = np.zeros(len(self.work_ids), dtype=bool)
+        for encoded_work_id, (_, slug, visible, redirect) in zip(
+                encoded_work_ids.tolist(), rows):
+            if encoded_work_id < 0:  # Not in the snapshot
+                continue
+            masks[slug][encoded_work_id] = True
+            if visible and redirect is None:
+                masks[VISIBLE][encoded_work_id] = True
+        return masks
+
+    def get(self, name):
+        """
+        Mask `visible` or of a category slug; unknown names get an empty mask.
+        The masks are shared: copy them before modifying them.
+        """
+        works_version = get_works_version()
+        with self._lock:
+            now = time.monotonic()
+            if (self._built_at is None or works_version != self._works_version or
+                    (works_version is None and now - self._built_at > WORKS_VERSION_MAX_AGE)):
+                self._masks = self.build()
+                self._works_version = works_version
+                self._built_at = now
+            masks = self._masks
+        if name not in masks:
+            return np.zeros(len(self.work_ids), dtype=bool)
+        return masks[name]
@@ -1,23 +1,125 @@
 # SPDX-FileCopyrightText: 2014, Mangaki Authors
 # SPDX-License-Identifier: AGPL-3.0-only
 
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
 from django.db import connection
 import logging
 
+import numpy as np
+
+# Quantiles are computed over the latest durations of each stage
+NB_KEPT_DURATIONS = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_NAME = 'mangaki_stage_duration_seconds'
+
+
+class StageDurations:
+    def __init__(self):
+        self.recent = deque(maxlen=NB_KEPT_DURATIONS)
+        self.count = 0
+        self.sum = 0.
+
+
+class LatencyRecorder:
+    """
+    In-process durations of named stages (e.g. of the recommendation
+    pipeline), labeled for instance by algorithm, to follow where time goes
+    over many requests.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def observe(self, stage, seconds, **labels):
+        key = (stage, tuple(sorted(labels.items())))
+        with self._lock:
+            durations = self._stages.get(key)
+            if durations is None:
+                durations = self._stages[key] = StageDurations()
+            durations.recent.append(seconds)
+            durations.count += 1
+            durations.sum += seconds
+
+    @contextmanager
+    def time(self, stage, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def summary(self):
+        """
+        List of `(stage, labels, quantiles, count, sum)`, where `quantiles`
+        maps each of `QUANTILES` to a duration in seconds.
+        """
+        with self._lock:
+            stages = [(stage, dict(labels), np.array(durations.recent),
+                       durations.count, durations.sum)
+                      for (stage, labels), durations in sorted(self._stages.items())]
+        return [(stage, labels,
+                 dict(zip(QUANTILES, np.quantile(recent, QUANTILES).tolist())),
+                 count, total)
+                for stage, labels, recent, count, total in stages]
+
+    def export_prometheus(self):
+        """
+        Summary of the durations in the Prometheus text format.
+        """
+        lines = ['# HELP {} Duration of the stages of Mangaki code paths.'.format(METRIC_NAME),
+                 '# TYPE {} summary'.format(METRIC_NAME)]
+        for stage, labels, quantiles, count, total in self.summary():
+            labels = dict(stage=stage, **labels)
+            for quantile, seconds in quantiles.items():
+                lines.append('{}{{{}}} {!r}'.format(
+                    METRIC_NAME, format_labels(dict(labels, quantile=quantile)), seconds))
+            lines.append('{}_sum{{{}}} {!r}'.format(METRIC_NAME, format_labels(labels), total))
+            lines.append('{}_count{{{}}} {}'.format(METRIC_NAME, format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+
+
+def format_labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join('{}="{}"'.format(name, escape(value))
+                    for name, value in labels.items())
+
+
+latency_recorder = LatencyRecorder()
+
 
 class Chrono(object):
+    """
+    Time the successive stages of a code path. Every stage is recorded in
+    `latency_recorder` with the `labels` of the chrono; it is also logged if
+    the chrono is enabled.
+    """
     checkpoint = None
     connection = None
     is_enabled = True
 
-    def __init__(self, is_enabled):
+    def __init__(self, is_enabled, recorder=latency_recorder, **labels):
         self.is_enabled = is_enabled
+        self.recorder = recorder
+        self.labels = labels
         self.checkpoint = datetime.now()
 
-    def save(self, title):
+    def save(self, title, stage=None):
+        """
+        End the current stage. `stage` names it in the recorder, by default
+        `title`, which should then not contain variable parts.
+        """
+        now = datetime.now()
+        delta = now - self.checkpoint
+        self.recorder.observe(stage or title, delta.total_seconds(), **self.labels)
         if self.is_enabled:
-            now = datetime.now()
-            delta = now - self.checkpoint
             logging.info('Chrono: %s [%dq, %dms]', title, len(connection.queries), round(delta.total_seconds() * 1000))
-            self.checkpoint = now
+        self.checkpoint = now
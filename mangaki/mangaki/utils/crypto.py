@@ -1,4 +1,4 @@
-from collections import defaultdict
+from math import isqrt
 from random import randint
 import numpy as np
 
@@ -25,6 +25,25 @@ def expmod(a, b, q=PRIME):
     return result
 
 
+def vexpmod(a, b, q=PRIME):
+    """Vectorized expmod over arrays, broadcast together
+    :param a b: arrays of non negative integers
+    :param int q: positive, such that q ** 2 fits in an int64
+    :complexity: O(log max(b)) array operations
+    """
+    a = np.asarray(a, dtype=np.int64) % q
+    b = np.array(b, dtype=np.int64)
+    assert (b >= 0).all()
+    a, b = np.broadcast_arrays(a, b)
+    b = b.copy()
+    result = np.ones(b.shape, dtype=np.int64)
+    while b.any():
+        result = np.where(b & 1, result * a % q, result)
+        a = a * a % q
+        b >>= 1
+    return result
+
+
 def bezout(a, b):
     """Bézout coefficients for a and b
     :param a,b: non-negative integers
@@ -44,61 +63,125 @@ def inv(a, p=PRIME):
     return bezout(a, p)[0] % p
 
 
+def prime_factors(n):
+    """Distinct prime factors of n, by trial division
+    :complexity: O(sqrt(n))
+    """
+    factors = []
+    d = 2
+    while d * d <= n:
+        if n % d == 0:
+            factors.append(d)
+            while n % d == 0:
+                n //= d
+        d += 1
+    if n > 1:
+        factors.append(n)
+    return factors
+
+
+PRIME_MINUS_ONE_FACTORS = prime_factors(PRIME - 1)
+
+
+def random_generator(p=PRIME):
+    """Random primitive root modulo p: its powers g^0 ... g^(p - 2) are distinct
+    :complexity: O(log p) expected tries
+    """
+    while True:
+        g = randint(2, p - 2)
+        if all(expmod(g, (p - 1) // factor, p) != 1
+               for factor in PRIME_MINUS_ONE_FACTORS):
+            return g
+
+
+def discrete_log(g, values, max_value, q=PRIME):
+    """Vectorized baby-step giant-step: x in [-max_value, max_value] such that
+    (g pow x) % q == value, for every value; no table of every power of g
+    :param int g: primitive root modulo q
+    :param values: array of non negative integers
+    :raises ValueError: if a value is not a power of g in this range
+    :complexity: O(sqrt(max_value) log sqrt(max_value)) array operations
+    """
+    values = np.asarray(values, dtype=np.int64)
+    size = 2 * max_value + 1
+    m = isqrt(size - 1) + 1  # m ** 2 >= size
+    baby_steps = vexpmod(g, np.arange(m), q)  # g ** j
+    order = np.argsort(baby_steps)
+    sorted_baby_steps = baby_steps[order]
+    giant_step = expmod(g, (q - 1 - m) % (q - 1), q)  # g ** -m
+
+    # value * g ** max_value = g ** (i * m + j) for the solution x + max_value
+    gamma = values * expmod(g, max_value, q) % q
+    logs = np.full(len(values), -1, dtype=np.int64)
+    for i in range(m):
+        positions = np.minimum(np.searchsorted(sorted_baby_steps, gamma), m - 1)
+        found = (sorted_baby_steps[positions] == gamma) & (logs < 0)
+        logs[found] = i * m + order[positions[found]]
+        if (logs >= 0).all():
+            break
+        gamma = gamma * giant_step % q
+    if ((logs < 0) | (logs >= size)).any():
+        raise ValueError('Some values are not in [-{0}, {0}]'.format(max_value))
+    return logs - max_value
+
+
 class HomomorphicEncryption:
+    """
+    Additively homomorphic ElGamal: the messages are encrypted as powers of
+    g, so that the product of the ciphertexts of several users decrypts to
+    the sum of their messages, as long as it stays in [-MAX_VALUE, MAX_VALUE].
+
+    Every operation works on whole embedding vectors at once.
+    """
     def __init__(self, user_ids, quantize_round=0, MAX_VALUE=10):
+        assert 2 * MAX_VALUE + 1 < PRIME - 1  # Otherwise PRIME is too small
         self.user_ids = user_ids
         self.quantize_round = quantize_round
-        self.g = randint(2, PRIME - 1)
+        self.MAX_VALUE = MAX_VALUE
+        self.g = random_generator()
+        self._rng = np.random.default_rng()
         self._keygen()
         self._shares = {}
-        self._encode(MAX_VALUE)
 
     def _keygen(self):
         self._sk = {user: randint(2, PRIME - 2) for user in self.user_ids}
         self._pk = {user: expmod(self.g, self._sk[user]) for user in self.user_ids}
 
-    def _encode(self, MAX_VALUE):
-        self.encode = {x: expmod(self.g, x) for x in range(0, MAX_VALUE + 1)}
-        for x in range(1, MAX_VALUE + 1):
-            self.encode[-x] = inv(self.encode[x])
-        self.decode = {v: k for k, v in self.encode.items()}
-        assert len(self.encode) == len(self.decode)  # Otherwise PRIME is too small
+    def _encrypt(self, user_id, messages):
+        r = self._rng.integers(0, PRIME - 1, size=len(messages))
+        c1 = vexpmod(self.g, r)
+        # g ** (PRIME - 1) == 1, hence g ** -x == g ** (PRIME - 1 - x)
+        encoded = vexpmod(self.g, messages % (PRIME - 1))
+        return c1, encoded * vexpmod(self._pk[user_id], r) % PRIME
 
     def encrypt(self, user_id, message: int):
-        r = randint(0, PRIME)
-        c1 = expmod(self.g, r)
-        return c1, (self.encode[message] * expmod(self._pk[user_id], r)) % PRIME
+        c1, c2 = self._encrypt(user_id, np.array([message], dtype=np.int64))
+        return int(c1[0]), int(c2[0])
 
     def encrypt_embeddings(self, user_id, parameters):
         mean, feat = parameters
-        feat = np.array(feat)
+        values = np.concatenate(([mean], np.asarray(feat, dtype=float)))
         if self.quantize_round:
-            mean = int((10 ** self.quantize_round) * mean.round(self.quantize_round))
-            feat = ((10 ** self.quantize_round) * feat.round(self.quantize_round)).astype(int)
-        encrypted = []
-        self._shares[user_id] = np.zeros(1 + len(feat), dtype=int)
-        for dim, value in enumerate([mean] + feat.tolist()):
-            c1, c2 = self.encrypt(user_id, value)
-            self._shares[user_id][dim] = expmod(c1, self._sk[user_id])
-            encrypted.append(c2)
-        return np.array(encrypted)
+            values = (10 ** self.quantize_round) * values.round(self.quantize_round)
+        values = np.rint(values).astype(np.int64)
+        c1, c2 = self._encrypt(user_id, values)
+        self._shares[user_id] = vexpmod(c1, self._sk[user_id])
+        return c2
 
     def combine_embeddings(self, encrypted_embeddings):
-        combined = np.ones_like(encrypted_embeddings[0])
+        combined = np.ones_like(encrypted_embeddings[0], dtype=np.int64)
         for encrypted_embedding in encrypted_embeddings:
-            combined *= encrypted_embedding
-            combined %= PRIME
-        self._combined_shares = np.ones_like(encrypted_embeddings[0])
+            combined = combined * encrypted_embedding % PRIME
+        self._combined_shares = np.ones_like(combined)
         for user_id in self.user_ids:
-            self._combined_shares *= self._shares[user_id]
-            self._combined_shares %= PRIME
+            self._combined_shares = self._combined_shares * self._shares[user_id] % PRIME
         return combined
 
     def decrypt_embeddings(self, encrypted_embeddings):
         combined = self.combine_embeddings(encrypted_embeddings)
-        inversed_shares = [inv(value) for value in self._combined_shares]
-        decrypted = (combined * inversed_shares) % PRIME
-        decoded = np.array([self.decode[value] for value in decrypted], dtype=float)
+        inversed_shares = vexpmod(self._combined_shares, PRIME - 2)  # Fermat
+        decrypted = combined * inversed_shares % PRIME
+        decoded = discrete_log(self.g, decrypted, self.MAX_VALUE).astype(float)
         if self.quantize_round:
             decoded /= 10 ** self.quantize_round
         return decoded[0], decoded[1:]  # Mean, feat
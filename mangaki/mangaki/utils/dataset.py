@@ -0,0 +1,106 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from collections import namedtuple
+
+import numpy as np
+from zero.dataset import RATED_BY_AT_LEAST, AnonymizedData
+
+from mangaki.utils.values import rating_values
+
+CHOICES = tuple(rating_values)
+CHOICE_VALUES = np.array([rating_values[choice] for choice in CHOICES],
+                         dtype=np.float32)
+CHOICE_CODES = {choice: code for code, choice in enumerate(CHOICES)}
+TRIPLETS_CHUNK_SIZE = 100000
+
+
+# Ratings to train on, with the (naive, local) time and the ratings version of
+# every user, both taken before reading the ratings: see `load_training_ratings`
+TrainingRatings = namedtuple('TrainingRatings', 'rating_arrays datetime ratings_versions')
+
+
+class RatingArrays(namedtuple('RatingArrays', 'user_ids work_ids choices')):
+    """
+    Ratings as three aligned arrays: `choices` holds the index of each
+    choice in `CHOICES`, which is much lighter than one tuple per rating.
+    """
+    @classmethod
+    def from_triplets(cls, triplets, size_hint=0):
+        """
+        Fill the arrays chunk by chunk from any iterable of (user_id, work_id,
+        choice), e.g. a streamed queryset. `size_hint` is the expected number
+        of triplets, to allocate the arrays once.
+        """
+        capacity = max(size_hint, TRIPLETS_CHUNK_SIZE)
+        user_ids = np.empty(capacity, dtype=np.int32)
+        work_ids = np.empty(capacity, dtype=np.int32)
+        choices = np.empty(capacity, dtype=np.int8)
+        size = 0
+        chunk = []
+        triplets = iter(triplets)
+        while True:
+            chunk.clear()
+            for triplet in triplets:
+                chunk.append(triplet)
+                if len(chunk) == TRIPLETS_CHUNK_SIZE:
+                    break
+            if not chunk:
+                break
+            if size + len(chunk) > capacity:  # More ratings than expected
+                capacity = max(2 * capacity, size + len(chunk))
+                user_ids = np.resize(user_ids, capacity)
+                work_ids = np.resize(work_ids, capacity)
+                choices = np.resize(choices, capacity)
+            chunk_user_ids, chunk_work_ids, chunk_choices = zip(*chunk)
+            user_ids[size:size + len(chunk)] = chunk_user_ids
+            work_ids[size:size + len(chunk)] = chunk_work_ids
+            choices[size:size + len(chunk)] = [CHOICE_CODES[choice]
+                                               for choice in chunk_choices]
+            size += len(chunk)
+        return cls(user_ids[:size].copy(), work_ids[:size].copy(),
+                   choices[:size].copy())
+
+    @property
+    def ratings(self):
+        return CHOICE_VALUES[self.choices]
+
+    def __len__(self):
+        return len(self.user_ids)
+
+
+def make_anonymous_data(dataset, rating_arrays, ordered=False, with_text=False):
+    """
+    Vectorized `zero.dataset.Dataset.make_anonymous_data` for `RatingArrays`:
+    fill the encodings of `dataset` and return its anonymized data, with
+    ratings as float32. The text of the choices (`y_text`) is only built if
+    `with_text` is set, e.g. to save the dataset as CSV.
+    """
+    order = np.random.permutation(len(rating_arrays))  # Scramble time
+    users, user_indices = np.unique(rating_arrays.user_ids, return_inverse=True)
+    works, work_indices = np.unique(rating_arrays.work_ids, return_inverse=True)
+    nb_ratings = np.bincount(work_indices, minlength=len(works))
+
+    anonymous_u = np.random.permutation(len(users))
+    if ordered:  # Most rated works first
+        anonymous_w = np.empty(len(works), dtype=np.int64)
+        anonymous_w[np.argsort(-nb_ratings, kind='stable')] = np.arange(len(works))
+    else:
+        anonymous_w = np.random.permutation(len(works))
+    dataset.encode_user = dict(zip(users.tolist(), anonymous_u.tolist()))
+    dataset.decode_user = dict(zip(anonymous_u.tolist(), users.tolist()))
+    dataset.encode_work = dict(zip(works.tolist(), anonymous_w.tolist()))
+    dataset.decode_work = dict(zip(anonymous_w.tolist(), works.tolist()))
+    dataset.interesting_works = set(
+        works[nb_ratings >= RATED_BY_AT_LEAST].tolist())
+
+    choices = rating_arrays.choices[order]
+    dataset.anonymized = AnonymizedData(
+        X=np.column_stack((anonymous_u[user_indices[order]],
+                           anonymous_w[work_indices[order]])).astype(np.int32),
+        y=CHOICE_VALUES[choices],
+        y_text=np.array(CHOICES)[choices] if with_text else None,
+        nb_users=len(users),
+        nb_works=len(works)
+    )
+    return dataset.anonymized
@@ -6,7 +6,7 @@ from random import sample
 import numpy as np
 
 from mangaki.utils import dpplib
-from mangaki.utils.fit_algo import get_algo_backup
+from mangaki.utils.fit_algo import get_embeddings
 
 
 class MangakiUniform:
@@ -22,24 +22,32 @@ class MangakiDPP:
         self.work_ids = np.array(work_ids)
         self.vectors = vectors
 
-    def compute_similarity(self):
-        self.L = self.vectors.dot(self.vectors.T)
-
     def load_from_algo(self, algo_name):
-        algo = get_algo_backup(algo_name)
-        available_work_ids = list(set(self.work_ids) & set(algo.dataset.encode_work.keys()))
-        self.work_ids = np.array(available_work_ids)
-        self.vectors = algo.VT.T[algo.dataset.encode_works(available_work_ids)]
+        embeddings = get_embeddings(algo_name)
+        encoded_work_ids = embeddings.encode_works(self.work_ids)
+        is_available = encoded_work_ids >= 0
+        self.work_ids = self.work_ids[is_available]
+        self.vectors = np.asarray(
+            embeddings.item_vectors[encoded_work_ids[is_available]],
+            dtype=np.float64)
         self.preprocess()
 
     def preprocess(self, indices=None):
-        self.compute_similarity()
+        """
+        Decompose the dual kernel of the vectors (of the given indices), of
+        the size of the embeddings: the N x N similarity is never formed, so
+        that large pools of works can be sampled from.
+        """
         if indices is None:
-            indices = list(range(len(self.vectors)))
-        D, V = np.linalg.eig(self.L[np.ix_(indices, indices)])
-        self.D = np.real(D)
-        self.V = np.real(V)
+            indices = np.arange(len(self.vectors))
+        self.indices = np.asarray(indices, dtype=int)
+        self.B = np.asarray(self.vectors, dtype=np.float64)[self.indices]
+        self.D, self.W = dpplib.dual_decomposition(self.B)
 
     def sample_k(self, k):
-        sampled_indices = [int(index) for index in dpplib.sample_k(k, self.D, self.V)]
-        return self.work_ids[sampled_indices]
+        """
+        Sample k diverse works, or fewer if the embeddings have fewer
+        dimensions.
+        """
+        sampled_indices = dpplib.sample_k_dual(k, self.D, self.W, self.B)
+        return self.work_ids[self.indices[sampled_indices]]
@@ -5,17 +5,24 @@ import numpy as np
 
 
 def esym_poly(k, lam):
+  """
+  E[l, n] is the elementary symmetric polynomial of degree l of lam[:n].
+  Each row follows from the previous one by the recurrence
+  E[l, n] = E[l, n-1] + lam[n-1]*E[l-1, n-1], i.e. a cumulative sum.
+  """
   N = lam.size
   E = np.zeros((k+1, N+1))
-  E[0, :] = np.ones((1, N+1))
+  E[0, :] = 1
   for l in range(1, k+1):
-    for n in range(1, N+1):
-      E[l, n] = E[l, n-1] + lam[n-1]*E[l-1, n-1]
+    np.cumsum(lam*E[l-1, :-1], out=E[l, 1:])
 
   return E
 
 
-def sample_k(k, lam, V_full):
+def sample_eigenvalues(k, lam):
+  """
+  Indices of the eigenvalues lam that span a sample of the k-DPP.
+  """
   E = esym_poly(k, lam)
   J = []
   remaining = k-1
@@ -37,23 +44,30 @@ def sample_k(k, lam, V_full):
     
     i = i-1
 
-  k = len(J)-1
-  Y = np.zeros((len(J), 1))
-  V = V_full[:, J]
+  return J
+
+
+def sample_elementary(V):
+  """
+  Sample the elementary DPP whose kernel is spanned by the orthonormal
+  columns of V: one item per column.
+  """
+  k = V.shape[1]-1
+  Y = np.zeros(V.shape[1], dtype=int)
 
   for i in range(k, -1, -1):
     # Sample
     Pr = np.sum(V**2, axis=1)
     Pr = Pr/sum(Pr)
     C = np.cumsum(Pr)
-    jj = np.argwhere(np.random.rand() <= C)[0]
-    Y[i] = jj
+    y = min(int(np.searchsorted(C, np.random.rand())), C.size-1)
+    Y[i] = y
 
     # Update V 
-    j = np.argwhere(V[int(Y[i]), :])[0]
+    j = np.flatnonzero(V[y, :])[0]
     Vj = V[:, j]
     V = np.delete(V, j, 1)
-    V = V - np.outer(Vj, V[int(Y[i]), :]/Vj[int(Y[i])])
+    V = V - np.outer(Vj, V[y, :]/Vj[y])
 
     # QR decomposition, which is more numerically stable (and faster) than Gram
     # Schmidt
@@ -61,3 +75,32 @@ def sample_k(k, lam, V_full):
       V, r = np.linalg.qr(V)
 
   return Y
+
+
+def sample_k(k, lam, V_full):
+  """
+  Sample k items from the k-DPP of kernel V_full . diag(lam) . V_full^T.
+  """
+  return sample_elementary(V_full[:, sample_eigenvalues(k, lam)])
+
+
+def dual_decomposition(B):
+  """
+  Eigendecomposition of the dual kernel B^T . B, of size d x d, instead of
+  the N x N kernel L = B . B^T of the same nonzero eigenvalues. Only the
+  nonzero eigenvalues are kept, at most d.
+  """
+  lam, W = np.linalg.eigh(B.T.dot(B))
+  is_nonzero = lam > lam.max(initial=0)*max(B.shape)*np.finfo(float).eps
+  return lam[is_nonzero], W[:, is_nonzero]
+
+
+def sample_k_dual(k, lam, W, B):
+  """
+  Sample k items (or as many as the rank of L if it is lower) from the k-DPP
+  of kernel L = B . B^T, given the dual decomposition of L. The
+  eigenvectors of L are only computed for the sampled eigenvalues:
+  u = B . w / sqrt(lam), in O(N d k) instead of O(N^3) for L itself.
+  """
+  J = sample_eigenvalues(min(k, lam.size), lam)
+  return sample_elementary(B.dot(W[:, J])/np.sqrt(lam[J]))
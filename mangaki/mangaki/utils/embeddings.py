@@ -0,0 +1,166 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import os
+import shutil
+
+import numpy as np
+
+
+EMBEDDINGS_SUFFIX = '.embeddings'
+
+
+def build_lookup(ids):
+    """
+    Build the inverse of an array of non-negative ids: `lookup[ids[i]] == i`,
+    and -1 for the ids that are not in the array.
+    """
+    lookup = np.full(int(ids.max()) + 1 if len(ids) else 0, -1, dtype=np.int32)
+    lookup[ids] = np.arange(len(ids), dtype=np.int32)
+    return lookup
+
+
+def save_arrays(path, arrays):
+    """
+    Write every array of a dict as a `.npy` file in the directory `path`.
+    The new directory replaces the previous one only once it is complete.
+    """
+    tmp_path = '{}.tmp-{}'.format(path, os.getpid())
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, name + '.npy'), array)
+    old_path = '{}.old-{}'.format(path, os.getpid())
+    if os.path.isdir(path):
+        # Workers that mapped the previous arrays keep reading them
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def load_arrays(path, names, mmap_mode='r'):
+    """
+    Read the arrays written by `save_arrays`, as a dict.
+
+    Raises FileNotFoundError if one of them does not exist.
+    """
+    return {name: np.load(os.path.join(path, name + '.npy'),
+                          mmap_mode=mmap_mode)
+            for name in names}
+
+
+def lookup_ids(lookup, ids):
+    """
+    Vectorized lookup of ids in an array built by `build_lookup`; the ids
+    that are out of bounds or unknown are mapped to -1.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    encoded = np.full(len(ids), -1, dtype=np.int32)
+    in_bounds = (ids >= 0) & (ids < len(lookup))
+    encoded[in_bounds] = lookup[ids[in_bounds]]
+    return encoded
+
+
+class EmbeddingSnapshot:
+    """
+    Factors of a matrix factorization model, stored as raw float32 arrays so
+    that they can be memory-mapped and shared by every worker through the page
+    cache, instead of each worker unpickling its own copy of the algorithm.
+
+    Row `i` of `item_vectors` (resp. `user_vectors`, `user_means`) belongs to
+    the encoded work (resp. user) `i`, whose actual id is `work_ids[i]`
+    (resp. `user_ids[i]`). The predicted rating of a known user for a work is
+    `user_means[u] + user_vectors[u] @ item_vectors[w]`.
+    """
+    ARRAYS = ('item_vectors', 'user_vectors', 'user_means',
+              'work_ids', 'user_ids', 'work_popularity')
+
+    def __init__(self, item_vectors, user_vectors, user_means,
+                 work_ids, user_ids, work_popularity):
+        self.item_vectors = item_vectors
+        self.user_vectors = user_vectors
+        self.user_means = user_means
+        self.work_ids = work_ids
+        self.user_ids = user_ids
+        self.work_popularity = work_popularity
+        self.work_lookup = build_lookup(work_ids)
+        self.user_lookup = build_lookup(user_ids)
+
+    @staticmethod
+    def is_supported(algo):
+        return (getattr(algo, 'U', None) is not None and
+                getattr(algo, 'VT', None) is not None)
+
+    @classmethod
+    def from_algo(cls, algo):
+        """
+        Extract the embeddings of a fitted ALS or SVD algorithm.
+        """
+        if not cls.is_supported(algo):
+            raise ValueError('{} has no embeddings'.format(algo))
+        dataset = algo.dataset
+        user_vectors = algo.U
+        sigma = getattr(algo, 'sigma', None)
+        if sigma is not None:  # SVD: M = U . diag(sigma) . VT
+            user_vectors = user_vectors * sigma
+        return cls(
+            item_vectors=np.ascontiguousarray(algo.VT.T, dtype=np.float32),
+            user_vectors=np.ascontiguousarray(user_vectors, dtype=np.float32),
+            user_means=np.asarray(algo.means, dtype=np.float32),
+            work_ids=np.array([dataset.decode_work[i]
+                               for i in range(len(dataset.decode_work))],
+                              dtype=np.int32),
+            user_ids=np.array([dataset.decode_user[i]
+                               for i in range(len(dataset.decode_user))],
+                              dtype=np.int32),
+            work_popularity=np.bincount(
+                dataset.anonymized.X[:, 1].astype(np.int64),
+                minlength=len(dataset.decode_work)).astype(np.int32)
+        )
+
+    @staticmethod
+    def get_path(folder, shortname):
+        return os.path.join(folder, shortname + EMBEDDINGS_SUFFIX)
+
+    def save(self, path):
+        save_arrays(path, {name: getattr(self, name) for name in self.ARRAYS})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        This function raises FileNotFoundError if no snapshot exists.
+        """
+        return cls(**load_arrays(path, cls.ARRAYS, mmap_mode))
+
+    @property
+    def nb_works(self):
+        return len(self.work_ids)
+
+    def encode_works(self, work_ids):
+        """
+        Encoded indices of the given work ids, -1 for the unknown ones.
+        """
+        return lookup_ids(self.work_lookup, work_ids)
+
+    def encode_user(self, user_id):
+        """
+        Encoded index of a user, or None if the user was not in the training
+        set.
+        """
+        encoded_user_id = lookup_ids(self.user_lookup, [user_id])[0]
+        return None if encoded_user_id < 0 else int(encoded_user_id)
+
+    def predict_user(self, user_id, work_ids):
+        """
+        Predicted ratings of a known user for some works.
+
+        Raises KeyError if the user or one of the works is unknown.
+        """
+        encoded_user_id = self.encode_user(user_id)
+        if encoded_user_id is None:
+            raise KeyError(user_id)
+        encoded_work_ids = self.encode_works(work_ids)
+        if (encoded_work_ids < 0).any():
+            raise KeyError(np.asarray(work_ids)[encoded_work_ids < 0][0])
+        return (self.user_means[encoded_user_id] +
+                self.item_vectors[encoded_work_ids] @
+                self.user_vectors[encoded_user_id])
@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import os
+import tempfile
+import time
+
+import numpy as np
+from django.test.utils import override_settings
+from zero.dataset import Dataset
+
+from mangaki.utils.dataset import CHOICE_CODES, RatingArrays, make_anonymous_data
+from mangaki.utils.embeddings import EmbeddingSnapshot
+from mangaki.utils.fit_algo import fit_encoded_algo, get_item_index
+
+RELEVANT_CHOICES = ('favorite', 'like')
+RANKING_CHUNK_SIZE = 256
+
+
+def time_split(nb_ratings, nb_folds):
+    """
+    Forward-chaining folds over ratings sorted by date: the ratings are cut
+    into `nb_folds + 1` consecutive chunks, and fold `i` trains on the first
+    `i + 1` chunks and tests on the next one. Returns (train, test) slices.
+    """
+    bounds = np.linspace(0, nb_ratings, nb_folds + 2).astype(int)
+    return [(slice(0, bounds[fold + 1]), slice(bounds[fold + 1], bounds[fold + 2]))
+            for fold in range(nb_folds)]
+
+
+def slice_ratings(rating_arrays, selection):
+    return RatingArrays(*(array[selection] for array in rating_arrays))
+
+
+def precision_at_k(hits):
+    """
+    Mean precision of boolean rankings of shape (nb_users, k).
+    """
+    return float(hits.mean()) if hits.size else 0.
+
+
+def ndcg_at_k(hits, nb_relevant):
+    """
+    Mean NDCG of boolean rankings of shape (nb_users, k), given the number of
+    relevant items of each user (at least one).
+    """
+    if not hits.size:
+        return 0.
+    discounts = 1 / np.log2(np.arange(2, hits.shape[1] + 2))
+    dcg = hits @ discounts
+    ideal_dcg = np.cumsum(discounts)[np.minimum(nb_relevant, hits.shape[1]) - 1]
+    return float((dcg / ideal_dcg).mean())
+
+
+def iter_user_scores(algo, users, embeddings=None):
+    """
+    Predicted ratings of every work, for chunks of encoded users.
+    """
+    for start in range(0, len(users), RANKING_CHUNK_SIZE):
+        chunk = users[start:start + RANKING_CHUNK_SIZE]
+        if embeddings is not None:
+            scores = (embeddings.user_vectors[chunk] @ embeddings.item_vectors.T +
+                      embeddings.user_means[chunk, None])
+        else:
+            X = np.column_stack((np.repeat(chunk, algo.nb_works),
+                                 np.tile(np.arange(algo.nb_works), len(chunk))))
+            scores = algo.predict(X).reshape(len(chunk), algo.nb_works)
+        yield chunk, scores
+
+
+def evaluate_fold(algo_name, train, test, k=10, nb_candidates=None):
+    """
+    Fit an algorithm on `train` (`RatingArrays`) in a throwaway snapshot
+    folder, and measure on `test`:
+
+    - the RMSE of the ratings of users and works seen in training;
+    - the precision and NDCG at `k` of the ranking of the works unrated in
+      training, where relevant works are the ones liked in `test`;
+    - if `nb_candidates` is given and the algorithm has an item index, the
+      same ranking metrics restricted to the candidates of the index;
+    - the fit time, prediction throughput and snapshot size.
+    """
+    dataset = Dataset()
+    make_anonymous_data(dataset, train)
+    with tempfile.TemporaryDirectory() as folder, \
+            override_settings(ML_SNAPSHOT_ROOT=folder):
+        start = time.perf_counter()
+        algo = fit_encoded_algo(algo_name, dataset, dump_viz=False)
+        fit_time = time.perf_counter() - start
+        snapshot_size = sum(os.path.getsize(os.path.join(root, filename))
+                            for root, _, filenames in os.walk(folder)
+                            for filename in filenames)
+        embeddings = None
+        item_index = None
+        if EmbeddingSnapshot.is_supported(algo):
+            embeddings = EmbeddingSnapshot.from_algo(algo)
+            if nb_candidates is not None and algo.is_serializable:
+                item_index = get_item_index(algo.get_shortname())
+
+        users = np.array([dataset.encode_user.get(user_id, -1)
+                          for user_id in test.user_ids.tolist()], dtype=np.int64)
+        works = np.array([dataset.encode_work.get(work_id, -1)
+                          for work_id in test.work_ids.tolist()], dtype=np.int64)
+        known = (users >= 0) & (works >= 0)
+        users, works = users[known], works[known]
+        X_test = np.column_stack((users, works))
+        start = time.perf_counter()
+        y_pred = algo.predict(X_test) if len(X_test) else np.array([])
+        predict_time = time.perf_counter() - start
+        y_test = test.ratings[known]
+
+        is_relevant = np.isin(test.choices[known], [CHOICE_CODES[choice]
+                                                    for choice in RELEVANT_CHOICES])
+        relevant = {}
+        for user, work in zip(users[is_relevant].tolist(), works[is_relevant].tolist()):
+            relevant.setdefault(user, set()).add(work)
+        rated = {}
+        for user, work in dataset.anonymized.X.tolist():
+            if user in relevant:
+                rated.setdefault(user, []).append(work)
+        ranked_users = np.array(sorted(relevant), dtype=np.int64)
+        nb_relevant = np.array([len(relevant[user]) for user in ranked_users.tolist()],
+                               dtype=np.int64)
+
+        k = min(k, algo.nb_works)
+        hits = np.zeros((len(ranked_users), k))
+        index_hits = np.zeros((len(ranked_users), k))
+        row = 0
+        for chunk, scores in iter_user_scores(algo, ranked_users, embeddings):
+            for user, user_scores in zip(chunk.tolist(), scores):
+                user_scores[rated[user]] = -np.inf
+                top = np.argsort(-user_scores, kind='stable')[:k]
+                hits[row] = [work in relevant[user] for work in top.tolist()]
+                if item_index is not None:
+                    candidates = embeddings.encode_works(item_index.search(
+                        embeddings.user_vectors[user], nb_candidates))
+                    candidates = candidates[candidates >= 0]
+                    candidates = candidates[np.argsort(-user_scores[candidates],
+                                                       kind='stable')][:k]
+                    index_hits[row, :len(candidates)] = [
+                        work in relevant[user] and np.isfinite(user_scores[work])
+                        for work in candidates.tolist()]
+                row += 1
+
+    results = {
+        'algo': algo_name,
+        'nb_train': len(train),
+        'nb_test': len(test),
+        'coverage': float(known.mean()) if len(known) else 0.,
+        'nb_ranked_users': len(ranked_users),
+        'rmse': float(algo.compute_rmse(y_pred, y_test)) if len(y_test) else None,
+        'precision@k': precision_at_k(hits),
+        'ndcg@k': ndcg_at_k(hits, nb_relevant),
+        'fit_s': fit_time,
+        'predictions_per_s': len(X_test) / predict_time if predict_time else None,
+        'snapshot_bytes': snapshot_size,
+    }
+    if item_index is not None:
+        results['index_precision@k'] = precision_at_k(index_hits)
+        results['index_ndcg@k'] = ndcg_at_k(index_hits, nb_relevant)
+    return results
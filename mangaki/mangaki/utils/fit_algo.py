@@ -1,44 +1,179 @@
 # SPDX-FileCopyrightText: 2014, Mangaki Authors
 # SPDX-License-Identifier: AGPL-3.0-only
 
+import os
+
 from django.conf import settings
 
 from zero.dataset import Dataset
 from zero.recommendation_algorithm import RecommendationAlgorithm
+from mangaki.utils.dataset import RatingArrays, TrainingRatings, make_anonymous_data
+from mangaki.utils.embeddings import EmbeddingSnapshot
+from mangaki.utils.item_index import InvertedFileIndex
+from mangaki.utils.model_registry import model_registry
+from mangaki.utils.snapshots import get_snapshot_path, publish_snapshot, resolve_snapshot_path
 from mangaki.utils.viz import dump_2d_embeddings
 
 
 def fit_algo(algo_name, triplets, titles=None, categories=None,
              output_csv=False):
-    algo = RecommendationAlgorithm.instantiate_algorithm(algo_name)
-    algo.dataset = Dataset()
+    """
+    Fit an algorithm on ratings given as `TrainingRatings` (see
+    `load_training_ratings`), `RatingArrays` or any iterable of (user_id,
+    work_id, choice).
+    """
+    dataset = make_dataset(triplets, titles, categories, output_csv)
+    return fit_encoded_algo(algo_name, dataset, output_csv)
+
+
+def make_dataset(triplets, titles=None, categories=None, with_text=False):
+    """
+    Encode ratings given like for `fit_algo` into a new dataset. Only
+    `TrainingRatings` tell when the ratings were read: otherwise, the
+    dataset is assumed to be as recent as its creation.
+    """
+    dataset = Dataset()
 
     if titles is not None:
-        algo.dataset.titles = dict(titles)
+        dataset.titles = dict(titles)
     if categories is not None:
-        algo.dataset.categories = dict(categories)
+        dataset.categories = dict(categories)
 
-    anonymized = algo.dataset.make_anonymous_data(triplets)
+    if isinstance(triplets, TrainingRatings):
+        dataset.datetime = triplets.datetime
+        dataset.ratings_versions = triplets.ratings_versions
+        triplets = triplets.rating_arrays
+    if not isinstance(triplets, RatingArrays):
+        triplets = RatingArrays.from_triplets(triplets)
+    make_anonymous_data(dataset, triplets, with_text=with_text)
+    return dataset
+
+
+def fit_encoded_algo(algo_name, dataset, output_csv=False, dump_viz=True):
+    """
+    Fit an algorithm on a dataset already encoded by `make_anonymous_data`,
+    which can be shared by several algorithms.
+    """
+    algo = RecommendationAlgorithm.instantiate_algorithm(algo_name)
+    algo.dataset = dataset
+    anonymized = dataset.anonymized
     algo.set_parameters(anonymized.nb_users, anonymized.nb_works)
     algo.fit(anonymized.X, anonymized.y)
 
+    save_fitted_algo(algo_name, algo, output_csv, dump_viz)
+    return algo
+
+
+def save_fitted_algo(algo_name, algo, output_csv=False, dump_viz=True):
+    """
+    Publish a new version of the snapshot of a fitted algorithm, along with
+    its embeddings and item index (see `mangaki.utils.snapshots`), make it
+    available to this process and dump its visualization.
+    """
+    embeddings = None
+    if EmbeddingSnapshot.is_supported(algo):
+        embeddings = EmbeddingSnapshot.from_algo(algo)
+
     if algo.is_serializable:
-        algo.save(settings.ML_SNAPSHOT_ROOT)
+        shortname = algo.get_shortname()
+
+        def write_files(folder):
+            algo.save(folder)
+            if embeddings is not None:
+                embeddings.save(EmbeddingSnapshot.get_path(folder, shortname))
+                InvertedFileIndex.build(
+                    embeddings.item_vectors, embeddings.work_ids).save(
+                    InvertedFileIndex.get_path(folder, shortname))
+
+        anonymized = algo.dataset.anonymized
+        publish_snapshot(shortname, write_files, algo=algo_name,
+                         nb_ratings=None if anonymized is None else len(anonymized.y),
+                         nb_users=algo.nb_users, nb_works=algo.nb_works)
+        algo.backup_path = get_snapshot_path(shortname,
+                                             get_backup_filename(algo))
+        # Web processes sharing this registry do not need to reload it
+        model_registry.register(algo.backup_path, algo)
         if output_csv:
             algo.dataset.save_csv(settings.DATA_ROOT)
 
     # Save visualization
-    if algo_name in {'als', 'svd'}:
-        dump_2d_embeddings(algo, f'points-{algo_name}.json')
+    if embeddings is not None and dump_viz and algo_name in {'als', 'svd'}:
+        dump_2d_embeddings(embeddings, f'points-{algo_name}.json')
+
+
+def get_backup_filename(algo):
+    return os.path.basename(algo.get_backup_path('', None))
+
 
+def load_snapshot(algo, path):
+    """
+    Load `algo` from the snapshot at `path`, checked against its manifest.
+    """
+    path = resolve_snapshot_path(path)
+    algo.load(os.path.dirname(path), os.path.basename(path))
     return algo
 
 
+def load_algo_backup(algo_name):
+    """
+    Load a fresh copy of an algorithm from its current snapshot, bypassing
+    the registry. Use it when the algorithm is going to be modified.
+    """
+    algo = RecommendationAlgorithm.instantiate_algorithm(algo_name)
+    if not algo.is_serializable:
+        raise RuntimeError('"{}" is not serializable, cannot load a backup!'
+                           .format(algo_name))
+
+    return load_snapshot(algo, get_snapshot_path(algo.get_shortname(),
+                                                 get_backup_filename(algo)))
+
+
 def get_algo_backup(algo_name):
+    """
+    Get the algorithm from its current snapshot, shared by every request of
+    this process until a new version becomes current.
+
+    The returned algorithm must be treated as read-only.
+    """
     algo = RecommendationAlgorithm.instantiate_algorithm(algo_name)
     if not algo.is_serializable:
         raise RuntimeError('"{}" is not serializable, cannot load a backup!'
                            .format(algo_name))
 
-    algo.load(settings.ML_SNAPSHOT_ROOT)
-    return algo
+    return model_registry.get(
+        get_snapshot_path(algo.get_shortname(), get_backup_filename(algo)),
+        lambda path: load_snapshot(
+            RecommendationAlgorithm.instantiate_algorithm(algo_name), path))
+
+
+def get_embeddings(algo_name):
+    """
+    Get the memory-mapped embeddings written by `fit_algo` next to the
+    snapshot of the algorithm, or extract them from the snapshot itself if it
+    predates them.
+
+    Raises FileNotFoundError if there is no snapshot.
+    """
+    algo = RecommendationAlgorithm.instantiate_algorithm(algo_name)
+    shortname = algo.get_shortname()
+    try:
+        return model_registry.get(
+            get_snapshot_path(shortname, os.path.basename(
+                EmbeddingSnapshot.get_path('', shortname))),
+            lambda path: EmbeddingSnapshot.load(resolve_snapshot_path(path)))
+    except FileNotFoundError:
+        return model_registry.derive(get_algo_backup(algo_name), 'embeddings',
+                                     EmbeddingSnapshot.from_algo)
+
+
+def get_item_index(shortname):
+    """
+    Get the index of the item vectors written by `fit_algo` next to the
+    snapshot of an algorithm, e.g. `get_item_index(algo.get_shortname())`.
+
+    Raises FileNotFoundError if there is no index.
+    """
+    return model_registry.get(
+        get_snapshot_path(shortname, os.path.basename(
+            InvertedFileIndex.get_path('', shortname))),
+        lambda path: InvertedFileIndex.load(resolve_snapshot_path(path)))
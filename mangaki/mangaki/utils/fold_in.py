@@ -0,0 +1,194 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from zero.als import MangakiALS
+from zero.svd import MangakiSVD
+
+from mangaki.utils.model_registry import model_registry
+
+
+FOLD_IN_CACHE_SIZE = 10000
+# Bound on the number of ratings (real or padding) solved for at once
+MAX_PADDED_ENTRIES = 1000000
+
+
+class FoldInCache:
+    """
+    LRU cache of the parameters `(mean, feat)` fitted for a user outside of
+    the training set, keyed by `(user_id, snapshot version, ratings version)`.
+
+    A new snapshot or a new rating of the user changes the key, so entries
+    never have to be invalidated: stale ones are just evicted eventually.
+    """
+    def __init__(self, maxsize=FOLD_IN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            parameters = self._entries.get(key)
+            if parameters is not None:
+                self._entries.move_to_end(key)
+            return parameters
+
+    def set(self, key, parameters):
+        with self._lock:
+            self._entries[key] = parameters
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+fold_in_cache = FoldInCache()
+
+
+def fit_user(algo, user_id, ratings_version, encoded_work_ids, ratings,
+             cache=fold_in_cache):
+    """
+    `algo.fit_single_user`, reusing the parameters fitted for the same user
+    and ratings version on the same snapshot.
+
+    `ratings_version` has to be read before the ratings themselves, so that
+    parameters are never stored under a newer version than their ratings.
+    Anonymous users (`user_id` None) and algorithms that were not loaded
+    through the model registry are not cached.
+
+    The returned parameters are shared: they must not be modified in place.
+    """
+    algo_version = model_registry.version(algo)
+    if user_id is None or ratings_version is None or algo_version is None:
+        return algo.fit_single_user(encoded_work_ids, ratings)
+    key = (user_id, algo_version, ratings_version)
+    parameters = cache.get(key)
+    if parameters is None:
+        parameters = algo.fit_single_user(encoded_work_ids, ratings)
+        cache.set(key, parameters)
+    return parameters
+
+
+def get_ridge_fold_in(algo):
+    """
+    Item factors `V` and regularization `lambda_` of the algorithms whose
+    `fit_single_user` is the ridge regression of the centered ratings of a
+    user on `V[:, rated_works]`, with penalty `lambda_ * nb_ratings`.
+
+    Returns None for any other algorithm.
+    """
+    fit_single_user = type(algo).fit_single_user
+    if fit_single_user is MangakiALS.fit_single_user:
+        return algo.VT, algo.lambda_
+    if fit_single_user is MangakiSVD.fit_single_user:
+        return algo.sigma[:, None] * algo.VT[:len(algo.sigma)], 0.1
+    return None
+
+
+def solve_ridge_batch(V, indptr, indices, targets, lambda_):
+    """
+    Solve one ridge regression per row of a CSR block: row `i` regresses
+    `targets[indptr[i]:indptr[i + 1]]` on the columns
+    `V[:, indices[indptr[i]:indptr[i + 1]]]`, with penalty `lambda_ * n_i`
+    where `n_i >= 1` is its number of entries. Returns one solution per row.
+
+    Rows of similar lengths are stacked and solved at once, in batches that
+    bound the size of the zero-padded tensors.
+    """
+    nb_components = V.shape[0]
+    lengths = np.diff(indptr)
+    solutions = np.empty((len(lengths), nb_components))
+    order = np.argsort(lengths, kind='stable')
+    start = 0
+    while start < len(order):
+        # Rows are sorted by length, so the last one of a batch is the longest
+        end = start + 1
+        while (end < len(order) and
+               (end + 1 - start) * lengths[order[end]] <= MAX_PADDED_ENTRIES):
+            end += 1
+        rows = order[start:end]
+        nb_entries = lengths[rows]
+        # Vectors of the entries of row i in stacked[i], padded with zeros
+        batch_rows = np.repeat(np.arange(len(rows)), nb_entries)
+        ranks = np.arange(nb_entries.sum()) - np.repeat(
+            np.cumsum(nb_entries) - nb_entries, nb_entries)
+        positions = np.repeat(indptr[rows], nb_entries) + ranks
+        stacked = np.zeros((len(rows), nb_entries.max(), nb_components))
+        stacked[batch_rows, ranks] = V[:, indices[positions]].T
+        padded_targets = np.zeros((len(rows), nb_entries.max(), 1))
+        padded_targets[batch_rows, ranks, 0] = targets[positions]
+
+        stacked_t = stacked.transpose(0, 2, 1)
+        gram = stacked_t @ stacked
+        gram += (lambda_ * nb_entries)[:, None, None] * np.eye(nb_components)
+        solutions[rows] = np.linalg.solve(gram, stacked_t @ padded_targets)[:, :, 0]
+        start = end
+    return solutions
+
+
+def fit_users_batch(algo, indptr, encoded_work_ids, ratings):
+    """
+    Parameters `(mean, feat)` of several users outside of the training set,
+    given as a CSR block: the ratings of user `i` are
+    `ratings[indptr[i]:indptr[i + 1]]`, for the works
+    `encoded_work_ids[indptr[i]:indptr[i + 1]]`. Every user needs at least
+    one rating.
+
+    For ALS and SVD, the normal equations are stacked and solved together.
+    Other algorithms fall back to one `fit_single_user` per user.
+    """
+    indptr = np.asarray(indptr, dtype=np.int64)
+    encoded_work_ids = np.asarray(encoded_work_ids, dtype=np.int64)
+    ratings = np.asarray(ratings, dtype=np.float64)
+    if len(indptr) <= 1:
+        return []
+    ridge = get_ridge_fold_in(algo)
+    if ridge is None:
+        return [algo.fit_single_user(encoded_work_ids[start:end],
+                                     ratings[start:end].copy())
+                for start, end in zip(indptr[:-1], indptr[1:])]
+
+    V, lambda_ = ridge
+    nb_ratings = np.diff(indptr)
+    means = np.add.reduceat(ratings, indptr[:-1]) / nb_ratings
+    centered = ratings - np.repeat(means, nb_ratings)
+    feats = solve_ridge_batch(V, indptr, encoded_work_ids, centered, lambda_)
+    return list(zip(means, feats))
+
+
+def fit_users(algo, user_ids, ratings_versions, indptr, encoded_work_ids,
+              ratings, cache=fold_in_cache):
+    """
+    `fit_users_batch` for known users, reusing their cached parameters like
+    `fit_user` does and only solving for the others.
+    """
+    algo_version = model_registry.version(algo)
+    keys = [None if algo_version is None or ratings_versions.get(user_id) is None
+            else (user_id, algo_version, ratings_versions[user_id])
+            for user_id in user_ids]
+    parameters = [None if key is None else cache.get(key) for key in keys]
+    missing = [i for i, user_parameters in enumerate(parameters)
+               if user_parameters is None]
+    if missing:
+        indptr = np.asarray(indptr)
+        starts, ends = indptr[missing], indptr[np.array(missing) + 1]
+        positions = np.concatenate([np.arange(start, end)
+                                    for start, end in zip(starts, ends)])
+        fitted = fit_users_batch(
+            algo, np.concatenate(([0], np.cumsum(ends - starts))),
+            np.asarray(encoded_work_ids)[positions],
+            np.asarray(ratings)[positions])
+        for i, user_parameters in zip(missing, fitted):
+            parameters[i] = user_parameters
+            if keys[i] is not None:
+                cache.set(keys[i], user_parameters)
+    return parameters
@@ -0,0 +1,147 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import logging
+from datetime import timezone
+
+import numpy as np
+from zero.als import MangakiALS
+from zero.dataset import RATED_BY_AT_LEAST, AnonymizedData, Dataset
+
+from mangaki.models import Rating
+from mangaki.utils.dataset import CHOICES
+from mangaki.utils.fit_algo import load_algo_backup, save_fitted_algo
+from mangaki.utils.fold_in import solve_ridge_batch
+from mangaki.utils.ratings import load_training_ratings
+
+NB_INCREMENTAL_SWEEPS = 3
+
+logger = logging.getLogger(__name__)
+
+
+def extend_encoding(encode, decode, ids):
+    """
+    Codes of `ids` according to `encode`, giving the unknown ids the next
+    free codes. Both dicts are updated in place.
+    """
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    codes = np.array([encode.get(id_, -1) for id_ in unique_ids.tolist()],
+                     dtype=np.int64)
+    is_new = codes < 0
+    codes[is_new] = len(encode) + np.arange(is_new.sum())
+    for id_, code in zip(unique_ids[is_new].tolist(), codes[is_new].tolist()):
+        encode[id_] = code
+        decode[code] = id_
+    return codes[inverse]
+
+
+def solve_rows(V, rows, entry_rows, entry_columns, targets, lambda_):
+    """
+    `solve_ridge_batch` for the sorted `rows` of a matrix given in coordinate
+    format. Each of those rows needs at least one entry.
+    """
+    selected = np.isin(entry_rows, rows)
+    positions = np.searchsorted(rows, entry_rows[selected])
+    order = np.argsort(positions, kind='stable')
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(positions,
+                                                        minlength=len(rows)))))
+    return solve_ridge_batch(V, indptr, entry_columns[selected][order],
+                             targets[selected][order], lambda_)
+
+
+def fit_algo_incremental(algo_name, nb_sweeps=NB_INCREMENTAL_SWEEPS,
+                         output_csv=False):
+    """
+    Update the latest ALS snapshot with the current ratings, instead of
+    training from scratch. New users and works get the next codes, and only
+    the users whose ratings changed since the snapshot (new, edited or
+    deleted ratings) and the works they rated are fit again, starting from
+    the factors of the snapshot.
+
+    Raises FileNotFoundError if there is no snapshot to start from, and
+    ValueError for other algorithms than ALS.
+    """
+    algo = load_algo_backup(algo_name)
+    if not isinstance(algo, MangakiALS):
+        raise ValueError('"{}" cannot be trained incrementally.'.format(algo_name))
+    previous = algo.dataset
+    training_ratings = load_training_ratings()
+    rating_arrays = training_ratings.rating_arrays
+    trained_on = previous.datetime.astimezone(timezone.utc)
+    edited_user_ids = set(Rating.objects.filter(date__gt=trained_on)
+                          .values_list('user_id', flat=True).distinct())
+    previous_versions = getattr(previous, 'ratings_versions', None)
+    if previous_versions is not None:  # Catch deleted ratings of any user
+        edited_user_ids.update(
+            user_id for user_id, version in training_ratings.ratings_versions.items()
+            if version is not None and version != previous_versions.get(user_id, 0))
+
+    dataset = Dataset()
+    dataset.datetime = training_ratings.datetime
+    dataset.ratings_versions = training_ratings.ratings_versions
+    dataset.encode_user = dict(previous.encode_user)
+    dataset.decode_user = dict(previous.decode_user)
+    dataset.encode_work = dict(previous.encode_work)
+    dataset.decode_work = dict(previous.decode_work)
+    users = extend_encoding(dataset.encode_user, dataset.decode_user,
+                            rating_arrays.user_ids)
+    works = extend_encoding(dataset.encode_work, dataset.decode_work,
+                            rating_arrays.work_ids)
+    nb_users, nb_works = len(dataset.encode_user), len(dataset.encode_work)
+    ratings = rating_arrays.ratings.astype(np.float64)
+    nb_user_ratings = np.bincount(users, minlength=nb_users)
+    nb_work_ratings = np.bincount(works, minlength=nb_works)
+    dataset.interesting_works = {
+        dataset.decode_work[work] for work in
+        np.flatnonzero(nb_work_ratings >= RATED_BY_AT_LEAST).tolist()}
+    dataset.anonymized = AnonymizedData(
+        X=np.column_stack((users, works)).astype(np.int32),
+        y=rating_arrays.ratings,
+        y_text=np.array(CHOICES)[rating_arrays.choices] if output_csv else None,
+        nb_users=nb_users,
+        nb_works=nb_works
+    )
+
+    is_changed = np.zeros(nb_users, dtype=bool)
+    is_changed[algo.nb_users:] = True
+    if previous.anonymized is not None:  # Catch deleted ratings
+        previous_nb_ratings = np.bincount(previous.anonymized.X[:, 0],
+                                          minlength=algo.nb_users)
+        is_changed[:algo.nb_users] |= (previous_nb_ratings !=
+                                       nb_user_ratings[:algo.nb_users])
+    else:
+        is_changed[:] = True
+    is_changed[[dataset.encode_user[user_id] for user_id in edited_user_ids
+                if user_id in dataset.encode_user]] = True
+    changed_users = np.flatnonzero(is_changed & (nb_user_ratings > 0))
+    is_touched = np.zeros(nb_works, dtype=bool)
+    is_touched[algo.nb_works:] = True
+    is_touched[works[np.isin(users, changed_users)]] = True
+    touched_works = np.flatnonzero(is_touched & (nb_work_ratings > 0))
+    logger.info('Fitting %d users and %d works again, out of %d and %d',
+                len(changed_users), len(touched_works), nb_users, nb_works)
+
+    # New users and works start from zero and get fit by the first sweep
+    U = np.zeros((nb_users, algo.nb_components))
+    U[:algo.nb_users] = algo.U
+    VT = np.zeros((algo.nb_components, nb_works))
+    VT[:, :algo.nb_works] = algo.VT
+    means = np.zeros(nb_users)
+    means[:algo.nb_users] = algo.means
+    sums = np.bincount(users, weights=ratings, minlength=nb_users)
+    means[changed_users] = sums[changed_users] / nb_user_ratings[changed_users]
+    centered = ratings - means[users]
+    for _ in range(nb_sweeps):
+        U[changed_users] = solve_rows(VT, changed_users, users, works,
+                                      centered, algo.lambda_)
+        VT[:, touched_works] = solve_rows(U.T, touched_works, works, users,
+                                          centered, algo.lambda_).T
+
+    algo.set_parameters(nb_users, nb_works)
+    algo.U = U
+    algo.VT = VT
+    algo.means = means
+    algo.M = None
+    algo.dataset = dataset
+    save_fitted_algo(algo_name, algo, output_csv)
+    return algo
@@ -0,0 +1,149 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import os
+
+import numpy as np
+
+from mangaki.utils.embeddings import (build_lookup, load_arrays, lookup_ids,
+                                      save_arrays)
+
+
+INDEX_SUFFIX = '.ivf'
+NB_KMEANS_ITERATIONS = 10
+MAX_TRAINING_POINTS_PER_CLUSTER = 256
+
+
+def augment_for_inner_product(vectors):
+    """
+    Append one coordinate to the item vectors so that they all have the same
+    norm: the nearest neighbors of the query `[q, 0]` are then the items of
+    largest inner product with `q` (Bachrach et al., 2014).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    squared_norms = (vectors ** 2).sum(axis=1)
+    extra = np.sqrt(np.maximum(squared_norms.max(initial=0) - squared_norms, 0))
+    return np.column_stack((vectors, extra))
+
+
+def kmeans(points, nb_clusters, nb_iterations=NB_KMEANS_ITERATIONS, seed=0):
+    """
+    Lloyd's algorithm. Returns the centroids and the cluster of each point.
+    """
+    rng = np.random.RandomState(seed)
+    centroids = points[rng.choice(len(points), nb_clusters, replace=False)]
+    for _ in range(nb_iterations):
+        assignment = assign_clusters(points, centroids)
+        sums = np.column_stack([
+            np.bincount(assignment, weights=points[:, dim], minlength=nb_clusters)
+            for dim in range(points.shape[1])])
+        sizes = np.bincount(assignment, minlength=nb_clusters)
+        non_empty = sizes > 0  # Empty clusters keep their previous centroid
+        centroids[non_empty] = sums[non_empty] / sizes[non_empty, None]
+    return centroids, assign_clusters(points, centroids)
+
+
+def assign_clusters(points, centroids):
+    # argmin |x - c|^2 = argmax 2 x.c - |c|^2
+    scores = 2 * points @ centroids.T - (centroids ** 2).sum(axis=1)
+    return scores.argmax(axis=1)
+
+
+class InvertedFileIndex:
+    """
+    Approximate maximum inner product search over the item vectors of a
+    matrix factorization model.
+
+    Works are partitioned into clusters by k-means. A query only considers
+    the works of the clusters whose centroids have the largest inner product
+    with it, so that the exact scores are computed for a few candidates
+    instead of the whole catalogue.
+
+    The works of cluster `c` are `work_ids[offsets[c]:offsets[c + 1]]`.
+    """
+    ARRAYS = ('centroids', 'offsets', 'work_ids')
+
+    def __init__(self, centroids, offsets, work_ids):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.work_ids = work_ids
+        self.work_lookup = build_lookup(work_ids)
+
+    @classmethod
+    def build(cls, item_vectors, work_ids, nb_clusters=None, seed=0):
+        """
+        Cluster the item vectors, by default into about sqrt(N) clusters.
+        """
+        points = augment_for_inner_product(item_vectors)
+        if nb_clusters is None:
+            nb_clusters = int(np.sqrt(len(points)))
+        nb_clusters = max(1, min(nb_clusters, len(points)))
+        rng = np.random.RandomState(seed)
+        nb_training_points = MAX_TRAINING_POINTS_PER_CLUSTER * nb_clusters
+        if len(points) > nb_training_points:
+            training_points = points[rng.choice(len(points), nb_training_points,
+                                                replace=False)]
+        else:
+            training_points = points
+        centroids, _ = kmeans(training_points, nb_clusters, seed=seed)
+        assignment = assign_clusters(points, centroids)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.zeros(nb_clusters + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=nb_clusters),
+                  out=offsets[1:])
+        return cls(
+            # The extra coordinate of the query is 0
+            centroids=np.ascontiguousarray(centroids[:, :-1]),
+            offsets=offsets,
+            work_ids=np.asarray(work_ids, dtype=np.int32)[order]
+        )
+
+    @staticmethod
+    def get_path(folder, shortname):
+        return os.path.join(folder, shortname + INDEX_SUFFIX)
+
+    def save(self, path):
+        save_arrays(path, {name: getattr(self, name) for name in self.ARRAYS})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        This function raises FileNotFoundError if no index exists.
+        """
+        return cls(**load_arrays(path, cls.ARRAYS, mmap_mode))
+
+    @property
+    def nb_clusters(self):
+        return len(self.centroids)
+
+    def search(self, query, nb_candidates, allowed_work_ids=None,
+               nb_probes=None):
+        """
+        Work ids that are likely to have the largest inner product with
+        `query`, taken from at least `nb_probes` clusters (by default a twentieth
+        of them) and as many as needed to get `nb_candidates` works.
+
+        Only the works in `allowed_work_ids` are returned if it is given. The
+        candidates are not sorted: their exact scores have to be computed.
+        """
+        if nb_probes is None:
+            nb_probes = max(1, self.nb_clusters // 20)
+        if allowed_work_ids is None:
+            is_allowed = np.ones(len(self.work_ids), dtype=bool)
+        else:
+            is_allowed = np.zeros(len(self.work_ids), dtype=bool)
+            positions = lookup_ids(self.work_lookup, allowed_work_ids)
+            is_allowed[positions[positions >= 0]] = True
+        nb_allowed = np.concatenate(([0], np.cumsum(is_allowed)))
+        cluster_sizes = nb_allowed[self.offsets[1:]] - nb_allowed[self.offsets[:-1]]
+
+        probed = np.argsort(-(self.centroids @ np.asarray(query,
+                                                          dtype=np.float32)))
+        nb_probed = int(np.searchsorted(np.cumsum(cluster_sizes[probed]),
+                                        nb_candidates)) + 1
+        probed = probed[:max(nb_probes, nb_probed)]
+        positions = np.concatenate(
+            [np.arange(self.offsets[cluster], self.offsets[cluster + 1])
+             for cluster in probed] or [np.array([], dtype=np.int64)])
+        positions = positions[is_allowed[positions]]
+        return np.asarray(self.work_ids[positions])
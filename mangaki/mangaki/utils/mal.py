@@ -24,6 +24,7 @@ from django.utils.functional import cached_property
 from django.db import transaction
 
 from mangaki.models import Work, Rating, Category, WorkTitle, ExtLanguage, Reference
+from mangaki.utils.ratings import ratings_changed
 
 import logging
 
@@ -589,5 +590,6 @@ def import_mal(mal_username: str, mangaki_username: str,
         ratings.append(rating)
 
     Rating.objects.bulk_create(ratings)
+    ratings_changed([user.id])
 
     return len(ratings), fails
@@ -0,0 +1,122 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import logging
+import os
+import threading
+import weakref
+from collections import namedtuple
+
+
+logger = logging.getLogger(__name__)
+
+SnapshotStamp = namedtuple('SnapshotStamp', 'inode mtime_ns size')
+RegisteredModel = namedtuple('RegisteredModel', 'model stamp')
+
+
+def get_snapshot_stamp(path):
+    """
+    Identify the current version of a snapshot on disk.
+
+    Raises FileNotFoundError if the snapshot does not exist.
+    """
+    stat = os.stat(path)
+    return SnapshotStamp(stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of the models loaded from their snapshots.
+
+    A model is kept in memory as long as its snapshot on disk keeps the same
+    inode, mtime and size. As soon as `fit_algo` writes a new snapshot, the
+    next lookup loads it and swaps it in place of the previous one, while the
+    requests still holding the old model can finish with it.
+
+    Derived structures (lookup arrays, masks, indexes) can be attached to a
+    loaded model through `derive`: they are dropped together with the model.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path_locks = {}
+        self._models = {}
+        self._derived = weakref.WeakKeyDictionary()
+
+    def _get_path_lock(self, path):
+        with self._lock:
+            return self._path_locks.setdefault(path, threading.Lock())
+
+    def get(self, path, loader):
+        """
+        Return the model stored at `path`, loading it with `loader(path)` if it
+        is not in memory yet or if its snapshot changed since.
+
+        Raises FileNotFoundError if there is no snapshot at `path`.
+        """
+        path = os.path.abspath(path)
+        try:
+            stamp = get_snapshot_stamp(path)
+        except FileNotFoundError:
+            self.invalidate(path)
+            raise
+        registered = self._models.get(path)
+        if registered is not None and registered.stamp == stamp:
+            return registered.model
+
+        # Only one thread per snapshot pays the loading cost, others wait.
+        with self._get_path_lock(path):
+            registered = self._models.get(path)
+            stamp = get_snapshot_stamp(path)
+            if registered is None or registered.stamp != stamp:
+                logger.info('Loading snapshot %s', path)
+                registered = RegisteredModel(loader(path), stamp)
+                self._models[path] = registered
+        return registered.model
+
+    def register(self, path, model):
+        """
+        Make a model that was just saved to `path` available without reloading
+        it from its snapshot.
+        """
+        path = os.path.abspath(path)
+        with self._get_path_lock(path):
+            self._models[path] = RegisteredModel(model,
+                                                 get_snapshot_stamp(path))
+
+    def invalidate(self, path=None):
+        """
+        Forget the model loaded from `path`, or every model if `path` is None.
+        """
+        with self._lock:
+            if path is None:
+                self._models.clear()
+            else:
+                self._models.pop(os.path.abspath(path), None)
+
+    def version(self, model):
+        """
+        Return a string identifying the snapshot a registered model was
+        loaded from, or None if the model is not registered.
+        """
+        for registered in list(self._models.values()):
+            if registered.model is model:
+                stamp = registered.stamp
+                return '{:x}-{:x}-{:x}'.format(stamp.inode, stamp.mtime_ns,
+                                               stamp.size)
+        return None
+
+    def derive(self, model, name, factory):
+        """
+        Return the structure `name` derived from `model`, computing it with
+        `factory(model)` the first time.
+        """
+        with self._lock:
+            derived = self._derived.setdefault(model, {})
+            if name in derived:
+                return derived[name]
+        value = factory(model)
+        with self._lock:
+            return self._derived.setdefault(model, {}).setdefault(name, value)
+
+
+model_registry = ModelRegistry()
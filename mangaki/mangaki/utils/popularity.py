@@ -0,0 +1,97 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import threading
+import time
+
+import numpy as np
+from zero.dataset import RATED_BY_AT_LEAST, Dataset
+from zero.recommendation_algorithm import RecommendationAlgorithm
+
+from mangaki.models import Work
+
+# Weight of the average rating of the catalogue in the score of each work,
+# as a number of ratings
+POPULARITY_PRIOR_WEIGHT = 10
+# The counters of the works are only updated by the `ranking` command
+POPULARITY_MAX_AGE = 10 * 60  # In seconds
+
+
+class PopularityAlgo(RecommendationAlgorithm):
+    """
+    Stand-in for a trained algorithm while no snapshot exists: every user
+    gets the works of best average rating, damped towards the average rating
+    of the catalogue, according to the `nb_ratings` and `sum_ratings`
+    counters of the works.
+
+    It needs no training, so it can be served as soon as the site starts.
+    """
+    def __init__(self, work_ids, scores):
+        super().__init__()
+        self.dataset = Dataset()
+        self.dataset.decode_work = dict(enumerate(work_ids))
+        self.dataset.encode_work = {work_id: encoded_work_id
+                                    for encoded_work_id, work_id
+                                    in enumerate(work_ids)}
+        self.dataset.interesting_works = set(work_ids)
+        self.set_parameters(0, len(work_ids))
+        self.scores = np.asarray(scores, dtype=np.float64)
+
+    @classmethod
+    def build(cls):
+        rows = list(Work.objects.filter(nb_ratings__gte=RATED_BY_AT_LEAST)
+                                .values_list('id', 'nb_ratings', 'sum_ratings'))
+        if not rows:
+            return cls([], [])
+        work_ids, nb_ratings, sum_ratings = map(np.array, zip(*rows))
+        prior = sum_ratings.sum() / nb_ratings.sum()
+        scores = ((sum_ratings + POPULARITY_PRIOR_WEIGHT * prior) /
+                  (nb_ratings + POPULARITY_PRIOR_WEIGHT))
+        return cls(work_ids.tolist(), scores)
+
+    def set_parameters(self, nb_users, nb_works):
+        self.nb_users = nb_users
+        self.nb_works = nb_works
+
+    def fit(self, X, y):
+        pass
+
+    def fit_single_user(self, rated_works, ratings):
+        # Everybody gets the same recommendations
+        return 0., None
+
+    def predict_single_user(self, work_ids, user_parameters):
+        return self.scores[work_ids]
+
+    def predict(self, X):
+        return self.scores[np.asarray(X)[:, 1]]
+
+    def get_shortname(self):
+        return 'popularity'
+
+
+class PopularityCache:
+    """
+    The popularity algorithm of this process, built again once it is older
+    than `max_age` seconds.
+    """
+    def __init__(self, max_age=POPULARITY_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._algo = None
+        self._built_at = None
+
+    def get(self):
+        with self._lock:
+            if (self._algo is None or
+                    time.monotonic() - self._built_at > self.max_age):
+                self._algo = PopularityAlgo.build()
+                self._built_at = time.monotonic()
+            return self._algo
+
+    def clear(self):
+        with self._lock:
+            self._algo = None
+
+
+popularity_cache = PopularityCache()
@@ -8,7 +8,7 @@ from django.contrib.auth.models import User
 from django.utils import timezone
 
 from mangaki.models import Rating, Work, Category, Recommendation
-from mangaki.utils.fit_algo import get_algo_backup
+from mangaki.utils.fit_algo import get_algo_backup, get_embeddings
 from mangaki.utils.ratings import get_anonymous_ratings
 from mangaki.utils.recommendations import get_personalized_ranking
 
@@ -79,7 +79,10 @@ def build_profile_compare_function(algo_name: Optional[str],
     if algo_name is not None:
         try:
             work_ids = [rating.work_id for rating in ratings]
-            algo = get_algo_backup(algo_name)
+            try:
+                algo = get_embeddings(algo_name)
+            except ValueError:  # Not a matrix factorization
+                algo = get_algo_backup(algo_name)
             best_pos = get_personalized_ranking(algo, user.id, work_ids)
             ranking = defaultdict(lambda: len(ratings))
             for rank, pos in enumerate(best_pos):
@@ -1,16 +1,85 @@
 # SPDX-FileCopyrightText: 2014, Mangaki Authors
 # SPDX-License-Identifier: AGPL-3.0-only
 
+from datetime import datetime
+
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.models import Q
 from mangaki.models import Rating
+from mangaki.utils.dataset import TRIPLETS_CHUNK_SIZE, RatingArrays, TrainingRatings
+from mangaki.utils.versions import bump_version, get_versions
+
+RATINGS_VERSION_KEY = 'ratings:{user_id}:version'
 
 
 def pk_from_object_or_pk(obj):
     return getattr(obj, 'pk', obj)
 
 
+def bump_ratings_version(user_id):
+    """
+    Record that the ratings of a user changed, so that everything computed
+    from the previous ones (e.g. fold-in parameters) is no longer used.
+    """
+    bump_version(RATINGS_VERSION_KEY.format(user_id=user_id))
+
+
+def ratings_changed(user_ids):
+    """
+    Bump the ratings version of users once the current transaction commits
+    (right away outside of one). Every write to the `Rating` table, creation,
+    update or deletion, goes through this.
+    """
+    user_ids = set(user_ids)
+
+    def bump_versions():
+        for user_id in user_ids:
+            bump_ratings_version(user_id)
+    transaction.on_commit(bump_versions)
+
+
+def get_ratings_versions(user_ids):
+    """
+    Current version of the ratings of each user, as a dict user_id -> int,
+    or user_id -> None without Redis (see `get_versions`).
+
+    Read the versions before the ratings: a version can be bumped between
+    both reads, not the other way around.
+    """
+    user_ids = list(user_ids)
+    versions = get_versions(RATINGS_VERSION_KEY.format(user_id=user_id)
+                            for user_id in user_ids)
+    if versions is None:
+        return dict.fromkeys(user_ids)
+    return dict(zip(user_ids, versions))
+
+
+def load_rating_arrays(queryset=None, chunk_size=TRIPLETS_CHUNK_SIZE):
+    """
+    Stream ratings (by default, all of them) through a server-side cursor
+    into `RatingArrays`, without materializing one tuple per rating.
+    """
+    if queryset is None:
+        queryset = Rating.objects.all()
+    triplets = queryset.values_list('user_id', 'work_id', 'choice')
+    return RatingArrays.from_triplets(triplets.iterator(chunk_size=chunk_size),
+                                      size_hint=queryset.count())
+
+
+def load_training_ratings(queryset=None):
+    """
+    `load_rating_arrays`, along with what a snapshot trained on them needs to
+    tell the ratings it has not seen: the time and the ratings version of
+    every user, both taken before reading the ratings, so that a rating
+    written meanwhile is never counted as seen.
+    """
+    started = datetime.now()  # Naive local time, like Dataset.datetime
+    ratings_versions = get_ratings_versions(User.objects.values_list('id', flat=True))
+    return TrainingRatings(load_rating_arrays(queryset), started, ratings_versions)
+
+
 def has_anonymous_ratings(session) -> bool:
     """
     Look if the session contains any ratings.
@@ -102,14 +171,21 @@ def friend_ratings(request, friend_ids=None):
         ratings -- A dictionary mapping Work primary keys to their rating
             string ('like', 'dislike', etc.)
     """
+    return user_friend_ratings(request.user, friend_ids)
+
+
+def user_friend_ratings(user, friend_ids=None):
+    """
+    `friend_ratings` outside of a request, for the friends of `user`.
+    """
     qs = Rating.objects.all()
     if friend_ids is not None:
         qs = qs.filter(user__in=friend_ids)
     return qs.filter(
-        user__in=request.user.profile.friends.values_list('id',
-                                                          flat=True)).filter(
+        user__in=user.profile.friends.values_list('id',
+                                                  flat=True)).filter(
         Q(user__profile__is_shared=True) |
-        Q(user__profile__friends__id=request.user.id)).values_list(
+        Q(user__profile__friends__id=user.id)).values_list(
         'user_id', 'work_id', 'choice')
 
 
@@ -159,11 +235,10 @@ def current_user_set_toggle_rating(request, work, choice):
     user = request.user
     if user.is_authenticated:
         deleted, _ = user.rating_set.filter(work=work, choice=choice).delete()
-        if deleted:
-            return None
-        else:
+        if not deleted:
             user.rating_set.update_or_create(work=work, defaults={'choice': choice})
-            return choice
+        ratings_changed([user.id])
+        return None if deleted else choice
     else:
         request.session.modified = True
         # Recall that keys in the session dictionary are always converted to
@@ -1,127 +1,370 @@
 # SPDX-FileCopyrightText: 2014, Mangaki Authors
 # SPDX-License-Identifier: AGPL-3.0-only
 
+import hashlib
+import json
+import logging
+from collections import defaultdict, namedtuple
+from datetime import timezone
+
 import numpy as np
-import pandas as pd
 from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
 from django.utils.translation import gettext_lazy as _
 
-from mangaki.models import Rating, Work
-from mangaki.utils.fit_algo import fit_algo, get_algo_backup
+from mangaki.choices import WORK_CATEGORY_CHOICES
+from mangaki.models import Category, PrecomputedRecommendation, Rating, Work
+from mangaki.utils.catalogue import VISIBLE, CatalogueMasks, get_works_version
+from mangaki.utils.embeddings import EmbeddingSnapshot, build_lookup, lookup_ids
+from mangaki.utils.fit_algo import (fit_algo, get_algo_backup, get_embeddings,
+                                    get_item_index)
+from mangaki.utils.fold_in import fit_user, fit_users
+from mangaki.utils.model_registry import model_registry
+from mangaki.utils.popularity import PopularityAlgo, popularity_cache
 from mangaki.utils.chrono import Chrono
-from mangaki.utils.ratings import current_user_ratings, friend_ratings
+from mangaki.utils.ratings import (current_user_ratings, get_ratings_versions,
+                                   load_training_ratings, user_friend_ratings)
+from mangaki.utils.snapshots import CorruptSnapshotError
 from mangaki.utils.values import rating_values
 from mangaki.utils.crypto import HomomorphicEncryption
 
 NB_RECO = 10
+NB_PRECOMPUTED_RECO = 50
+PRECOMPUTE_BATCH_SIZE = 500
+# Above this many candidate works, only the ones retrieved by the item index
+# are scored
+ANN_MIN_CANDIDATES = 20000
+NB_ANN_CANDIDATES = 100 * NB_RECO
 CHRONO_ENABLED = True
+RECO_CACHE_TIMEOUT = 60 * 60  # In seconds
 
+logger = logging.getLogger(__name__)
 
-def get_algo_backup_or_fit_svd(request, algo_name):
+
+def find_algo_backup(algo_name):
+    """
+    `get_algo_backup`, or None if the algorithm has no snapshot or its
+    current snapshot is corrupt.
+    """
     try:
-        algo = get_algo_backup(algo_name)
+        return get_algo_backup(algo_name)
     except FileNotFoundError:
+        return None
+    except CorruptSnapshotError:
+        logger.exception('Snapshot of %s is corrupt, not serving it', algo_name)
+        return None
+
+
+def get_algo_backup_or_fit_svd(request, algo_name):
+    algo = find_algo_backup(algo_name)
+    if algo is None:
         # Fallback to SVD
-        messages.warning(request,
-            _('We switched to SVD as recommendation algorithm, '
-              'as {algo_name} was not available.').format(
-                algo_name=algo_name.upper()))
-        triplets = list(
-            Rating.objects.values_list('user_id', 'work_id', 'choice'))
-        algo_name = 'svd'
-        try:
-            algo = get_algo_backup('svd')
-        except FileNotFoundError:
-            algo = fit_algo('svd', triplets)
+        algo = find_algo_backup('svd')
+        if algo is None:
+            algo = get_fallback_algo()
+        # Not in a background task, and the popularity is not worth a message
+        if request is not None and not isinstance(algo, PopularityAlgo):
+            messages.warning(request,
+                _('We switched to SVD as recommendation algorithm, '
+                  'as {algo_name} was not available.').format(
+                    algo_name=algo_name.upper()))
     return algo
 
 
+def get_fallback_algo():
+    """
+    Serve the popularity algorithm while the SVD is fitted in the background.
+    Without a background worker, the SVD is fitted right away instead.
+    """
+    from mangaki.tasks import start_fallback_svd_fit  # Avoid a circular import
+    if start_fallback_svd_fit():
+        return popularity_cache.get()
+    return fit_algo('svd', load_training_ratings())
+
+
+def get_work_lookup(algo):
+    """
+    Array mapping each work id to its encoded index in the algorithm (-1 if
+    unknown), computed once per loaded snapshot.
+    """
+    def build_work_lookup(algo):
+        decode_work = algo.dataset.decode_work
+        return build_lookup(np.fromiter(
+            (decode_work[encoded_work_id]
+             for encoded_work_id in range(len(decode_work))),
+            dtype=np.int64, count=len(decode_work)))
+    return model_registry.derive(algo, 'work_lookup', build_work_lookup)
+
+
+def encode_work_ids(algo, work_ids):
+    """
+    Vectorized `algo.dataset.encode_work`, raising KeyError for unknown works.
+    """
+    encoded_work_ids = lookup_ids(get_work_lookup(algo), work_ids)
+    if (encoded_work_ids < 0).any():
+        raise KeyError(np.asarray(work_ids)[encoded_work_ids < 0][0])
+    return encoded_work_ids
+
+
+def get_work_ids(algo):
+    """
+    Array of the work ids of the algorithm, indexed by their encoded index.
+    """
+    def build_work_ids(algo):
+        decode_work = algo.dataset.decode_work
+        return np.fromiter((decode_work[encoded_work_id]
+                            for encoded_work_id in range(len(decode_work))),
+                           dtype=np.int64, count=len(decode_work))
+    return model_registry.derive(algo, 'work_ids', build_work_ids)
+
+
+def get_works_mask(algo, work_ids):
+    """
+    Boolean mask over the encoded works of the algorithm, True for the given
+    work ids. Unknown works are ignored.
+    """
+    mask = np.zeros(len(get_work_ids(algo)), dtype=bool)
+    encoded_work_ids = lookup_ids(get_work_lookup(algo), list(work_ids))
+    mask[encoded_work_ids[encoded_work_ids >= 0]] = True
+    return mask
+
+
+def get_interesting_mask(algo):
+    """
+    Mask of the works of the algorithm that are worth recommending. It is
+    shared by the requests: copy it before modifying it.
+    """
+    return model_registry.derive(
+        algo, 'interesting_mask',
+        lambda algo: get_works_mask(algo, algo.dataset.interesting_works))
+
+
+def get_catalogue(algo):
+    """
+    Category and visibility masks over the encoded works of the algorithm,
+    kept up to date with the works table.
+    """
+    return model_registry.derive(
+        algo, 'catalogue', lambda algo: CatalogueMasks(get_work_ids(algo)))
+
+
+def encode_ratings(algo, work_ids, choices):
+    """
+    Encoded indices and values of the ratings of the works known by the
+    algorithm, and the mask of those ratings.
+    """
+    encoded_work_ids = lookup_ids(get_work_lookup(algo), work_ids)
+    known = encoded_work_ids >= 0
+    # Few distinct choices: map them instead of every rating
+    distinct_choices, choice_ids = np.unique(np.asarray(choices, dtype=str),
+                                             return_inverse=True)
+    values = np.array([rating_values[choice] for choice in distinct_choices],
+                      dtype=np.float64)
+    return encoded_work_ids[known], values[choice_ids][known], known
+
+
+GroupRatings = namedtuple('GroupRatings', [
+    'my_encoded_work_ids', 'my_ratings',
+    # Ratings of the other members, as a CSR block of one row per user
+    'other_ids', 'indptr', 'encoded_work_ids', 'ratings',
+    # Mask over the encoded works already rated by the group
+    'is_rated'])
+
+
+def get_group_ratings(algo, my_ratings, triplets, merge_type=None):
+    """
+    Arrays of the ratings of a group, restricted to the works of the
+    algorithm.
+
+    `my_ratings` maps work ids to choices, `triplets` are the
+    `(user_id, work_id, choice)` of the other members: the ones without
+    ratings of known works are ignored. Works rated by everyone are
+    considered already rated by the group, or by anyone if `merge_type` is
+    'union', or by myself only if it is 'mine'.
+    """
+    nb_works = len(get_work_ids(algo))
+    my_encoded_work_ids, my_values, _ = encode_ratings(
+        algo, np.fromiter(my_ratings.keys(), dtype=np.int64,
+                          count=len(my_ratings)),
+        list(my_ratings.values()))
+
+    triplets = list(triplets)
+    if triplets:
+        user_ids, work_ids, choices = zip(*triplets)
+        user_ids = np.array(user_ids, dtype=np.int64)
+        encoded_work_ids, values, known = encode_ratings(
+            algo, work_ids, choices)
+        user_ids = user_ids[known]
+        order = np.argsort(user_ids, kind='stable')
+        user_ids = user_ids[order]
+        encoded_work_ids = encoded_work_ids[order]
+        values = values[order]
+    else:
+        user_ids = np.array([], dtype=np.int64)
+        encoded_work_ids = np.array([], dtype=np.int32)
+        values = np.array([], dtype=np.float64)
+    other_ids, nb_ratings = np.unique(user_ids, return_counts=True)
+
+    # A work is rated at most once per user
+    nb_raters = np.bincount(my_encoded_work_ids, minlength=nb_works)
+    if merge_type != 'mine':
+        nb_raters += np.bincount(encoded_work_ids, minlength=nb_works)
+    if merge_type == 'union':
+        is_rated = nb_raters > 0
+    elif merge_type == 'mine':
+        is_rated = nb_raters == 1
+    else:
+        is_rated = nb_raters == 1 + len(other_ids)
+
+    return GroupRatings(
+        my_encoded_work_ids=my_encoded_work_ids,
+        my_ratings=my_values,
+        other_ids=other_ids.tolist(),
+        indptr=np.concatenate(([0], np.cumsum(nb_ratings))),
+        encoded_work_ids=encoded_work_ids,
+        ratings=values,
+        is_rated=is_rated)
+
+
+def get_top_positions(y_pred, limit=None):
+    """
+    Positions of the best predictions in decreasing order, up to `limit`.
+
+    :complexity: :math:`O(N + k \\log k)` when `limit` is :math:`k`
+    """
+    if limit is None or limit >= len(y_pred):
+        return y_pred.argsort()[::-1]
+    if limit <= 0:
+        return np.array([], dtype=np.int64)
+    pos_of_best = np.argpartition(-y_pred, limit - 1)[:limit]
+    return pos_of_best[np.argsort(-y_pred[pos_of_best], kind='stable')]
+
+
 def get_personalized_ranking(algo, user_id, work_ids, enc_rated_works=[],
                              ratings=[], limit=None):
-    if user_id in algo.dataset.encode_user:
-        encoded_user_id = algo.dataset.encode_user[user_id]
-        X_test = np.asarray([[encoded_user_id,
-                              algo.dataset.encode_work[work_id]]
-                             for work_id in work_ids])
-        y_pred = algo.predict(X_test)
+    """
+    Rank the given works for a user.
+
+    `algo` is either a recommendation algorithm or an EmbeddingSnapshot, in
+    which case the user has to be part of the snapshot.
+    """
+    if isinstance(algo, EmbeddingSnapshot):
+        y_pred = algo.predict_user(user_id, work_ids)
+    elif user_id in algo.dataset.encode_user:
+        if EmbeddingSnapshot.is_supported(algo):
+            # One matrix-vector product against the item factors
+            embeddings = model_registry.derive(algo, 'embeddings',
+                                               EmbeddingSnapshot.from_algo)
+            y_pred = embeddings.predict_user(user_id, work_ids)
+        else:
+            encoded_work_ids = encode_work_ids(algo, work_ids)
+            X_test = np.column_stack((
+                np.full(len(encoded_work_ids),
+                        algo.dataset.encode_user[user_id]),
+                encoded_work_ids))
+            y_pred = algo.predict(X_test)
     else:
         user_parameters = algo.fit_single_user(enc_rated_works, ratings)
-        encoded_work_ids = [algo.dataset.encode_work[work_id]
-                            for work_id in work_ids]
+        encoded_work_ids = encode_work_ids(algo, work_ids)
         y_pred = algo.predict_single_user(encoded_work_ids, user_parameters)
 
-    # Get top work indices in decreasing value
-    pos_of_best = y_pred.argsort()[::-1]
-    if limit is not None:
-        pos_of_best = pos_of_best[:limit]  # Up to some limit
-    return pos_of_best
+    # Get top work indices in decreasing value, up to some limit
+    return get_top_positions(np.asarray(y_pred), limit)
 
 
 def get_group_reco_algo(request, users_id=None, algo_name='als',
                         category='all', merge_type=None):
+    # Anonymous ratings only live in the session
+    anonymous_ratings = (current_user_ratings(request)
+                         if request.user.is_anonymous else None)
+    return get_group_reco(request.user, users_id, algo_name, category,
+                          merge_type, anonymous_ratings, request=request)
+
+
+def get_group_reco(user, users_id=None, algo_name='als', category='all',
+                   merge_type=None, anonymous_ratings=None, request=None):
+    """
+    Recommend works to `user` and the friends in `users_id`, outside of a
+    request if needed, e.g. in a background task. The ratings of an anonymous
+    user are given as `anonymous_ratings`; `request` is only used to show
+    messages.
+    """
     # others_id contain a group to recommend to
     others_id = users_id
-    if request.user.is_anonymous or users_id is None:
+    if user.is_anonymous or users_id is None:
         others_id = []
-    elif request.user.id in users_id:
+    elif user.id in users_id:
         others_id = [user_id for user_id in users_id
-                     if user_id != request.user.id]
+                     if user_id != user.id]
 
-    chrono = Chrono(is_enabled=CHRONO_ENABLED)
+    chrono = Chrono(is_enabled=CHRONO_ENABLED, algo=algo_name)
 
     algo = get_algo_backup_or_fit_svd(request, algo_name)
-    available_works = set(algo.dataset.encode_work.keys())
 
-    chrono.save('retrieve or fit %s' % algo.get_shortname())
+    chrono.save('retrieve or fit %s' % algo.get_shortname(),
+                stage='retrieve or fit')
+
+    if not user.is_anonymous and not others_id:
+        best_work_ids = get_precomputed_recommendations(
+            user, algo_name, algo, category)
+        if best_work_ids is not None:
+            # Drop the works hidden or moved to another category since they
+            # were precomputed, then keep the first ones that still exist
+            catalogue = get_catalogue(algo)
+            is_shown = catalogue.get(VISIBLE)
+            if category != 'all':
+                is_shown = is_shown & catalogue.get(category)
+            encoded_work_ids = lookup_ids(get_work_lookup(algo), best_work_ids)
+            encoded_work_ids = encoded_work_ids[encoded_work_ids >= 0]
+            data = get_ranked_works(get_work_ids(algo)[
+                encoded_work_ids[is_shown[encoded_work_ids]]].tolist())
+            data['work_ids'] = data['work_ids'][:NB_RECO]
+            chrono.save('get precomputed')
+            return data
+
+    # Versions are read before the ratings they stand for
+    if user.is_anonymous:
+        my_id = None
+        ratings_versions = {}
+        my_ratings = anonymous_ratings or {}
+    else:
+        my_id = user.id
+        ratings_versions = get_ratings_versions([my_id] + others_id)
+        my_ratings = dict(user.rating_set.values_list('work_id', 'choice'))
 
     # Building the training set
-    my_ratings = current_user_ratings(request)  # Myself
-    df_mine = pd.DataFrame(my_ratings.items(), columns=('work_id', 'choice')).query(
-        'work_id in @available_works')
-    df_mine['encoded_work_id'] = df_mine['work_id'].map(
-        algo.dataset.encode_work)
-    df_mine['rating'] = df_mine['choice'].map(rating_values)    
-
-    if not request.user.is_anonymous and others_id:
-        triplets = friend_ratings(request, others_id)
-        df = pd.DataFrame(triplets, columns=['user_id', 'work_id', 'choice']).query(
-            'work_id in @available_works')
-        df['encoded_work_id'] = df['work_id'].map(
-            algo.dataset.encode_work)
-        df['rating'] = df['choice'].map(rating_values)
-        # Ignore those with no ratings in the group
-        participating_other_ids = df['user_id'].unique().tolist()
+    if not user.is_anonymous and others_id:
+        triplets = list(user_friend_ratings(user, others_id))
     else:
-        participating_other_ids = []
-    group_length = 1 + len(participating_other_ids)
+        triplets = []
 
-    # What is already rated for a group? intersection or union of seen works?
-    # Here we default with intersection
-    merge_function = \
-        set.union if merge_type == 'union' else set.intersection
-    sets_of_rated_works = [set(df_mine['work_id'])]
-    if merge_type != 'mine':
-        for user_id in participating_other_ids:
-            sets_of_rated_works.append(set(
-                df.query('user_id == @user_id')['work_id'].tolist()))
-    already_rated_works = list(merge_function(*sets_of_rated_works))
+    cache_key = get_reco_cache_key(algo, category, merge_type, my_ratings,
+                                   triplets)
+    best_work_ids = None if cache_key is None else cache.get(cache_key)
+    if best_work_ids is not None:
+        chrono.save('get cached')
+        return get_ranked_works(best_work_ids)
+
+    group = get_group_ratings(algo, my_ratings, triplets, merge_type)
+    participating_other_ids = group.other_ids
+    group_length = 1 + len(participating_other_ids)
 
     chrono.save('get rated works')
 
-    category_filter = algo.dataset.interesting_works
+    catalogue = get_catalogue(algo)
+    is_candidate = (get_interesting_mask(algo) & catalogue.get(VISIBLE) &
+                    ~group.is_rated)
     if category != 'all':
-        category_filter &= set(Work.objects.filter(category__slug=category)
-                                           .values_list('id', flat=True))
-
-    filtered_works = list((algo.dataset.interesting_works & category_filter) -
-                          set(already_rated_works))
-    chrono.save('remove already rated, left {:d}'.format(len(filtered_works)))
+        is_candidate &= catalogue.get(category)
+    encoded_work_ids = np.flatnonzero(is_candidate)
+    filtered_works = get_work_ids(algo)[encoded_work_ids]
+    chrono.save('remove already rated, left {:d}'.format(len(filtered_works)),
+                stage='remove already rated')
 
-    encoded_work_ids = [algo.dataset.encode_work[work_id]
-                        for work_id in filtered_works]
-
-    my_mean, my_feat = algo.fit_single_user(
-        df_mine['encoded_work_id'], df_mine['rating'])
+    my_mean, my_feat = fit_user(
+        algo, my_id, ratings_versions.get(my_id),
+        group.my_encoded_work_ids, group.my_ratings)
 
     if algo.get_shortname().startswith('svd') and participating_other_ids:
         he = HomomorphicEncryption(participating_other_ids, quantize_round=1,
@@ -133,13 +376,13 @@ def get_group_reco_algo(request, users_id=None, algo_name='als',
         is_encrypted = False
 
     embeddings = []
-    for user_id in participating_other_ids:
-        user_ratings = df.query("user_id == @user_id")
-        embeddings.append(transform(user_id,
-            algo.fit_single_user(
-                user_ratings['encoded_work_id'],
-                user_ratings['rating']
-            )))
+    if participating_other_ids:
+        others_parameters = fit_users(
+            algo, participating_other_ids, ratings_versions, group.indptr,
+            group.encoded_work_ids, group.ratings)
+        for user_id, parameters in zip(participating_other_ids,
+                                       others_parameters):
+            embeddings.append(transform(user_id, parameters))
 
     if is_encrypted:
         sum_means, sum_feats = he.decrypt_embeddings(embeddings)
@@ -148,19 +391,207 @@ def get_group_reco_algo(request, users_id=None, algo_name='als',
     else:
         group_parameters = [(my_mean, my_feat)] + embeddings
 
+    if len(filtered_works) >= ANN_MIN_CANDIDATES:
+        filtered_works, encoded_work_ids = retrieve_candidates(
+            algo, group_parameters, filtered_works, encoded_work_ids)
+        chrono.save('retrieve {:d} candidates'.format(len(filtered_works)),
+                    stage='retrieve candidates')
+
     pos_of_best = algo.recommend(user_ids=[],  # Anonymous & retrained
                                  extra_users_parameters=group_parameters,
                                  item_ids=encoded_work_ids,
                                  k=NB_RECO)['item_id']
-    best_work_ids = [filtered_works[pos] for pos in pos_of_best]
+    best_work_ids = filtered_works[pos_of_best].tolist()
+    if cache_key is not None:
+        cache.set(cache_key, best_work_ids, RECO_CACHE_TIMEOUT)
 
     chrono.save('compute every prediction')
 
+    data = get_ranked_works(best_work_ids)
+
+    chrono.save('get bulk')
+
+    return data
+
+
+def get_ranked_works(best_work_ids):
     works = Work.objects.in_bulk(best_work_ids)
     # Some of the works may have been deleted since the algo backup was created
     ranked_work_ids = [work_id for work_id in best_work_ids
                        if work_id in works]
+    return {'work_ids': ranked_work_ids, 'works': works}
 
-    chrono.save('get bulk')
 
-    return {'work_ids': ranked_work_ids, 'works': works}
+def get_reco_cache_key(algo, category, merge_type, my_ratings, triplets):
+    """
+    Cache key of the recommendations of a group, given the ratings of its
+    members: it changes with the snapshot of `algo` and the works version, so
+    that entries never have to be invalidated. Returns None if `algo` has no
+    snapshot or there is no works version.
+    """
+    algo_version = model_registry.version(algo)
+    works_version = get_works_version()
+    if algo_version is None or works_version is None:
+        return None
+    ratings_by_user = defaultdict(list)
+    for user_id, work_id, choice in triplets:
+        ratings_by_user[user_id].append((work_id, choice))
+    # Only the ratings of the others matter, not who they are
+    others_ratings = sorted(sorted(ratings) for ratings in ratings_by_user.values())
+    fingerprint = json.dumps([sorted(my_ratings.items()), others_ratings])
+    return 'reco:{}:{}:{}:{}:{}:{}'.format(
+        algo.get_shortname(), algo_version, works_version, category,
+        merge_type, hashlib.sha256(fingerprint.encode('utf8')).hexdigest())
+
+
+def serialize_reco_list(user, data, nb_reco):
+    """
+    The first `nb_reco` works recommended in `data`, as returned by
+    `get_group_reco`, along with the current ratings of `user`.
+    """
+    works = data['works']
+    work_ids = data['work_ids'][:nb_reco]
+    categories = dict(WORK_CATEGORY_CHOICES)
+    ratings = dict(Rating.objects.filter(user__pk=user.pk, work__id__in=[
+        works[work_id].id for work_id in work_ids
+    ]).values_list('work_id', 'choice'))
+    reco_list = []
+    for work_id in work_ids:
+        work = works[work_id]
+        reco_list.append({'id': work.id, 'title': work.title,
+                          'poster': work.ext_poster, 'synopsis': work.synopsis,
+                          'category_slug': work.category.slug,
+                          'category': str(categories[work.category.slug]),
+                          'rating': ratings.get(work.id, None)})
+    return reco_list
+
+
+def retrieve_candidates(algo, group_parameters, work_ids, encoded_work_ids,
+                        nb_candidates=NB_ANN_CANDIDATES):
+    """
+    Restrict the works to score for a group to the ones of largest inner
+    product with the mean of the group embeddings, according to the item
+    index of the snapshot. Averaged predictions are `mean + feat . VT`, so the
+    best works for the mean embedding are the best works for the group.
+
+    Returns the works unchanged if there is no index for this snapshot.
+    """
+    try:
+        item_index = get_item_index(algo.get_shortname())
+    except FileNotFoundError:
+        return work_ids, encoded_work_ids
+    query = np.mean([feat for _, feat in group_parameters], axis=0)
+    candidates = item_index.search(query, nb_candidates,
+                                   allowed_work_ids=work_ids)
+    # The index may predate the snapshot: ignore the works it does not know
+    encoded_candidates = lookup_ids(get_work_lookup(algo), candidates)
+    known = encoded_candidates >= 0
+    return candidates[known], encoded_candidates[known]
+
+
+def get_precomputed_recommendations(user, algo_name, algo, category):
+    """
+    Get the ranked work ids precomputed for a user by
+    `materialize_recommendations`, if they are still valid for the snapshot
+    of `algo` and the ratings of the user did not change since it was trained.
+
+    Returns None if there are no such recommendations.
+    """
+    algo_version = model_registry.version(algo)
+    if algo_version is None:
+        return None
+    precomputed = (PrecomputedRecommendation.objects
+                   .filter(user=user, algo_name=algo_name, category=category,
+                           algo_version=algo_version)
+                   .values_list('work_ids', flat=True)
+                   .first())
+    if precomputed is None:
+        return None
+    # The user embedding needs to be fit again if any rating changed since
+    # the ratings were read, including deleted ones
+    trained_versions = getattr(algo.dataset, 'ratings_versions', None)
+    ratings_version = get_ratings_versions([user.id])[user.id]
+    if (trained_versions is not None and ratings_version is not None and
+            ratings_version != trained_versions.get(user.id, 0)):
+        return None
+    # Naive datetime in local time, taken before reading the ratings by
+    # `load_training_ratings`; there are no versions without Redis
+    trained_on = algo.dataset.datetime.astimezone(timezone.utc)
+    if user.rating_set.filter(date__gt=trained_on).exists():
+        return None
+    return precomputed
+
+
+def get_top_positions_per_row(scores, limit):
+    """
+    Row-wise `get_top_positions` of a matrix, ignoring -inf scores.
+    """
+    nb_rows, nb_columns = scores.shape
+    if limit < nb_columns:
+        candidates = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+    else:
+        candidates = np.tile(np.arange(nb_columns), (nb_rows, 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+    return [row_candidates[row_order][np.isfinite(row_scores[row_order])]
+            for row_candidates, row_scores, row_order
+            in zip(candidates, candidate_scores, order)]
+
+
+def materialize_recommendations(algo_name, nb_works=NB_PRECOMPUTED_RECO,
+                                batch_size=PRECOMPUTE_BATCH_SIZE):
+    """
+    Store the best works of every user of the snapshot of `algo_name` and
+    every category, so that solo recommendations are a single indexed read.
+
+    Returns the number of users processed.
+    """
+    algo = get_algo_backup(algo_name)
+    embeddings = get_embeddings(algo_name)
+    algo_version = model_registry.version(algo)
+
+    work_ids = np.asarray(embeddings.work_ids)
+    # Masks over the encoded works of the embeddings
+    catalogue = CatalogueMasks(work_ids)
+    is_candidate = catalogue.get(VISIBLE) & np.isin(
+        work_ids, list(algo.dataset.interesting_works))
+    category_masks = {'all': is_candidate}
+    for slug in Category.objects.values_list('slug', flat=True):
+        category_masks[slug] = is_candidate & catalogue.get(slug)
+
+    user_ids = np.asarray(embeddings.user_ids)
+    for start in range(0, len(user_ids), batch_size):
+        encoded_user_ids = np.arange(start, min(start + batch_size,
+                                                len(user_ids)))
+        batch_user_ids = user_ids[encoded_user_ids].tolist()
+        scores = (embeddings.user_means[encoded_user_ids, None] +
+                  embeddings.user_vectors[encoded_user_ids] @
+                  embeddings.item_vectors.T)
+        # Do not recommend what was already rated
+        rated = np.array(Rating.objects.filter(user_id__in=batch_user_ids)
+                                       .values_list('user_id', 'work_id'),
+                         dtype=np.int64).reshape(-1, 2)
+        if len(rated):
+            rows = embeddings.user_lookup[rated[:, 0]] - start
+            columns = embeddings.encode_works(rated[:, 1])
+            known = columns >= 0
+            scores[rows[known], columns[known]] = -np.inf
+
+        precomputed = []
+        for category, mask in category_masks.items():
+            category_scores = np.where(mask, scores, -np.inf)
+            best = get_top_positions_per_row(category_scores, nb_works)
+            for user_id, positions in zip(batch_user_ids, best):
+                precomputed.append(PrecomputedRecommendation(
+                    user_id=user_id, algo_name=algo_name, category=category,
+                    work_ids=work_ids[positions].tolist(),
+                    algo_version=algo_version))
+        with transaction.atomic():
+            PrecomputedRecommendation.objects.filter(
+                algo_name=algo_name, user_id__in=batch_user_ids).delete()
+            PrecomputedRecommendation.objects.bulk_create(precomputed)
+
+    # Users that are no longer part of the snapshot
+    PrecomputedRecommendation.objects.filter(algo_name=algo_name).exclude(
+        algo_version=algo_version).delete()
+    return len(user_ids)
@@ -0,0 +1,217 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+"""
+Versioned snapshots of the recommendation algorithms.
+
+Each fit is written to a new version folder,
+`{ML_SNAPSHOT_ROOT}/{shortname}/versions/{version}/`, holding the pickled
+algorithm, the files derived from it (embeddings, item index) and a manifest
+with their checksums. Only once the folder is complete, the `current` symlink
+of the algorithm is switched to it with an atomic rename: readers either see
+the previous version or the new one, never a partially written one. Older
+versions are kept for rollbacks, up to `ML_SNAPSHOT_RETENTION`.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+MANIFEST_FILENAME = 'manifest.json'
+CURRENT_VERSION = 'current'
+VERSIONS_FOLDER = 'versions'
+STAGING_PREFIX = '.staging-'
+STAGING_MAX_AGE = 24 * 60 * 60  # Folders left behind by crashed fits
+HASH_CHUNK_SIZE = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+
+class CorruptSnapshotError(Exception):
+    """
+    A snapshot file does not match the checksum recorded in its manifest.
+    """
+
+
+def get_algo_folder(shortname):
+    return os.path.join(settings.ML_SNAPSHOT_ROOT, shortname)
+
+
+def get_versions_folder(shortname):
+    return os.path.join(get_algo_folder(shortname), VERSIONS_FOLDER)
+
+
+def get_snapshot_path(shortname, filename):
+    """
+    Path of a file of the current version of an algorithm, which stays the
+    same across versions. Snapshots written before versioning are found at
+    the root of `ML_SNAPSHOT_ROOT`.
+    """
+    current = os.path.join(get_algo_folder(shortname), CURRENT_VERSION)
+    if os.path.lexists(current):
+        return os.path.join(current, filename)
+    return os.path.join(settings.ML_SNAPSHOT_ROOT, filename)
+
+
+def get_current_version(shortname):
+    """
+    Return the current version of an algorithm, or None if it has none.
+    """
+    try:
+        target = os.readlink(os.path.join(get_algo_folder(shortname),
+                                          CURRENT_VERSION))
+    except FileNotFoundError:
+        return None
+    return os.path.basename(target)
+
+
+def list_versions(shortname):
+    """
+    Complete versions of an algorithm, from the oldest to the latest.
+    """
+    try:
+        names = os.listdir(get_versions_folder(shortname))
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if not name.startswith(STAGING_PREFIX))
+
+
+def read_manifest(shortname, version):
+    """
+    This function raises FileNotFoundError if the version does not exist.
+    """
+    with open(os.path.join(get_versions_folder(shortname), version,
+                           MANIFEST_FILENAME)) as f:
+        return json.load(f)
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def list_files(folder):
+    """
+    Paths of the files under `folder`, relative to it.
+    """
+    return sorted(os.path.relpath(os.path.join(root, filename), folder)
+                  for root, _, filenames in os.walk(folder)
+                  for filename in filenames)
+
+
+def publish_snapshot(shortname, write_files, **metadata):
+    """
+    Create a new version of an algorithm and make it current. `write_files`
+    is called with the folder of the version, which is published if it
+    returns. The manifest records the checksums of the files, along with
+    `metadata`, e.g. the algorithm name and rating count.
+
+    Returns the manifest.
+    """
+    versions_folder = get_versions_folder(shortname)
+    os.makedirs(versions_folder, exist_ok=True)
+    created_at = datetime.now(timezone.utc)
+    # Sorting versions by name sorts them by date
+    version = '{:%Y%m%dT%H%M%S%fZ}-{}'.format(created_at, uuid.uuid4().hex[:8])
+    staging_folder = os.path.join(versions_folder, STAGING_PREFIX + version)
+    os.mkdir(staging_folder)
+    try:
+        write_files(staging_folder)
+        manifest = dict(metadata, shortname=shortname, version=version,
+                        created_at=created_at.isoformat(),
+                        sha256={path: file_sha256(os.path.join(staging_folder, path))
+                                for path in list_files(staging_folder)})
+        with open(os.path.join(staging_folder, MANIFEST_FILENAME), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(staging_folder, os.path.join(versions_folder, version))
+    except BaseException:
+        shutil.rmtree(staging_folder, ignore_errors=True)
+        raise
+
+    activate_version(shortname, version)
+    prune_versions(shortname)
+    return manifest
+
+
+def activate_version(shortname, version):
+    """
+    Atomically point the `current` symlink of an algorithm to one of its
+    versions, e.g. to roll back. Processes reload it on their next lookup.
+
+    Raises FileNotFoundError if the version does not exist.
+    """
+    folder = get_algo_folder(shortname)
+    target = os.path.join(VERSIONS_FOLDER, version)  # Relative, like the folder
+    if not os.path.isfile(os.path.join(folder, target, MANIFEST_FILENAME)):
+        raise FileNotFoundError('No version {} of {}'.format(version, shortname))
+    link = os.path.join(folder, '.{}-{}'.format(CURRENT_VERSION, uuid.uuid4().hex))
+    os.symlink(target, link)
+    os.replace(link, os.path.join(folder, CURRENT_VERSION))
+    logger.info('Version %s of %s is now current', version, shortname)
+
+
+def prune_versions(shortname, retention=None):
+    """
+    Delete the versions of an algorithm beyond the `retention` latest ones
+    (by default `ML_SNAPSHOT_RETENTION`), except the current one, as well as
+    stale staging folders. Processes that mapped the files of a deleted
+    version keep reading them.
+    """
+    if retention is None:
+        retention = settings.ML_SNAPSHOT_RETENTION
+    versions_folder = get_versions_folder(shortname)
+    current = get_current_version(shortname)
+    versions = list_versions(shortname)
+    for version in versions[:max(len(versions) - max(retention, 1), 0)]:
+        if version != current:
+            shutil.rmtree(os.path.join(versions_folder, version), ignore_errors=True)
+    for name in os.listdir(versions_folder):
+        path = os.path.join(versions_folder, name)
+        if (name.startswith(STAGING_PREFIX) and
+                time.time() - os.path.getmtime(path) > STAGING_MAX_AGE):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def resolve_snapshot_path(path):
+    """
+    Resolve a path given by `get_snapshot_path` to the version it currently
+    belongs to, and check the file (or every file of the folder) against the
+    manifest of that version. Loading from the returned path is not affected
+    by a new version becoming current meanwhile. Snapshots written before
+    versioning have no manifest and are not checked.
+
+    Raises FileNotFoundError if the file does not exist, and
+    CorruptSnapshotError if it does not match its manifest.
+    """
+    path = os.path.realpath(path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    version_folder = os.path.dirname(path)
+    try:
+        with open(os.path.join(version_folder, MANIFEST_FILENAME)) as f:
+            checksums = json.load(f)['sha256']
+    except FileNotFoundError:
+        return path
+
+    relative_path = os.path.basename(path)
+    if os.path.isdir(path):
+        relative_paths = [os.path.join(relative_path, filename)
+                          for filename in list_files(path)]
+    else:
+        relative_paths = [relative_path]
+    for relative_path in relative_paths:
+        if (checksums.get(relative_path) !=
+                file_sha256(os.path.join(version_folder, relative_path))):
+            raise CorruptSnapshotError('{} does not match the manifest of {}'.format(
+                relative_path, version_folder))
+    return path
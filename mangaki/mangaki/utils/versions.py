@@ -0,0 +1,39 @@
+# SPDX-FileCopyrightText: 2014, Mangaki Authors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import redis
+
+
+def _get_redis():
+    # Imported here, as mangaki.tasks depends on the modules using this one
+    from mangaki.tasks import redis_pool
+    if redis_pool is None:
+        return None
+    return redis.StrictRedis(connection_pool=redis_pool)
+
+
+def bump_version(key):
+    """
+    Increment the version counter stored at `key` in Redis, shared by every
+    process. Without Redis, there is nothing to increment.
+    """
+    r = _get_redis()
+    if r is not None:
+        r.incr(key)
+
+
+def get_versions(keys):
+    """
+    Current value of several version counters, as a list of ints (0 for the
+    counters that were never bumped).
+
+    Returns None without Redis: a version bumped by another process could
+    not be seen, so nothing should be cached under these versions.
+    """
+    keys = list(keys)
+    r = _get_redis()
+    if r is None:
+        return None
+    if not keys:
+        return []
+    return [int(version or 0) for version in r.mget(keys)]
@@ -1,8 +1,14 @@
 # SPDX-FileCopyrightText: 2014, Mangaki Authors
 # SPDX-License-Identifier: AGPL-3.0-only
 
-from collections import Counter
 import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
 from sklearn import manifold
 import pandas as pd
 import numpy as np
@@ -10,43 +16,210 @@ import requests
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import User
+from mangaki.utils.embeddings import build_lookup, lookup_ids
 from mangaki.utils.values import rating_values
 
+NB_LAYOUT_NEIGHBORS = 5
+# Below this fraction of works already on the map, it is laid out again
+MIN_PLACED_FRACTION = 0.5
+MAP_MAX_AGE = 60
+MAP_REQUEST_TIMEOUT = 10
 
-def dump_2d_embeddings(algo, filename, N=2025):
-    item_ids = Counter(algo.dataset.anonymized.X[:, 1])
-    encoded_most_popular_items = np.array(item_ids.most_common(N))[:, 0]
-    metaencoding = dict(zip(encoded_most_popular_items, range(N)))
+logger = logging.getLogger(__name__)
 
-    user_ids = Counter(algo.dataset.anonymized.X[:, 0])
-    encoded_most_active_users = np.array(user_ids.most_common(N))[:, 0]
 
-    NB_WORKS = len(encoded_most_popular_items)  # Currently equal to N
-    NB_USERS = len(encoded_most_active_users)
-    
-    M = algo.VT.T[encoded_most_popular_items]
+def load_2d_positions(filename):
+    """
+    Positions of the works on the map previously dumped to `VIZ_ROOT`, as a
+    dict {work_id: (x, y)}, empty if there is none.
+    """
+    try:
+        with open(f'{settings.VIZ_ROOT}/{filename}') as f:
+            points = json.load(f)['works']
+    except (FileNotFoundError, ValueError, KeyError):
+        return {}
+    return {point['work_id']: (point['x'], point['y']) for point in points}
+
+
+def interpolate_positions(vectors, positions, is_placed,
+                          nb_neighbors=NB_LAYOUT_NEIGHBORS):
+    """
+    Place the works that are not placed yet at the mean position of their
+    nearest placed neighbors in embedding space, weighted by inverse
+    distance. `positions` is updated in place.
+    """
+    placed = np.flatnonzero(is_placed)
+    new = np.flatnonzero(~is_placed)
+    if not len(new) or not len(placed):
+        return positions
+    vectors = np.asarray(vectors, dtype=np.float64)
+    placed_vectors = vectors[placed]
+    squared_distances = ((vectors[new] ** 2).sum(axis=1)[:, None]
+                         - 2 * vectors[new] @ placed_vectors.T
+                         + (placed_vectors ** 2).sum(axis=1))
+    distances = np.sqrt(np.maximum(squared_distances, 0))
+    nb_neighbors = min(nb_neighbors, len(placed))
+    neighbors = np.argpartition(distances, nb_neighbors - 1, axis=1)[:, :nb_neighbors]
+    weights = 1 / (np.take_along_axis(distances, neighbors, axis=1) + 1e-9)
+    positions[new] = ((weights[:, :, None] * positions[placed][neighbors]).sum(axis=1)
+                      / weights.sum(axis=1)[:, None])
+    return positions
+
+
+def dump_2d_embeddings(embeddings, filename, N=2025, relayout=False):
+    """
+    Project the embeddings of the N most popular works on a 2D map.
+
+    The works already on the previous map keep their positions and the new
+    ones are placed next to their neighbors, so that the map does not move
+    for users at each fit. The whole map is laid out with t-SNE only if
+    `relayout` is set, or if too few works were on the previous map.
+
+    :param embeddings: an EmbeddingSnapshot, possibly memory-mapped
+    """
+    popularity = np.asarray(embeddings.work_popularity)
+    # Stable sort, so that ties are broken by encoded work id
+    encoded_most_popular_items = np.argsort(-popularity, kind='stable')[:N]
+
+    M = embeddings.item_vectors[encoded_most_popular_items]
+    most_popular_work_ids = embeddings.work_ids[encoded_most_popular_items]
+
+    previous_positions = {} if relayout else load_2d_positions(filename)
+    is_placed = np.array([work_id in previous_positions
+                          for work_id in most_popular_work_ids.tolist()], dtype=bool)
+    if is_placed.sum() >= max(NB_LAYOUT_NEIGHBORS,
+                              MIN_PLACED_FRACTION * len(is_placed)):
+        X_2d = np.zeros((len(M), 2))
+        X_2d[is_placed] = [previous_positions[work_id] for work_id
+                           in most_popular_work_ids[is_placed].tolist()]
+        interpolate_positions(M, X_2d, is_placed)
+    else:
+        tsne = manifold.TSNE(n_components=2, init='pca', perplexity=5.0)
+        X_2d = tsne.fit_transform(M)
 
-    tsne = manifold.TSNE(n_components=2, init='pca', perplexity=5.0)
-    X_tsne = tsne.fit_transform(M)
-    
     Work = apps.get_model('mangaki', 'Work')
-    items = Work.objects.in_bulk([algo.dataset.decode_work[i]
-                                  for i in encoded_most_popular_items])
+    items = Work.objects.in_bulk(most_popular_work_ids.tolist())
     
     user_points = []
     work_points = []
-    for encoded_work_id, (x, y) in zip(encoded_most_popular_items,
-                                       X_tsne[:NB_WORKS].astype(np.float64)):
-        work_id = algo.dataset.decode_work[encoded_work_id]
+    for work_id, (x, y) in zip(most_popular_work_ids.tolist(),
+                               X_2d.astype(np.float64)):
         work_points.append({'work_id': work_id,
                             'title': items[work_id].title,
                             'poster': items[work_id].poster_url,
                             'x': x, 'y': y})
-    
-    with open(f'{settings.VIZ_ROOT}/{filename}', 'w') as f:
-        f.write(json.dumps({'works': work_points, 'users': user_points}))
+
+    # Written aside then moved in place, so that readers never see a partial map
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{filename}.', dir=settings.VIZ_ROOT)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps({'works': work_points, 'users': user_points}))
+        os.chmod(tmp_path, 0o644)  # Served as is, unlike the 0600 of mkstemp
+        os.replace(tmp_path, f'{settings.VIZ_ROOT}/{filename}')
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class MapPositions(namedtuple('MapPositions', 'work_ids positions lookup')):
+    """
+    Positions of the works on a map: `positions[i]` is the (x, y) of the work
+    `work_ids[i]`, and `lookup` maps work ids to `i` (see `build_lookup`).
+    """
+    @classmethod
+    def from_points(cls, points):
+        works = points['works']
+        work_ids = np.array([work['work_id'] for work in works], dtype=np.int64)
+        positions = np.array([(work['x'], work['y']) for work in works],
+                             dtype=np.float64).reshape(-1, 2)
+        return cls(work_ids, positions, build_lookup(work_ids))
+
+    def get_positions(self, work_ids):
+        """
+        Positions of the given works and whether each of them is on the map;
+        the works that are not get NaN.
+        """
+        indices = lookup_ids(self.lookup, work_ids)
+        is_known = indices >= 0
+        positions = np.full((len(indices), 2), np.nan)
+        positions[is_known] = self.positions[indices[is_known]]
+        return positions, is_known
+
+
+# The stamp is (mtime, size) for a local file, (ETag, Last-Modified) otherwise
+MapEntry = namedtuple('MapEntry', 'map_positions stamp checked_at')
+
+
+class MapCache:
+    """
+    The maps of this process. A map dumped to `VIZ_ROOT` on this machine is
+    read from there and read again when the file changes. Otherwise, it is
+    downloaded from `VIZ_URL`, and checked with a conditional request once it
+    is older than `max_age` seconds.
+    """
+    def __init__(self, max_age=MAP_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, algo_name):
+        filename = f'points-{algo_name}.json'
+        path = f'{settings.VIZ_ROOT}/{filename}'
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return self._get_remote(f'{settings.VIZ_URL}/{filename}')
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(path)
+        if entry is None or entry.stamp != stamp:
+            try:
+                with open(path) as f:
+                    points = json.load(f)
+            except ValueError:
+                if entry is None:
+                    raise
+                logger.warning('Unreadable map %s, keeping the previous one', path)
+                return entry.map_positions
+            entry = MapEntry(MapPositions.from_points(points), stamp, None)
+            with self._lock:
+                self._entries[path] = entry
+        return entry.map_positions
+
+    def _get_remote(self, url):
+        entry = self._entries.get(url)
+        if entry is not None and time.monotonic() - entry.checked_at < self.max_age:
+            return entry.map_positions
+
+        headers = {}
+        if entry is not None:
+            etag, last_modified = entry.stamp
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        r = requests.get(url, headers=headers, timeout=MAP_REQUEST_TIMEOUT)
+        if entry is not None and r.status_code == 304:  # Not Modified
+            entry = entry._replace(checked_at=time.monotonic())
+        else:
+            r.raise_for_status()
+            entry = MapEntry(MapPositions.from_points(r.json()),
+                             (r.headers.get('ETag'), r.headers.get('Last-Modified')),
+                             time.monotonic())
+        with self._lock:
+            self._entries[url] = entry
+        return entry.map_positions
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+map_cache = MapCache()
 
 
 def get_2d_embeddings(algo_name):
-    r = requests.get(f'{settings.VIZ_URL}/points-{algo_name}.json')
-    return r.json()
+    """
+    Get the positions of the works on the map of an algorithm, as
+    `MapPositions`.
+    """
+    return map_cache.get(algo_name)
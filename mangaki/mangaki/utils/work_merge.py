@@ -3,6 +3,7 @@
 
 from typing import List
 
+from django.db import transaction
 from django.db.models import Max, Case, When, Value, IntegerField
 from django.utils import timezone
 
@@ -19,6 +20,8 @@ from mangaki.models import (
     WorkTitle,
     Work
 )
+from mangaki.utils.catalogue import bump_works_version
+from mangaki.utils.ratings import ratings_changed
 
 
 def is_param_null(param):
@@ -82,6 +85,8 @@ class WorkClusterMergeHandler:
         self.redirect_staff()
         self.redirect_related_objects()
         self.merge_references()
+        # Works were redirected through an update, without signals
+        transaction.on_commit(bump_works_version)
 
     def redirect_ratings(self):
         # Get all IDs of considered ratings
@@ -100,6 +105,7 @@ class WorkClusterMergeHandler:
             kept_rating_ids.append(get_id_of_rating[(user_id, date)])
         Rating.objects.filter(work__in=self.works_to_merge).exclude(id__in=kept_rating_ids).delete()
         Rating.objects.filter(id__in=kept_rating_ids).update(work_id=self.target_work.id)
+        ratings_changed(user_id for user_id, _ in get_id_of_rating)
 
     def redirect_staff(self):
         target_work_staff = set()
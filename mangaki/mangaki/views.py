@@ -11,6 +11,7 @@ from urllib.parse import urlencode
 import allauth.account.views
 
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
@@ -39,14 +40,13 @@ from django.views.generic.list import ListView
 from markdown import markdown
 from natsort import natsorted
 
-from mangaki.choices import (TOP_CATEGORY_CHOICES, WORK_CATEGORY_CHOICES,
-                             SORT_MODE_CHOICES)
+from mangaki.choices import TOP_CATEGORY_CHOICES, SORT_MODE_CHOICES
 from mangaki.forms import SuggestionForm
 from mangaki.mixins import AjaxableResponseMixin, JSONResponseMixin
 from mangaki.models import (Artist, Category, FAQTheme, Page, Pairing, Profile, Ranking, Rating,
                             Recommendation, Staff, Suggestion, Evidence, Top, Trope, Work, WorkCluster)
 from mangaki.utils.mal import client
-from mangaki.tasks import import_mal, get_current_mal_import, redis_pool
+from mangaki.tasks import import_mal, get_current_mal_import, redis_pool, start_group_reco
 from mangaki.utils.profile import (
     get_profile_ratings,
     build_profile_compare_function,
@@ -55,7 +55,8 @@ from mangaki.utils.profile import (
 from mangaki.utils.ratings import (clear_anonymous_ratings, current_user_rating, current_user_ratings,
                                    current_user_set_toggle_rating, get_anonymous_ratings)
 from mangaki.utils.tokens import compute_token, NEWS_SALT
-from mangaki.utils.recommendations import get_group_reco_algo
+from mangaki.utils.chrono import latency_recorder
+from mangaki.utils.recommendations import get_group_reco_algo, serialize_reco_list
 from irl.models import Partner
 
 
@@ -789,7 +790,6 @@ def get_works(request, category):
 
 
 def get_reco_algo_list(request, algo_name, category, merge_type=None):
-    reco_list = []
     NB_RECO = 8
     if request.user.is_authenticated:
         group_reco = request.session.setdefault(
@@ -803,30 +803,30 @@ def get_reco_algo_list(request, algo_name, category, merge_type=None):
             request.user.profile.friends.filter(username__in=group_reco)
                                         .values_list('id')
         )
+        if request.GET.get('async') and friend_ids and redis_pool:
+            # Heavy group requests are computed in the background and polled
+            task_id = start_group_reco(request.user, friend_ids, algo_name,
+                                       category, merge_type, NB_RECO)
+            return HttpResponse(json.dumps({'task_id': task_id}), status=202,
+                                content_type='application/json')
         data = get_group_reco_algo(request, friend_ids, algo_name, category,
                                    merge_type)
     else:
         data = get_group_reco_algo(request, None, algo_name, category)
-    works = data['works']
-    categories = dict(WORK_CATEGORY_CHOICES)
-    ratings_bulk = Rating.objects.filter(user__pk=request.user.pk) \
-                                 .filter(work__id__in=[
-                                     works[work_id].id
-                                     for work_id in data['work_ids'][:NB_RECO]
-                                 ])
-    ratings = dict()
-    for rating in ratings_bulk:
-        ratings[rating.work.id] = rating.choice
-    for work_id in data['work_ids'][:NB_RECO]:
-        work = works[work_id]
-        reco_list.append({'id': work.id, 'title': work.title,
-                          'poster': work.ext_poster, 'synopsis': work.synopsis,
-                          'category_slug': work.category.slug,
-                          'category': str(categories[work.category.slug]),
-                          'rating': ratings.get(work.id, None)})
+    reco_list = serialize_reco_list(request.user, data, NB_RECO)
     return HttpResponse(json.dumps(reco_list), content_type='application/json')
 
 
+@staff_member_required
+def metrics(request):
+    """
+    Latencies of the instrumented stages of this process, to be scraped by
+    Prometheus.
+    """
+    return HttpResponse(latency_recorder.export_prometheus(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def remove_all_anon_ratings(request):
     if request.method == 'POST':
         clear_anonymous_ratings(request.session)